@@ -1,20 +1,377 @@
-from flask import Flask, request, abort, jsonify
+import logging
+import os
+from datetime import datetime
+from flask import Flask, Response, request, abort, jsonify
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-from models import setup_db, Movie, Actor
+from sqlalchemy import tuple_
+from sqlalchemy.exc import IntegrityError
+from werkzeug.exceptions import HTTPException
+from werkzeug.middleware.proxy_fix import ProxyFix
+from models import (
+    setup_db, db, env_flag, is_unique_violation, pool_stats, Movie, Actor)
+from auth import auth
 from auth.auth import requires_auth, AuthError
+from pagination import paginate
+from search import actor_filters, movie_filters
+from stats import actor_stats, movie_stats
+from replicas import read_replica, reads_primary, served_by_primary
+from cache import create_backend, read_cache
+from export import export_response
+from json_provider import create_json_provider
+from commands import register_commands
+from compression import compress_response
+from health import Readiness
+import metrics
+from ratelimit import client_key, limiter, parse_limits
+from ratelimit import configure_from as configure_limiter
+from http_cache import (
+    DEFAULT_CACHE_CONTROL, apply_cache_control, collection_validators,
+    is_conditional, not_modified, resource_validators, set_validators)
+
+logger = logging.getLogger(__name__)
 
 QUESTIONS_PER_PAGE = 10
+MAX_BATCH_SIZE = 1000
+BATCH_CHUNK_SIZE = 500
+
+MOVIE_FIELDS = (Movie.id, Movie.title, Movie.release_year)
+ACTOR_FIELDS = (Actor.id, Actor.movie_id, Actor.name, Actor.age, Actor.gender)
+
+error_handlers = {
+    404: 'Resource not found',
+    422: 'Unprocessable entity',
+    400: 'Bad request',
+    500: 'Internal server error',
+    409: 'Conflict with existing resource',
+    429: 'Too many requests'
+}
+
+
+def get_includes(allowed):
+    include = request.args.get('include', '')
+    includes = {name for name in include.split(',') if name}
+    if not includes <= allowed:
+        abort(400)
+    return includes
+
+
+def get_fields(fields):
+    """Narrow fields to the request's ?fields=a,b; id is always kept."""
+    requested = request.args.get('fields', None)
+    if requested is None:
+        return fields
+    names = {name for name in requested.split(',') if name}
+    if not names <= {field.key for field in fields}:
+        abort(400)
+    return tuple(
+        field for field in fields if field.key in names or field.key == 'id')
+
+
+def with_columns(fields, *required):
+    keys = {field.key for field in fields}
+    return tuple(fields) + tuple(
+        column for column in required if column.key not in keys)
+
+
+def row_dict(row, fields):
+    return {field.key: value for field, value in zip(fields, row)}
+
+
+def embed_actors(movies):
+    by_id = {}
+    for movie in movies:
+        movie['actors'] = by_id[movie['id']] = []
+    if not by_id:
+        return
+    actors = db.session.query(*ACTOR_FIELDS).filter(
+        Actor.movie_id.in_(list(by_id))).order_by(Actor.id)
+    for row in actors:
+        by_id[row.movie_id].append(row_dict(row, ACTOR_FIELDS))
+
+
+def join_movie(query):
+    return query.join(Movie, Actor.movie_id == Movie.id).add_columns(
+        Movie.title, Movie.release_year)
+
+
+def embedded_movie(row):
+    return {'id': row.movie_id, 'title': row.title,
+            'release_year': row.release_year}
+
+
+def load_movies_page(include_actors, fields=MOVIE_FIELDS, filters=()):
+    # List pages select plain column tuples: no ORM objects, identity map
+    # or format() calls on the hot path.
+    rows, meta = paginate(
+        db.session.query(*fields).filter(*filters), Movie, QUESTIONS_PER_PAGE)
+    movies = [row_dict(row, fields) for row in rows]
+    if include_actors:
+        embed_actors(movies)
+    return {
+        'movies': movies,
+        **meta
+    }
+
+
+def load_actors_page(include_movie, fields=ACTOR_FIELDS, filters=()):
+    if include_movie:
+        query = join_movie(
+            db.session.query(*with_columns(fields, Actor.movie_id)))
+    else:
+        query = db.session.query(*fields)
+    rows, meta = paginate(query.filter(*filters), Actor, QUESTIONS_PER_PAGE)
+    actors = []
+    for row in rows:
+        actor = row_dict(row, fields)
+        if include_movie:
+            actor['movie'] = embedded_movie(row)
+        actors.append(actor)
+    return {
+        'actors': actors,
+        **meta
+    }
+
+
+def load_movie(movie_id, include_actors, fields=MOVIE_FIELDS):
+    row = db.session.query(*fields, Movie.version, Movie.updated_at).filter(
+        Movie.id == movie_id).one_or_none()
+    if row is None:
+        return None
+    movie = row_dict(row, fields)
+    if include_actors:
+        embed_actors([movie])
+    return {
+        'movie': movie,
+        'version': row.version,
+        'updated_at': row.updated_at.isoformat()
+    }
+
+
+def load_actor(actor_id, include_movie, fields=ACTOR_FIELDS):
+    columns = with_columns(fields, Actor.movie_id) if include_movie else fields
+    query = db.session.query(*columns, Actor.version, Actor.updated_at)
+    if include_movie:
+        query = join_movie(query)
+    row = query.filter(Actor.id == actor_id).one_or_none()
+    if row is None:
+        return None
+    actor = row_dict(row, fields)
+    if include_movie:
+        actor['movie'] = embedded_movie(row)
+    return {
+        'actor': actor,
+        'version': row.version,
+        'updated_at': row.updated_at.isoformat()
+    }
+
+
+def resource_ttl(app):
+    """TTL for /movies/<id> and /actors/<id> entries.
+
+    A shared backend's generations move for every worker, so its entries
+    keep the normal TTL. A per-process backend only sees its own worker's
+    writes, so there entries expire after READ_CACHE_RESOURCE_TTL.
+    """
+    return None if read_cache.shared else app.config['READ_CACHE_RESOURCE_TTL']
+
+
+def load_cached(namespaces, key, loader, ttl=None):
+    # A replica can lag behind a generation bump, so only primary reads fill
+    # the cache, and a client reading its own writes skips it entirely.
+    if reads_primary():
+        return loader()
+    return read_cache.get_or_load(namespaces, key, loader,
+                                  cacheable=served_by_primary, ttl=ttl)
+
+
+def get_batch_items(body, key):
+    items = body.get(key, None) if isinstance(body, dict) else None
+    if not isinstance(items, list) or not items or len(items) > MAX_BATCH_SIZE:
+        abort(400)
+    return items
+
+
+def item_error(index, error_code):
+    return {
+        'index': index,
+        'success': False,
+        'error': error_code,
+        'message': error_handlers[error_code]
+    }
+
+
+def chunked(items, size=BATCH_CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def commit_batch(staged, results, name):
+    """Write staged (index, stage) changes in a single transaction.
+
+    If the transaction fails, each item is retried on its own so that only
+    the offending items are reported as errors.
+    """
+    if not staged:
+        return
+    try:
+        objs = [(index, stage()) for index, stage in staged]
+        db.session.flush()
+        formatted = [(index, obj.format()) for index, obj in objs]
+        db.session.commit()
+    except Exception as e:
+        logger.warning('Batch commit of %d %s item(s) failed: %s',
+                       len(staged), name, e)
+        db.session.rollback()
+        if len(staged) == 1:
+            error_code = 409 if is_unique_violation(e) else 422
+            results[staged[0][0]] = item_error(staged[0][0], error_code)
+        else:
+            for item in staged:
+                commit_batch([item], results, name)
+        return
+    for index, data in formatted:
+        results[index] = {'index': index, 'success': True, name: data}
+
+
+def create_batch(model, items, key_columns, name):
+    results = [None] * len(items)
+    valid = []
+    for index, item in enumerate(items):
+        try:
+            valid.append((index, model.validate(item)))
+        except (ValueError, AttributeError):
+            results[index] = item_error(index, 422)
+
+    for chunk in chunked(valid):
+        keys = {tuple(fields[c.key] for c in key_columns) for _, fields in chunk}
+        existing = set(map(tuple, db.session.query(*key_columns).filter(
+            tuple_(*key_columns).in_(keys))))
+        staged = []
+        for index, fields in chunk:
+            key = tuple(fields[c.key] for c in key_columns)
+            if key in existing:
+                results[index] = item_error(index, 409)
+                continue
+            existing.add(key)
+            staged.append((index, lambda fields=fields: add_new(model(**fields))))
+        commit_batch(staged, results, name)
+    return results
+
+
+def update_batch(model, items, updatable, name):
+    results = [None] * len(items)
+    for chunk in chunked(list(enumerate(items))):
+        ids = [item.get('id') for _, item in chunk if isinstance(item, dict)]
+        found = {obj.id: obj for obj in model.query.filter(
+            model.id.in_([i for i in ids if isinstance(i, int)]))}
+        staged = []
+        for index, item in chunk:
+            if not isinstance(item, dict) or not isinstance(item.get('id'), int):
+                results[index] = item_error(index, 422)
+            elif item['id'] not in found:
+                results[index] = item_error(index, 404)
+            else:
+                staged.append((index, lambda obj=found[item['id']], item=item:
+                               apply_update(obj, item, updatable)))
+        commit_batch(staged, results, name)
+    return results
+
+
+def delete_batch(model, ids, name):
+    results = [None] * len(ids)
+    seen = set()
+    for chunk in chunked(list(enumerate(ids))):
+        found = {obj.id: obj for obj in model.query.filter(
+            model.id.in_([i for _, i in chunk if isinstance(i, int)]))}
+        staged = []
+        for index, obj_id in chunk:
+            if not isinstance(obj_id, int):
+                results[index] = item_error(index, 422)
+            elif obj_id not in found or obj_id in seen:
+                results[index] = item_error(index, 404)
+            else:
+                seen.add(obj_id)
+                staged.append((index, lambda obj=found[obj_id]: delete_obj(obj)))
+        commit_batch(staged, results, name)
+    return results
+
+
+def add_new(obj):
+    db.session.add(obj)
+    return obj
+
+
+def apply_update(obj, item, updatable):
+    for field in updatable:
+        if item.get(field, None):
+            setattr(obj, field, item[field])
+    return obj
+
+
+def delete_obj(obj):
+    obj.format()
+    db.session.delete(obj)
+    return obj
 
 def create_app(test_config=None):
     app = Flask(__name__)
+    app.config['CACHE_CONTROL'] = dict(DEFAULT_CACHE_CONTROL)
+    app.config['READ_CACHE_URL'] = os.environ.get('READ_CACHE_URL', 'memory')
+    app.config['READ_CACHE_TTL'] = int(os.environ.get('READ_CACHE_TTL', 60))
+    app.config['READ_CACHE_RESOURCE_TTL'] = int(
+        os.environ.get('READ_CACHE_RESOURCE_TTL', 5))
+    app.config['READ_CACHE_SIZE'] = int(os.environ.get('READ_CACHE_SIZE', 10000))
+    app.config['JSON_PROVIDER'] = os.environ.get('JSON_PROVIDER', 'orjson')
+    app.config['MAX_PAGE_SIZE'] = int(os.environ.get('MAX_PAGE_SIZE', 100))
+    app.config['COMPRESS_ALGORITHMS'] = [name for name in os.environ.get(
+        'COMPRESS_ALGORITHMS', 'br,gzip').split(',') if name]
+    app.config['COMPRESS_MIN_SIZE'] = int(os.environ.get('COMPRESS_MIN_SIZE', 500))
+    app.config['COMPRESS_LEVEL'] = int(os.environ.get('COMPRESS_LEVEL', 6))
+    app.config['COMPRESS_BR_LEVEL'] = int(os.environ.get('COMPRESS_BR_LEVEL', 4))
+    app.config['SLOW_QUERY_MS'] = int(os.environ.get('SLOW_QUERY_MS', 500))
+    app.config['SERVER_TIMING'] = env_flag(os.environ, 'SERVER_TIMING', True)
+    app.config['STATS_SUMMARY'] = env_flag(os.environ, 'STATS_SUMMARY', False)
+    app.config['READINESS_CACHE_SECONDS'] = float(
+        os.environ.get('READINESS_CACHE_SECONDS', 2))
+    app.config['READINESS_TIMEOUT_MS'] = int(
+        os.environ.get('READINESS_TIMEOUT_MS', 1000))
+    app.config['RATE_LIMIT_URL'] = os.environ.get('RATE_LIMIT_URL')
+    app.config['RATE_LIMITS'] = parse_limits(os.environ.get('RATE_LIMITS', ''))
+    app.config['TRUSTED_PROXY_COUNT'] = int(
+        os.environ.get('TRUSTED_PROXY_COUNT', 0))
     if test_config is None:
         setup_db(app)
     else:
+        app.config.from_mapping(test_config)
         database_path = test_config.get('SQLALCHEMY_DATABASE_URI')
         setup_db(app, database_path=database_path)
+    app.json = create_json_provider(app, app.config['JSON_PROVIDER'])
+    auth.init_app(app)
+    metrics.init_app(app)
+    read_cache.configure(
+        create_backend(app.config['READ_CACHE_URL'],
+                       app.config['READ_CACHE_SIZE']),
+        ttl=app.config['READ_CACHE_TTL'])
+    limiter.configure(*configure_limiter(app.config['RATE_LIMIT_URL'],
+                                         app.config['RATE_LIMITS']))
+    app.extensions['readiness'] = Readiness(
+        app.config['READINESS_CACHE_SECONDS'], app.config['READINESS_TIMEOUT_MS'])
+    if app.config['TRUSTED_PROXY_COUNT']:
+        # remote_addr becomes the address the last trusted proxy saw.
+        app.wsgi_app = ProxyFix(app.wsgi_app,
+                                x_for=app.config['TRUSTED_PROXY_COUNT'])
+    register_commands(app)
     CORS(app, resources={r'/api/': {'origins': '*'}})
 
+    @app.before_request
+    def limit_anonymous_requests():
+        # Authenticated views are limited per token subject in requires_auth.
+        view = app.view_functions.get(request.endpoint)
+        if not (getattr(view, 'requires_auth', False)
+                or getattr(view, 'rate_limit_exempt', False)):
+            limiter.check(client_key(), request.endpoint)
+
     @app.after_request
     def after_request(response):
         
@@ -22,89 +379,170 @@ def create_app(test_config=None):
             'Access-Control-Allow-Headers', 'Content-Type, Authorization, True')
         response.headers.add(
             'Access-Control-Allow-Methods', 'GET, POST, DELETE, PATCH, OPTIONS')
-        return response
+        return compress_response(apply_cache_control(response))
     
-    @app.route('/', methods=['GET'])
-    def health_check():
-        page = request.args.get('page', 1, type=int)
-        start = (page - 1) * QUESTIONS_PER_PAGE
-        end = start + QUESTIONS_PER_PAGE
-        movies = Movie.query.all()
-        result = len(movies)
-        if start >= result:
-            return jsonify({
-                'success': True,
-                'movies': []  # Fixed typo 'modvies'
-            })
-        result = movies[start:end]
+    @app.route('/metrics', methods=['GET'])
+    @limiter.exempt
+    def get_metrics():
+        samples = []
+        for name, stats in (('read', read_cache.stats()),
+                            ('token', auth.token_cache.stats())):
+            samples += [('cache_hits_total', {'cache': name}, stats['hits']),
+                        ('cache_misses_total', {'cache': name}, stats['misses']),
+                        ('cache_entries', {'cache': name}, stats['size'])]
+        pool = pool_stats()
+        for state in ('checked_in', 'checked_out', 'overflow'):
+            if state in pool:
+                samples.append(
+                    ('db_pool_connections', {'state': state}, pool[state]))
+        return Response(metrics.metrics.render(samples),
+                        mimetype=metrics.PROMETHEUS_MIMETYPE)
+
+    @app.route('/healthz', methods=['GET'])
+    @limiter.exempt
+    def liveness():
         return jsonify({
             'success': True,
-            'movies': [movie.format() for movie in result],
-            'description': 'Capstone App is running successfully!!!'
+            'status': 'ok'
         })
 
-    @app.route('/movies', methods=['GET'])
-    @requires_auth('get:movies')
-    def get_movies():
-        page = request.args.get('page', 1, type=int)
-        start = (page - 1) * QUESTIONS_PER_PAGE
-        end = start + QUESTIONS_PER_PAGE
-        movies = Movie.query.all()
-        result = len(movies)
-        if start >= result:
+    @app.route('/readyz', methods=['GET'])
+    @limiter.exempt
+    def readiness():
+        ready, checks = app.extensions['readiness'].check()
+        if not ready:
             return jsonify({
-                'success': True,
-                'movies': []  # Fixed typo 'modvies'
-            })
-        result = movies[start:end]
+                'success': False,
+                'error': 503,
+                'status': 'unavailable',
+                'checks': checks
+            }), 503
         return jsonify({
             'success': True,
-            'movies': [movie.format() for movie in result]
+            'status': 'ready',
+            'checks': checks
         })
+
+    @app.route('/', methods=['GET'])
+    @read_replica
+    def health_check():
+        fields = get_fields(MOVIE_FIELDS)
+        etag, last_modified = collection_validators('movies')
+        cached = not_modified(etag, last_modified)
+        if cached is not None:
+            return cached
+        body = load_cached(
+            ['movies'], etag, lambda: load_movies_page(False, fields))
+        if not body['movies']:
+            return set_validators(jsonify({
+                'success': True,
+                'movies': [],  # Fixed typo 'modvies'
+                **body
+            }), etag, last_modified)
+        return set_validators(jsonify({
+            'success': True,
+            'description': 'Capstone App is running successfully!!!',
+            **body
+        }), etag, last_modified)
+
+    @app.route('/movies', methods=['GET'])
+    @read_replica
+    @requires_auth('get:movies')
+    def get_movies(payload):
+        include_actors = 'actors' in get_includes({'actors'})
+        fields = get_fields(MOVIE_FIELDS)
+        filters = movie_filters()
+        tables = ['movies'] + (['actors'] if include_actors else [])
+        etag, last_modified = collection_validators(*tables)
+        cached = not_modified(etag, last_modified)
+        if cached is not None:
+            return cached
+        body = load_cached(
+            tables, etag,
+            lambda: load_movies_page(include_actors, fields, filters))
+        return set_validators(jsonify({
+            'success': True,
+            **body
+        }), etag, last_modified)
     
+    @app.route('/stats/movies', methods=['GET'])
+    @read_replica
+    @requires_auth('get:movies')
+    def get_movie_stats(payload):
+        etag, last_modified = collection_validators('movies')
+        cached = not_modified(etag, last_modified)
+        if cached is not None:
+            return cached
+        body = load_cached(
+            ['movies'], etag,
+            lambda: {'stats': movie_stats(app.config['STATS_SUMMARY'])})
+        return set_validators(jsonify({
+            'success': True,
+            **body
+        }), etag, last_modified)
+
+    @app.route('/movies/export', methods=['GET'])
+    @requires_auth('get:movies')
+    def export_movies(payload):
+        return export_response(get_fields(MOVIE_FIELDS), 'movies')
+
     @app.route('/movies/<int:movie_id>', methods=['GET'])
+    @read_replica
     @requires_auth('get:movies')
-    def get_movie(movie_id):
-        movie = Movie.query.filter(Movie.id == movie_id).one_or_none()
-        if movie is None:
+    def get_movie(payload, movie_id):
+        include_actors = 'actors' in get_includes({'actors'})
+        fields = get_fields(MOVIE_FIELDS)
+        related = ['actors'] if include_actors else []
+        if is_conditional():
+            row = db.session.query(Movie.version, Movie.updated_at).filter(
+                Movie.id == movie_id).one_or_none()
+            if row is None:
+                abort(404)
+            cached = not_modified(*resource_validators(
+                'movies', movie_id, *row, *related))
+            if cached is not None:
+                return cached
+        body = load_cached(
+            ['movies'] + related,
+            f'movie:{movie_id}:{include_actors}:{request.args.get("fields")}',
+            lambda: load_movie(movie_id, include_actors, fields),
+            ttl=resource_ttl(app))
+        if body is None:
             abort(404)
-        return jsonify({
+        return set_validators(jsonify({
             'success': True,
-            'movie': movie.format()
-        })
+            'movie': body['movie']
+        }), *resource_validators(
+            'movies', movie_id, body['version'],
+            datetime.fromisoformat(body['updated_at']), *related))
 
 
     @app.route('/movies', methods=['POST'])
     @requires_auth('post:movies')
-    def create_movie():
+    def create_movie(payload):
         body = request.get_json()
-        new_title = body.get('title', None)
-        new_release_year = body.get('release_year', None)
-        
-        if not isinstance(new_title, str) or not isinstance(new_release_year, int):
-            abort(422)
-
-        if not new_title or not new_release_year:
+        try:
+            fields = Movie.validate(body)
+        except (ValueError, AttributeError):
             abort(422)
 
-        exist = Movie.query.filter(Movie.title == new_title, Movie.release_year == new_release_year).one_or_none()
-        if exist is not None:
-            abort(409)
-
+        new_movie = Movie(**fields)
         try:
-            new_movie = Movie(title=new_title, release_year=new_release_year)
             new_movie.insert()
-            return jsonify({
-                'success': True,
-                'movie': new_movie.format()
-            })
+        except IntegrityError as e:
+            db.session.rollback()
+            abort(409 if is_unique_violation(e) else 422)
         except BaseException as e:
             print(e)
             abort(422)
+        return jsonify({
+            'success': True,
+            'movie': new_movie.format()
+        })
 
     @app.route('/movies/<int:movie_id>', methods=['PATCH'])
     @requires_auth('patch:movies')
-    def update_movie(movie_id):
+    def update_movie(payload, movie_id):
         body = request.get_json()
         movie = Movie.query.filter(Movie.id == movie_id).one_or_none()
         if movie is None:
@@ -119,13 +557,16 @@ def create_app(test_config=None):
                 'success': True,
                 'movie': movie.format()
             })
+        except IntegrityError as e:
+            db.session.rollback()
+            abort(409 if is_unique_violation(e) else 422)
         except BaseException as e:
             print(e)
             abort(422)
 
     @app.route('/movies/<int:movie_id>', methods=['DELETE'])
     @requires_auth('delete:movies')
-    def delete_movie(movie_id):
+    def delete_movie(payload, movie_id):
         movie = Movie.query.filter(Movie.id == movie_id).one_or_none()
         if movie is None:
             abort(404)
@@ -139,71 +580,134 @@ def create_app(test_config=None):
             print(e)
             abort(422)
 
-    @app.route('/actors', methods=['GET'])
-    @requires_auth('get:actors')
-    def get_actors():
-        page = request.args.get('page', 1, type=int)
-        start = (page - 1) * QUESTIONS_PER_PAGE
-        end = start + QUESTIONS_PER_PAGE
-        actors = Actor.query.all()
-        result = len(actors)
-        if start >= result:
-            return jsonify({
-                'success': True,
-                'actors': []  # Fixed typo 'modvies'
-            })
-        result = actors[start:end]
+    @app.route('/movies/batch', methods=['POST'])
+    @requires_auth('post:movies')
+    def create_movies(payload):
+        items = get_batch_items(request.get_json(), 'movies')
+        results = create_batch(
+            Movie, items, [Movie.title, Movie.release_year], 'movie')
         return jsonify({
             'success': True,
-            'actors': [actor.format() for actor in result]
+            'results': results
         })
+
+    @app.route('/movies/batch', methods=['PATCH'])
+    @requires_auth('patch:movies')
+    def update_movies(payload):
+        items = get_batch_items(request.get_json(), 'movies')
+        results = update_batch(Movie, items, ['title', 'release_year'], 'movie')
+        return jsonify({
+            'success': True,
+            'results': results
+        })
+
+    @app.route('/movies/batch', methods=['DELETE'])
+    @requires_auth('delete:movies')
+    def delete_movies(payload):
+        ids = get_batch_items(request.get_json(), 'ids')
+        results = delete_batch(Movie, ids, 'movie')
+        return jsonify({
+            'success': True,
+            'results': results
+        })
+
+    @app.route('/actors', methods=['GET'])
+    @read_replica
+    @requires_auth('get:actors')
+    def get_actors(payload):
+        include_movie = 'movie' in get_includes({'movie'})
+        fields = get_fields(ACTOR_FIELDS)
+        filters = actor_filters()
+        tables = ['actors'] + (['movies'] if include_movie else [])
+        etag, last_modified = collection_validators(*tables)
+        cached = not_modified(etag, last_modified)
+        if cached is not None:
+            return cached
+        body = load_cached(
+            tables, etag,
+            lambda: load_actors_page(include_movie, fields, filters))
+        return set_validators(jsonify({
+            'success': True,
+            **body
+        }), etag, last_modified)
     
+    @app.route('/stats/actors', methods=['GET'])
+    @read_replica
+    @requires_auth('get:actors')
+    def get_actor_stats(payload):
+        etag, last_modified = collection_validators('movies', 'actors')
+        cached = not_modified(etag, last_modified)
+        if cached is not None:
+            return cached
+        body = load_cached(
+            ['movies', 'actors'], etag,
+            lambda: {'stats': actor_stats(app.config['STATS_SUMMARY'])})
+        return set_validators(jsonify({
+            'success': True,
+            **body
+        }), etag, last_modified)
+
+    @app.route('/actors/export', methods=['GET'])
+    @requires_auth('get:actors')
+    def export_actors(payload):
+        return export_response(get_fields(ACTOR_FIELDS), 'actors')
+
     @app.route('/actors/<int:actor_id>', methods=['GET'])
+    @read_replica
     @requires_auth('get:actors')
-    def get_actor(actor_id):
-        actor = Actor.query.filter(Actor.id == actor_id).one_or_none()
-        if actor is None:
+    def get_actor(payload, actor_id):
+        include_movie = 'movie' in get_includes({'movie'})
+        fields = get_fields(ACTOR_FIELDS)
+        related = ['movies'] if include_movie else []
+        if is_conditional():
+            row = db.session.query(Actor.version, Actor.updated_at).filter(
+                Actor.id == actor_id).one_or_none()
+            if row is None:
+                abort(404)
+            cached = not_modified(*resource_validators(
+                'actors', actor_id, *row, *related))
+            if cached is not None:
+                return cached
+        body = load_cached(
+            ['actors'] + related,
+            f'actor:{actor_id}:{include_movie}:{request.args.get("fields")}',
+            lambda: load_actor(actor_id, include_movie, fields),
+            ttl=resource_ttl(app))
+        if body is None:
             abort(404)
-        return jsonify({
+        return set_validators(jsonify({
             'success': True,
-            'actor': actor.format()
-        })
+            'actor': body['actor']
+        }), *resource_validators(
+            'actors', actor_id, body['version'],
+            datetime.fromisoformat(body['updated_at']), *related))
 
     @app.route('/actors', methods=['POST'])
     @requires_auth('post:actors')
-    def create_actor():
+    def create_actor(payload):
         body = request.get_json()
-        new_name = body.get('name', None)
-        new_age = body.get('age', None)
-        new_gender = body.get('gender', None)
-        new_movie_id = body.get('movie_id', None)
-
-        if not new_name or not new_age or not new_gender or not new_movie_id:
+        try:
+            fields = Actor.validate(body)
+        except (ValueError, AttributeError):
             abort(422)
 
-        exist = Actor.query.filter(
-            Actor.name == new_name,
-            Actor.age == new_age,
-            Actor.gender == new_gender,
-            Actor.movie_id == new_movie_id
-        ).one_or_none()
-        if exist is not None:
-            abort(409)
-        
+        new_actor = Actor(**fields)
         try:
-            new_actor = Actor(name=new_name, age=new_age, gender=new_gender, movie_id=new_movie_id)
             new_actor.insert()
-            return jsonify({
-                'success': True,
-                'actor': new_actor.format()
-            })
+        except IntegrityError as e:
+            db.session.rollback()
+            abort(409 if is_unique_violation(e) else 422)
         except BaseException as e:
             print(e)
             abort(422)
+        return jsonify({
+            'success': True,
+            'actor': new_actor.format()
+        })
 
     @app.route('/actors/<int:actor_id>', methods=['PATCH'])
     @requires_auth('patch:actors')
-    def update_actor(actor_id):
+    def update_actor(payload, actor_id):
         body = request.get_json()
         actor = Actor.query.filter(Actor.id == actor_id).one_or_none()
         movie = Movie.query.filter(Movie.id == body.get('movie_id', None)).one_or_none()
@@ -224,13 +728,16 @@ def create_app(test_config=None):
                 'success': True,
                 'actor': actor.format()
             })
+        except IntegrityError as e:
+            db.session.rollback()
+            abort(409 if is_unique_violation(e) else 422)
         except BaseException as e:
             print(e)
             abort(422)
 
     @app.route('/actors/<int:actor_id>', methods=['DELETE'])
     @requires_auth('delete:actors')
-    def delete_actor(actor_id):
+    def delete_actor(payload, actor_id):
         actor = Actor.query.filter(Actor.id == actor_id).one_or_none()
         if actor is None:
             abort(404)
@@ -244,26 +751,71 @@ def create_app(test_config=None):
             print(e)
             abort(422)
 
-    error_handlers = {
-        404: 'Resource not found',
-        422: 'Unprocessable entity',
-        400: 'Bad request',
-        500: 'Internal server error',
-        409: 'Conflict with existing resource'
-    }
+    @app.route('/actors/batch', methods=['POST'])
+    @requires_auth('post:actors')
+    def create_actors(payload):
+        items = get_batch_items(request.get_json(), 'actors')
+        results = create_batch(
+            Actor, items,
+            [Actor.name, Actor.age, Actor.gender, Actor.movie_id], 'actor')
+        return jsonify({
+            'success': True,
+            'results': results
+        })
+
+    @app.route('/actors/batch', methods=['PATCH'])
+    @requires_auth('patch:actors')
+    def update_actors(payload):
+        items = get_batch_items(request.get_json(), 'actors')
+        results = update_batch(
+            Actor, items, ['name', 'age', 'gender', 'movie_id'], 'actor')
+        return jsonify({
+            'success': True,
+            'results': results
+        })
+
+    @app.route('/actors/batch', methods=['DELETE'])
+    @requires_auth('delete:actors')
+    def delete_actors(payload):
+        ids = get_batch_items(request.get_json(), 'ids')
+        results = delete_batch(Actor, ids, 'actor')
+        return jsonify({
+            'success': True,
+            'results': results
+        })
 
     @app.errorhandler(Exception)  # Fixed missing error code or exception type
     def handle_errors(error):
         error_code = error.code if hasattr(error, 'code') else 500
+        headers = {}
+        if isinstance(error, HTTPException):
+            # Keep Retry-After on 429s, Allow on 405s, etc.
+            headers = {name: value for name, value in error.get_headers()
+                       if name != 'Content-Type'}
         return jsonify({
             'success': False,
             'error': error_code,
             'message': error_handlers.get(error_code, 'Unexpected error')
-        }), error_code
+        }), error_code, headers
+
+    @app.errorhandler(AuthError)
+    def handle_auth_error(error):
+        return jsonify({
+            'success': False,
+            'error': error.status_code,
+            'message': error.error['description']
+        }), error.status_code
 
     return app
 
-app = create_app()
+def __getattr__(name):
+    # `gunicorn app:app` and `flask run` look the app up on first use, so
+    # importing this module (tests, CLI tools) stays free of side effects.
+    if name == 'app':
+        globals()['app'] = create_app()
+        return globals()['app']
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
 
 if __name__ == '__main__':
-    app.run()
+    create_app().run()
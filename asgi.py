@@ -0,0 +1,389 @@
+"""Async serving mode: the catalog API on Starlette and async SQLAlchemy.
+
+    uvicorn asgi:app --workers 4
+
+Routes, payloads, errors and requires_auth semantics match app.py, and
+writes keep the catalog_stats summary up to date when STATS_SUMMARY is on.
+Batch, export, /stats, rate limiting, health probes, /metrics and the read
+replica/HTTP caching layers stay on the WSGI app; ?fields= and the list
+filters are answered with 400 rather than ignored.
+"""
+import logging
+import os
+from contextlib import asynccontextmanager
+from functools import wraps
+from sqlalchemy import event, func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import Session, joinedload, selectinload, sessionmaker
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import HTTPException as WerkzeugHTTPException
+from app import QUESTIONS_PER_PAGE, error_handlers
+from auth import auth
+from auth.auth import AuthError
+from cache import create_backend, read_cache
+from models import (
+    apply_stat_changes, engine_options, env_flag, forget_changed_tables,
+    get_database_path, invalidate_read_cache, is_unique_violation,
+    track_collection_changes, track_stat_removals, Movie, Actor)
+from pagination import get_page_args
+
+logger = logging.getLogger(__name__)
+
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+# Filters and ?fields= are only implemented by app:app.
+WSGI_ONLY_PARAMS = frozenset(
+    ['fields', 'q', 'title', 'name', 'gender', 'movie_id']
+    + [f'{name}{suffix}' for name in ('release_year', 'age')
+       for suffix in ('', '_min', '_max')])
+
+
+class CatalogSession(Session):
+    """Sync half of the AsyncSession, with the same write hooks as db.session."""
+
+
+event.listen(CatalogSession, 'before_flush', track_collection_changes)
+event.listen(CatalogSession, 'before_flush', track_stat_removals)
+event.listen(CatalogSession, 'after_flush', apply_stat_changes)
+event.listen(CatalogSession, 'after_commit', invalidate_read_cache)
+event.listen(CatalogSession, 'after_rollback', forget_changed_tables)
+
+
+def async_database_url(database_path):
+    scheme, rest = database_path.split('://', 1)
+    return f'{ASYNC_DRIVERS.get(scheme, scheme)}://{rest}'
+
+
+def async_engine_options(database_path, environ=os.environ):
+    options = engine_options(database_path, environ)
+    connect_args = options.pop('connect_args', None)
+    if connect_args:
+        # asyncpg spells the psycopg2 settings differently.
+        options['connect_args'] = {'timeout': connect_args['connect_timeout']}
+        statement_timeout = environ.get('DB_STATEMENT_TIMEOUT_MS')
+        if statement_timeout:
+            options['connect_args']['server_settings'] = {
+                'statement_timeout': str(int(statement_timeout))}
+    return options
+
+
+def abort(status_code):
+    raise HTTPException(status_code=status_code)
+
+
+def error_response(error_code):
+    return JSONResponse({
+        'success': False,
+        'error': error_code,
+        'message': error_handlers.get(error_code, 'Unexpected error')
+    }, status_code=error_code)
+
+
+def requires_auth(permission='', any_of=(), all_of=()):
+    required = frozenset(all_of).union([permission] if permission else [])
+    any_of = frozenset(any_of)
+
+    def requires_auth_decorator(f):
+        @wraps(f)
+        async def wrapper(request):
+            token = auth.parse_auth_header(request.headers.get('Authorization'))
+            try:
+                payload, permissions = await auth.verify_token_async(token)
+            except Exception as e:
+                logger.warning('Token verification failed: %s', e)
+                raise AuthError({
+                    'code': 'invalid_token',
+                    'description': 'Cannot verify token.'
+                }, 401)
+            auth.check_permissions(required, payload, permissions, any_of)
+            return await f(payload, request)
+
+        return wrapper
+
+    return requires_auth_decorator
+
+
+def reject_wsgi_only_params(request):
+    # Answering without them would return rows or fields the client excluded.
+    if WSGI_ONLY_PARAMS.intersection(request.query_params):
+        abort(400)
+
+
+def get_includes(request, allowed):
+    include = request.query_params.get('include', '')
+    includes = {name for name in include.split(',') if name}
+    if not includes <= allowed:
+        abort(400)
+    return includes
+
+
+async def get_body(request):
+    try:
+        return await request.json()
+    except ValueError:
+        abort(400)
+
+
+async def paginate(session, request, statement, model):
+    args = MultiDict(request.query_params.multi_items())
+    page, after, limit = get_page_args(
+        QUESTIONS_PER_PAGE, args, request.app.state.max_page_size)
+    statement = statement.order_by(model.id).limit(limit)
+    if after is not None:
+        statement = statement.where(model.id > after)
+    else:
+        statement = statement.offset((page - 1) * limit)
+    items = (await session.execute(statement)).scalars().all()
+
+    meta = {
+        'next_cursor': items[-1].id if len(items) == limit else None
+    }
+    if args.get('count', 'false').lower() in ('1', 'true'):
+        meta['total'] = await session.scalar(select(func.count(model.id)))
+    return items, meta
+
+
+async def get_or_404(session, model, resource_id, option=None):
+    statement = select(model).where(model.id == resource_id)
+    if option is not None:
+        statement = statement.options(option)
+    obj = (await session.execute(statement)).scalar_one_or_none()
+    if obj is None:
+        abort(404)
+    return obj
+
+
+async def commit(session):
+    try:
+        await session.commit()
+    except IntegrityError as e:
+        await session.rollback()
+        abort(409 if is_unique_violation(e) else 422)
+    except Exception:
+        logger.exception('Commit failed')
+        await session.rollback()
+        abort(422)
+
+
+def create_asgi_app(test_config=None):
+    config = {
+        'READ_CACHE_URL': os.environ.get('READ_CACHE_URL', 'memory'),
+        'READ_CACHE_TTL': int(os.environ.get('READ_CACHE_TTL', 60)),
+        'READ_CACHE_SIZE': int(os.environ.get('READ_CACHE_SIZE', 10000)),
+        'MAX_PAGE_SIZE': int(os.environ.get('MAX_PAGE_SIZE', 100)),
+        'STATS_SUMMARY': env_flag(os.environ, 'STATS_SUMMARY', False),
+    }
+    config.update(test_config or {})
+    database_path = (config.get('SQLALCHEMY_DATABASE_URI')
+                     or get_database_path())
+    options = async_engine_options(database_path)
+    options.update(config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    engine = create_async_engine(async_database_url(database_path), **options)
+    Session = sessionmaker(engine, class_=AsyncSession,
+                           sync_session_class=CatalogSession,
+                           expire_on_commit=False,
+                           info={'stats_summary': config['STATS_SUMMARY']})
+    auth.configure(config)
+    read_cache.configure(
+        create_backend(config['READ_CACHE_URL'], config['READ_CACHE_SIZE']),
+        ttl=config['READ_CACHE_TTL'])
+
+    async def movies_page(request, include_actors):
+        reject_wsgi_only_params(request)
+        statement = select(Movie)
+        if include_actors:
+            statement = statement.options(selectinload(Movie.actors))
+        async with Session() as session:
+            movies, meta = await paginate(session, request, statement, Movie)
+            return {
+                'movies': [movie.format(include_actors) for movie in movies],
+                **meta
+            }
+
+    async def health_check(request):
+        body = await movies_page(request, False)
+        if not body['movies']:
+            return JSONResponse({'success': True, **body})
+        return JSONResponse({
+            'success': True,
+            'description': 'Capstone App is running successfully!!!',
+            **body
+        })
+
+    @requires_auth('get:movies')
+    async def get_movies(payload, request):
+        include_actors = 'actors' in get_includes(request, {'actors'})
+        body = await movies_page(request, include_actors)
+        return JSONResponse({'success': True, **body})
+
+    @requires_auth('get:movies')
+    async def get_movie(payload, request):
+        reject_wsgi_only_params(request)
+        include_actors = 'actors' in get_includes(request, {'actors'})
+        option = selectinload(Movie.actors) if include_actors else None
+        async with Session() as session:
+            movie = await get_or_404(
+                session, Movie, request.path_params['movie_id'], option)
+            return JSONResponse({
+                'success': True,
+                'movie': movie.format(include_actors)
+            })
+
+    @requires_auth('post:movies')
+    async def create_movie(payload, request):
+        body = await get_body(request)
+        try:
+            fields = Movie.validate(body)
+        except (ValueError, AttributeError):
+            abort(422)
+        async with Session() as session:
+            movie = Movie(**fields)
+            session.add(movie)
+            await commit(session)
+            return JSONResponse({'success': True, 'movie': movie.format()})
+
+    @requires_auth('patch:movies')
+    async def update_movie(payload, request):
+        body = await get_body(request)
+        async with Session() as session:
+            movie = await get_or_404(
+                session, Movie, request.path_params['movie_id'])
+            for field in ('title', 'release_year'):
+                if body.get(field, None):
+                    setattr(movie, field, body[field])
+            await commit(session)
+            return JSONResponse({'success': True, 'movie': movie.format()})
+
+    @requires_auth('delete:movies')
+    async def delete_movie(payload, request):
+        async with Session() as session:
+            movie = await get_or_404(
+                session, Movie, request.path_params['movie_id'])
+            await session.delete(movie)
+            await commit(session)
+            return JSONResponse({'success': True, 'movie': movie.format()})
+
+    @requires_auth('get:actors')
+    async def get_actors(payload, request):
+        reject_wsgi_only_params(request)
+        include_movie = 'movie' in get_includes(request, {'movie'})
+        statement = select(Actor)
+        if include_movie:
+            statement = statement.options(joinedload(Actor.movies))
+        async with Session() as session:
+            actors, meta = await paginate(session, request, statement, Actor)
+            return JSONResponse({
+                'success': True,
+                'actors': [actor.format(include_movie) for actor in actors],
+                **meta
+            })
+
+    @requires_auth('get:actors')
+    async def get_actor(payload, request):
+        reject_wsgi_only_params(request)
+        include_movie = 'movie' in get_includes(request, {'movie'})
+        option = joinedload(Actor.movies) if include_movie else None
+        async with Session() as session:
+            actor = await get_or_404(
+                session, Actor, request.path_params['actor_id'], option)
+            return JSONResponse({
+                'success': True,
+                'actor': actor.format(include_movie)
+            })
+
+    @requires_auth('post:actors')
+    async def create_actor(payload, request):
+        body = await get_body(request)
+        try:
+            fields = Actor.validate(body)
+        except (ValueError, AttributeError):
+            abort(422)
+        async with Session() as session:
+            actor = Actor(**fields)
+            session.add(actor)
+            await commit(session)
+            return JSONResponse({'success': True, 'actor': actor.format()})
+
+    @requires_auth('patch:actors')
+    async def update_actor(payload, request):
+        body = await get_body(request)
+        async with Session() as session:
+            actor = await get_or_404(
+                session, Actor, request.path_params['actor_id'])
+            await get_or_404(session, Movie, body.get('movie_id', None))
+            for field in ('name', 'age', 'gender', 'movie_id'):
+                if body.get(field, None):
+                    setattr(actor, field, body[field])
+            await commit(session)
+            return JSONResponse({'success': True, 'actor': actor.format()})
+
+    @requires_auth('delete:actors')
+    async def delete_actor(payload, request):
+        async with Session() as session:
+            actor = await get_or_404(
+                session, Actor, request.path_params['actor_id'])
+            await session.delete(actor)
+            await commit(session)
+            return JSONResponse({'success': True, 'actor': actor.format()})
+
+    async def handle_http_error(request, error):
+        return error_response(getattr(error, 'status_code', None)
+                              or getattr(error, 'code', 500))
+
+    async def handle_auth_error(request, error):
+        return JSONResponse({
+            'success': False,
+            'error': error.status_code,
+            'message': error.error['description']
+        }, status_code=error.status_code)
+
+    async def handle_errors(request, error):
+        logger.error('Unhandled error on %s %s', request.method,
+                     request.url.path, exc_info=error)
+        return error_response(500)
+
+    @asynccontextmanager
+    async def lifespan(app):
+        yield
+        await engine.dispose()
+
+    app = Starlette(
+        routes=[
+            Route('/', health_check, methods=['GET']),
+            Route('/movies', get_movies, methods=['GET']),
+            Route('/movies', create_movie, methods=['POST']),
+            Route('/movies/{movie_id:int}', get_movie, methods=['GET']),
+            Route('/movies/{movie_id:int}', update_movie, methods=['PATCH']),
+            Route('/movies/{movie_id:int}', delete_movie, methods=['DELETE']),
+            Route('/actors', get_actors, methods=['GET']),
+            Route('/actors', create_actor, methods=['POST']),
+            Route('/actors/{actor_id:int}', get_actor, methods=['GET']),
+            Route('/actors/{actor_id:int}', update_actor, methods=['PATCH']),
+            Route('/actors/{actor_id:int}', delete_actor, methods=['DELETE']),
+        ],
+        exception_handlers={
+            HTTPException: handle_http_error,
+            WerkzeugHTTPException: handle_http_error,
+            AuthError: handle_auth_error,
+            Exception: handle_errors,
+        },
+        lifespan=lifespan)
+    app.state.engine = engine
+    app.state.max_page_size = config['MAX_PAGE_SIZE']
+    return app
+
+
+def __getattr__(name):
+    # Built on first use, like app.app, so `uvicorn asgi:app` and imports
+    # from tests don't race for the environment.
+    if name == 'app':
+        globals()['app'] = create_asgi_app()
+        return globals()['app']
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -1,14 +1,57 @@
-import json
 from flask import request
 from functools import wraps
 from jose import jwt
-from urllib.request import urlopen
 import os
+from auth.jwks import AsyncJWKSCache, JWKSCache, async_url_fetcher, url_fetcher
+from auth.token_cache import TokenCache
+from metrics import timer
+from ratelimit import client_key, limiter
 
 
-AUTH0_DOMAIN = os.environ['AUTH0_DOMAIN']
-ALGORITHMS = os.environ['ALGORITHMS']
-API_AUDIENCE = os.environ['API_AUDIENCE']
+AUTH0_DOMAIN = None
+ALGORITHMS = 'RS256'
+API_AUDIENCE = None
+
+
+def fetch_auth0_jwks():
+    with timer('jwks', 'auth_jwks_fetch_seconds'):
+        return url_fetcher(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')()
+
+
+async def fetch_auth0_jwks_async():
+    with timer('jwks', 'auth_jwks_fetch_seconds'):
+        return await async_url_fetcher(
+            f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')()
+
+
+jwks_cache = JWKSCache(fetch_auth0_jwks)
+async_jwks_cache = AsyncJWKSCache(fetch_auth0_jwks_async)
+token_cache = TokenCache()
+
+
+def init_app(app):
+    """Resolve auth settings from app.config, falling back to the environment."""
+    configure(app.config)
+
+
+def configure(config):
+    global AUTH0_DOMAIN, ALGORITHMS, API_AUDIENCE
+
+    def setting(name, default=None):
+        return config.get(name) or os.environ.get(name, default)
+
+    AUTH0_DOMAIN = setting('AUTH0_DOMAIN')
+    ALGORITHMS = setting('ALGORITHMS', 'RS256')
+    API_AUDIENCE = setting('API_AUDIENCE')
+
+    for cache in (jwks_cache, async_jwks_cache):
+        cache.ttl = int(setting('JWKS_CACHE_TTL', 600))
+        cache.stale_ttl = int(setting('JWKS_STALE_TTL', 3600))
+        cache.min_refresh_interval = int(
+            setting('JWKS_MIN_REFRESH_INTERVAL', 30))
+    token_cache.maxsize = int(setting('TOKEN_CACHE_SIZE', 10000))
+    token_cache.ttl = int(setting('TOKEN_CACHE_TTL', 300))
+
 
 class AuthError(Exception):
     def __init__(self, error, status_code):
@@ -17,8 +60,10 @@ class AuthError(Exception):
 
 
 def get_auth_token_header():
-    auth = request.headers.get('Authorization', None)
+    return parse_auth_header(request.headers.get('Authorization', None))
+
 
+def parse_auth_header(auth):
     if not auth:
         raise AuthError({
             'code': 'authorization_header_missing',
@@ -44,14 +89,31 @@ def get_auth_token_header():
     return token
 
 
-def check_permissions(permission, payload):
-    if 'permissions' not in payload:
+def get_permissions(payload):
+    if 'permissions' not in payload and 'scope' not in payload:
+        return None
+    permissions = frozenset(payload.get('permissions') or ())
+    return permissions.union(payload.get('scope', '').split())
+
+
+def check_permissions(permission, payload, permissions=None, any_of=frozenset()):
+    if permissions is None:
+        permissions = get_permissions(payload)
+
+    if permissions is None:
         raise AuthError({
             'code': 'invalid_claims',
             'description': 'Permission not found in JWT.'
         }, 400)
 
-    if permission not in payload['permissions']:
+    if isinstance(permission, str):
+        allowed = not permission or permission in permissions
+    else:
+        allowed = permission <= permissions
+    if allowed and any_of:
+        allowed = not permissions.isdisjoint(any_of)
+
+    if not allowed:
         raise AuthError({
             'code': 'unauthorized',
             'description': 'You are not allowed to perform this permission'
@@ -61,29 +123,38 @@ def check_permissions(permission, payload):
 
 
 def verify_decode_jwt(token):
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
+    payload, _ = verify_token(token)
+    return payload
+
+
+def verify_token(token):
+    verified = token_cache.get(token)
+    if verified is not None:
+        return verified
+    return decode_token(token, jwks_cache.get_key(get_token_kid(token)))
 
-    unverified_header = jwt.get_unverified_header(token)
 
-    rsa_key = {}
+async def verify_token_async(token):
+    """verify_token for the ASGI app; key fetches don't block the loop."""
+    verified = token_cache.get(token)
+    if verified is not None:
+        return verified
+    return decode_token(
+        token, await async_jwks_cache.get_key(get_token_kid(token)))
+
+
+def get_token_kid(token):
+    unverified_header = jwt.get_unverified_header(token)
 
     if 'kid' not in unverified_header:
         raise AuthError({
             'code': 'invalid_header',
             'description': 'Authorization is malformed.'
         }, 401)
+    return unverified_header['kid']
 
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e'],
-            }
 
+def decode_token(token, rsa_key):
     if rsa_key:
         try:
             payload = jwt.decode(
@@ -93,8 +164,10 @@ def verify_decode_jwt(token):
                 audience=API_AUDIENCE,
                 issuer=f'https://{AUTH0_DOMAIN}/',
             )
+            verified = (payload, get_permissions(payload))
+            token_cache.set(token, verified, payload.get('exp'))
 
-            return payload
+            return verified
 
         except jwt.ExpiredSignatureError:
             raise AuthError({
@@ -119,22 +192,40 @@ def verify_decode_jwt(token):
     }, 400)
 
 
-def requires_auth(permission=''):
+def charge_client_address(permission):
+    # Requests whose token can't be verified spend the client address's
+    # tokens, so a stream of bad tokens is limited like anonymous traffic.
+    limiter.check(client_key(), request.endpoint, permission)
+
+
+def requires_auth(permission='', any_of=(), all_of=()):
+    required = frozenset(all_of).union([permission] if permission else [])
+    any_of = frozenset(any_of)
+
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
-            token = get_auth_token_header()
             try:
-                payload = verify_decode_jwt(token)
+                token = get_auth_token_header()
+            except AuthError:
+                charge_client_address(permission)
+                raise
+            try:
+                with timer('auth', 'auth_token_verify_seconds'):
+                    payload, permissions = verify_token(token)
             except BaseException as e:
                 print(e)
+                charge_client_address(permission)
                 raise AuthError({
                     'code': 'invalid_token',
                     'description': 'Cannot verify token.'
                 }, 401)
-            check_permissions(permission, payload)
+            check_permissions(required, payload, permissions, any_of)
+            limiter.check(client_key(payload), request.endpoint, permission)
             return f(payload, *args, **kwargs)
 
+        # Views without this flag are rate limited by client address instead.
+        wrapper.requires_auth = True
         return wrapper
 
-    return requires_auth_decorator
\ No newline at end of file
+    return requires_auth_decorator
@@ -0,0 +1,223 @@
+import asyncio
+import json
+import re
+import time
+import logging
+from threading import Lock, Thread
+from urllib.request import urlopen
+
+logger = logging.getLogger(__name__)
+
+MAX_AGE_RE = re.compile(r'(?:^|,)\s*max-age\s*=\s*"?(\d+)"?', re.IGNORECASE)
+
+
+def parse_max_age(cache_control):
+    if not cache_control:
+        return None
+    directives = cache_control.lower()
+    if 'no-store' in directives or 'no-cache' in directives:
+        return 0
+    match = MAX_AGE_RE.search(cache_control)
+    return int(match.group(1)) if match else None
+
+
+def url_fetcher(url, timeout=5):
+    """Fetch a JWKS document over HTTP(S), returning (jwks, max_age)."""
+    def fetch():
+        with urlopen(url, timeout=timeout) as response:
+            jwks = json.loads(response.read())
+            return jwks, parse_max_age(response.headers.get('Cache-Control'))
+    return fetch
+
+
+def async_url_fetcher(url, timeout=5):
+    """Like url_fetcher, but awaitable; needs httpx (ASGI mode only)."""
+    async def fetch():
+        import httpx
+        async with httpx.AsyncClient(timeout=timeout) as client:
+            response = await client.get(url)
+            response.raise_for_status()
+            return (response.json(),
+                    parse_max_age(response.headers.get('Cache-Control')))
+    return fetch
+
+
+def file_fetcher(path):
+    """Serve a JWKS document from a local file, e.g. in tests."""
+    def fetch():
+        with open(path) as f:
+            return json.load(f), None
+    return fetch
+
+
+class JWKSCache:
+    """Process-wide signing key store keyed by ``kid``.
+
+    Keys are fresh for the server's Cache-Control max-age (or ``ttl``).
+    Once expired they are still served for ``stale_ttl`` seconds while a
+    background thread refreshes them, so a slow IdP never sits on the
+    request path. Unknown kids force a refresh, at most once every
+    ``min_refresh_interval`` seconds.
+    """
+
+    def __init__(self, fetcher, ttl=600, stale_ttl=3600,
+                 min_refresh_interval=30):
+        self.fetcher = fetcher
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.min_refresh_interval = min_refresh_interval
+        self._lock = Lock()
+        self._keys = None
+        self._expires_at = 0
+        self._last_fetch = None
+        self._refreshing = False
+
+    def set_fetcher(self, fetcher):
+        with self._lock:
+            self.fetcher = fetcher
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._keys = None
+            self._expires_at = 0
+            self._last_fetch = None
+
+    def get_key(self, kid):
+        now = time.monotonic()
+        keys = self._keys
+        if keys is None or now >= self._expires_at + self.stale_ttl:
+            keys = self.refresh(since=now)
+        elif now >= self._expires_at:
+            self._refresh_in_background()
+
+        now = time.monotonic()
+        if kid not in keys and self._can_refresh(now):
+            keys = self.refresh(since=now)
+        return keys.get(kid)
+
+    def refresh(self, since=None):
+        with self._lock:
+            # Threads that queued up behind a fetch reuse its result.
+            if self._fetched_since(since):
+                return self._keys
+            return self._store(*self.fetcher())
+
+    def _fetched_since(self, since):
+        return (since is not None and self._keys is not None
+                and self._last_fetch is not None and self._last_fetch >= since)
+
+    def _store(self, jwks, max_age):
+        now = time.monotonic()
+        self._keys = {
+            key['kid']: {
+                'kty': key['kty'],
+                'kid': key['kid'],
+                'use': key.get('use'),
+                'n': key['n'],
+                'e': key['e'],
+            }
+            for key in jwks['keys'] if 'kid' in key
+        }
+        self._expires_at = now + (self.ttl if max_age is None else max_age)
+        self._last_fetch = now
+        return self._keys
+
+    def status(self):
+        now = time.monotonic()
+        keys = self._keys
+        return {
+            'keys': len(keys) if keys is not None else 0,
+            'fresh': keys is not None and now < self._expires_at,
+            'usable': keys is not None and now < self._expires_at + self.stale_ttl,
+        }
+
+    def warm(self):
+        """Fetch keys in the background if they are missing or expired."""
+        if self._keys is None or time.monotonic() >= self._expires_at:
+            self._refresh_in_background()
+
+    def _can_refresh(self, now):
+        last_fetch = self._last_fetch
+        return last_fetch is None or now - last_fetch >= self.min_refresh_interval
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing or not self._can_refresh(time.monotonic()):
+                return
+            self._refreshing = True
+        Thread(target=self._background_refresh, daemon=True).start()
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            logger.warning('JWKS refresh failed, serving stale keys: %s', e)
+            with self._lock:
+                self._last_fetch = time.monotonic()
+        finally:
+            self._refreshing = False
+
+
+class AsyncJWKSCache(JWKSCache):
+    """JWKSCache for the event loop: fetches never block the worker.
+
+    The fetcher is a coroutine function (see async_url_fetcher or
+    as_async). Stale keys are refreshed in a task rather than a thread.
+    """
+
+    def __init__(self, fetcher, **kwargs):
+        super().__init__(fetcher, **kwargs)
+        self._async_lock = None
+        # The event loop only keeps weak references to tasks.
+        self._task = None
+
+    async def get_key(self, kid):
+        now = time.monotonic()
+        keys = self._keys
+        if keys is None or now >= self._expires_at + self.stale_ttl:
+            keys = await self.refresh(since=now)
+        elif now >= self._expires_at:
+            self._refresh_in_background()
+
+        now = time.monotonic()
+        if kid not in keys and self._can_refresh(now):
+            keys = await self.refresh(since=now)
+        return keys.get(kid)
+
+    async def refresh(self, since=None):
+        if self._async_lock is None:
+            self._async_lock = asyncio.Lock()
+        async with self._async_lock:
+            # Requests that queued up behind a fetch reuse its result.
+            if self._fetched_since(since):
+                return self._keys
+            jwks, max_age = await self.fetcher()
+            with self._lock:
+                return self._store(jwks, max_age)
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing or not self._can_refresh(time.monotonic()):
+                return
+            self._refreshing = True
+        self._task = asyncio.get_running_loop().create_task(
+            self._background_refresh())
+
+    async def _background_refresh(self):
+        try:
+            await self.refresh()
+        except Exception as e:
+            logger.warning('JWKS refresh failed, serving stale keys: %s', e)
+            with self._lock:
+                self._last_fetch = time.monotonic()
+        finally:
+            self._refreshing = False
+            self._task = None
+
+
+def as_async(fetcher):
+    """Wrap a blocking fetcher (e.g. file_fetcher) for AsyncJWKSCache."""
+    async def fetch():
+        return await asyncio.to_thread(fetcher)
+    return fetch
@@ -0,0 +1,354 @@
+"""Per-route latency and auth/serialization micro-benchmarks.
+
+Builds the app with create_app against a local fixture database seeded at
+--movies scale (SQLite by default, or --database-url for PostgreSQL), signs
+tokens with a throwaway RSA key served by a stand-in JWKS, and drives every
+route in app.py through the test client; the delete routes get fresh rows
+from the batch API between requests. Reports p50/p99 latency and req/s
+per route plus micro-benchmarks of verify_decode_jwt, check_permissions and
+format().
+
+    python benchmarks/api.py --movies 100000
+    python benchmarks/api.py --json after.json --baseline before.json
+
+With --baseline, exits non-zero if any p50 regressed by more than
+--tolerance (default 25%).
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import timeit
+from datetime import datetime
+from itertools import count
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import rsa  # noqa: E402
+from jose import jwk, jwt  # noqa: E402
+from app import MOVIE_FIELDS, create_app, row_dict  # noqa: E402
+from auth import auth  # noqa: E402
+from models import db, Movie, Actor  # noqa: E402
+from stats import rebuild_summary  # noqa: E402
+
+DOMAIN = 'bench.local'
+AUDIENCE = 'bench'
+PERMISSIONS = [f'{verb}:{name}' for verb in ('get', 'post', 'patch', 'delete')
+               for name in ('movies', 'actors')]
+GENDERS = ('Female', 'Male', 'Other')
+
+
+class Signer:
+    """Local stand-in for the Auth0 tenant."""
+
+    def __init__(self, kid='bench'):
+        public_key, private_key = rsa.newkeys(2048)
+        self.private_pem = private_key.save_pkcs1().decode()
+        key = jwk.construct(public_key.save_pkcs1().decode(), 'RS256').to_dict()
+        key.update({'kid': kid, 'use': 'sig'})
+        self.jwks = {'keys': [key]}
+        self.kid = kid
+
+    def fetch(self):
+        return self.jwks, None
+
+    def token(self, permissions=PERMISSIONS, **claims):
+        now = int(time.time())
+        payload = {'iss': f'https://{DOMAIN}/', 'aud': AUDIENCE,
+                   'sub': 'bench@clients', 'iat': now, 'exp': now + 3600,
+                   'permissions': list(permissions), **claims}
+        return jwt.encode(payload, self.private_pem, algorithm='RS256',
+                          headers={'kid': self.kid})
+
+
+def seed(movies, actors_per_movie, chunk_size=50000):
+    now = datetime.utcnow()
+    started = time.perf_counter()
+    with db.engine.begin() as connection:
+        for start in range(1, movies + 1, chunk_size):
+            ids = range(start, min(start + chunk_size, movies + 1))
+            connection.execute(Movie.__table__.insert(), [
+                {'id': i, 'title': f'Movie {i}', 'release_year': 1900 + i % 125,
+                 'version': 1, 'updated_at': now} for i in ids])
+            connection.execute(Actor.__table__.insert(), [
+                {'name': f'Actor {i}-{j}', 'age': 18 + (i + j) % 60,
+                 'gender': GENDERS[(i + j) % 3], 'movie_id': i,
+                 'version': 1, 'updated_at': now}
+                for i in ids for j in range(actors_per_movie)])
+    return time.perf_counter() - started
+
+
+class Fixtures:
+    """Rows for the delete routes, created through the batch API in bulk.
+
+    Ids are handed out one request at a time, before its timer starts, so
+    every delete hits a row that exists and no route pays for the setup.
+    """
+
+    ITEMS = {
+        'movies': lambda n: {'title': f'Fixture {n}', 'release_year': 2032},
+        'actors': lambda n: {'name': f'Fixture {n}', 'age': 30,
+                             'gender': 'Other', 'movie_id': 1},
+    }
+
+    def __init__(self, client, headers, chunk_size=1000):
+        self.client = client
+        self.headers = headers
+        self.chunk_size = chunk_size
+        self.counter = count()
+        self.ids = {name: [] for name in self.ITEMS}
+
+    def take(self, name, number=1):
+        ids = self.ids[name]
+        while len(ids) < number:
+            ids.extend(self.create(name))
+        taken, self.ids[name] = ids[:number], ids[number:]
+        return taken
+
+    def create(self, name):
+        items = [self.ITEMS[name](next(self.counter))
+                 for _ in range(self.chunk_size)]
+        response = self.client.post(f'/{name}/batch', headers=self.headers,
+                                    json={name: items})
+        results = response.get_json()['results']
+        return [result[name[:-1]]['id'] for result in results
+                if result['success']]
+
+
+def routes(movies, actors, fixtures):
+    pick = lambda: random.randint(1, movies)  # noqa: E731
+    pick_actor = lambda: random.randint(1, actors)  # noqa: E731
+    counter = iter(range(10 ** 9))
+    return [
+        ('GET /', 'get', lambda: '/', None),
+        ('GET /movies', 'get', lambda: '/movies', None),
+        ('GET /movies deep cursor', 'get',
+         lambda: f'/movies?after={movies - 20}', None),
+        ('GET /movies?include=actors', 'get',
+         lambda: '/movies?include=actors&limit=50', None),
+        ('GET /movies?fields=title', 'get',
+         lambda: '/movies?fields=title&limit=100', None),
+        ('GET /movies?q=', 'get', lambda: f'/movies?q=ie {pick()}', None),
+        ('GET /movies/<id>', 'get', lambda: f'/movies/{pick()}', None),
+        ('GET /movies/<id>?include=actors', 'get',
+         lambda: f'/movies/{pick()}?include=actors', None),
+        ('GET /actors', 'get', lambda: '/actors', None),
+        ('GET /actors?include=movie', 'get',
+         lambda: '/actors?include=movie&limit=50', None),
+        ('GET /actors filtered', 'get',
+         lambda: '/actors?gender=Female&age_min=30&age_max=40&count=true', None),
+        ('GET /actors/<id>', 'get', lambda: f'/actors/{pick_actor()}', None),
+        ('GET /stats/movies', 'get', lambda: '/stats/movies', None),
+        ('GET /stats/actors', 'get', lambda: '/stats/actors', None),
+        ('POST /movies', 'post', lambda: '/movies',
+         lambda: {'title': f'New {next(counter)}', 'release_year': 2030}),
+        ('PATCH /movies/<id>', 'patch', lambda: f'/movies/{pick()}',
+         lambda: {'title': f'Renamed {next(counter)}'}),
+        ('DELETE /movies/<id>', 'delete',
+         lambda: f'/movies/{fixtures.take("movies")[0]}', None),
+        ('POST /actors', 'post', lambda: '/actors',
+         lambda: {'name': f'New {next(counter)}', 'age': 30,
+                  'gender': 'Female', 'movie_id': pick()}),
+        ('PATCH /actors/<id>', 'patch', lambda: f'/actors/{pick_actor()}',
+         lambda: {'name': f'Renamed {next(counter)}', 'movie_id': pick()}),
+        ('DELETE /actors/<id>', 'delete',
+         lambda: f'/actors/{fixtures.take("actors")[0]}', None),
+        ('POST /movies/batch (100)', 'post', lambda: '/movies/batch',
+         lambda: {'movies': [{'title': f'Batch {next(counter)}',
+                              'release_year': 2031} for _ in range(100)]}),
+        ('PATCH /movies/batch (100)', 'patch', lambda: '/movies/batch',
+         lambda: {'movies': [{'id': movie_id,
+                              'title': f'Batch renamed {next(counter)}'}
+                             for movie_id in random.sample(range(1, movies + 1),
+                                                           min(100, movies))]}),
+        ('DELETE /movies/batch (100)', 'delete', lambda: '/movies/batch',
+         lambda: {'ids': fixtures.take('movies', 100)}),
+        ('POST /actors/batch (100)', 'post', lambda: '/actors/batch',
+         lambda: {'actors': [{'name': f'Batch {next(counter)}', 'age': 30,
+                              'gender': 'Male', 'movie_id': pick()}
+                             for _ in range(100)]}),
+        ('PATCH /actors/batch (100)', 'patch', lambda: '/actors/batch',
+         lambda: {'actors': [{'id': actor_id,
+                              'name': f'Batch renamed {next(counter)}'}
+                             for actor_id in random.sample(range(1, actors + 1),
+                                                           min(100, actors))]}),
+        ('DELETE /actors/batch (100)', 'delete', lambda: '/actors/batch',
+         lambda: {'ids': fixtures.take('actors', 100)}),
+    ]
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[max(int(len(ordered) * fraction) - 1, 0)]
+
+
+def bench_routes(app, headers, movies, actors, requests, warmup):
+    client = app.test_client()
+    fixtures = Fixtures(client, headers)
+    results = {}
+    for name, method, url, body in routes(movies, actors, fixtures):
+        call = getattr(client, method)
+        timings = []
+        for i in range(warmup + requests):
+            kwargs = {'headers': headers}
+            if body is not None:
+                kwargs['json'] = body()
+            path = url()
+            started = time.perf_counter()
+            response = call(path, **kwargs)
+            elapsed = time.perf_counter() - started
+            if response.status_code >= 400:
+                raise RuntimeError(f'{name} returned {response.status_code}')
+            if i >= warmup:
+                timings.append(elapsed * 1000)
+        results[name] = {
+            'p50': statistics.median(timings),
+            'p99': percentile(timings, 0.99),
+            'rps': 1000 / statistics.mean(timings),
+        }
+    return results
+
+
+def bench_export(app, headers):
+    client = app.test_client()
+    results = {}
+    for url in ('/movies/export', '/actors/export'):
+        started = time.perf_counter()
+        response = client.get(url, headers=headers, buffered=False)
+        rows = sum(chunk.count(b'\n') for chunk in response.response)
+        response.close()
+        results[f'GET {url}'] = rows / (time.perf_counter() - started)
+    return results
+
+
+def micro(signer, number):
+    def per_call(statement):
+        return min(timeit.repeat(statement, number=number, repeat=3)) / number * 1e6
+
+    token = signer.token()
+    payload, permissions = auth.verify_token(token)
+    required = frozenset({'get:movies'})
+    movies = Movie.query.limit(100).all()
+    actors = Actor.query.limit(100).all()
+    rows = db.session.query(*MOVIE_FIELDS).limit(100).all()
+    page = {'movies': [movie.format(True) for movie in movies]}
+
+    def verify_uncached():
+        auth.token_cache.clear()
+        auth.verify_decode_jwt(token)
+
+    return {
+        'verify_decode_jwt (uncached)': per_call(verify_uncached),
+        'verify_decode_jwt (cached)': per_call(
+            lambda: auth.verify_decode_jwt(token)),
+        'check_permissions': per_call(
+            lambda: auth.check_permissions(required, payload, permissions)),
+        'Movie.format() x100': per_call(
+            lambda: [movie.format() for movie in movies]),
+        'Movie.format(include_actors) x100': per_call(
+            lambda: [movie.format(True) for movie in movies]),
+        'Actor.format() x100': per_call(
+            lambda: [actor.format() for actor in actors]),
+        'row_dict x100': per_call(
+            lambda: [row_dict(row, MOVIE_FIELDS) for row in rows]),
+        'json dumps (100 movies + actors)': per_call(
+            lambda: db.get_app().json.dumps(page)),
+    }
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, result in results['routes'].items():
+        before = baseline.get('routes', {}).get(name)
+        if before and result['p50'] > before['p50'] * (1 + tolerance):
+            regressions.append(
+                f'{name}: p50 {before["p50"]:.2f} -> {result["p50"]:.2f} ms')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--movies', type=int, default=10000,
+                        help='movies to seed (10k-10M)')
+    parser.add_argument('--actors-per-movie', type=int, default=3)
+    parser.add_argument('--database-url',
+                        help='empty fixture database; defaults to a temp SQLite file')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--micro-number', type=int, default=200)
+    parser.add_argument('--read-cache', default='none',
+                        help="READ_CACHE_URL, e.g. 'memory'")
+    parser.add_argument('--stats-summary', action='store_true',
+                        help='serve /stats from the catalog_stats summary')
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--baseline', help='results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args()
+
+    directory = tempfile.TemporaryDirectory()
+    database_url = (args.database_url
+                    or f'sqlite:///{directory.name}/bench.db')
+    signer = Signer()
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': database_url,
+        'AUTH0_DOMAIN': DOMAIN,
+        'API_AUDIENCE': AUDIENCE,
+        'READ_CACHE_URL': args.read_cache,
+        'RATE_LIMIT_URL': 'none',
+        'STATS_SUMMARY': args.stats_summary,
+    })
+    auth.jwks_cache.set_fetcher(signer.fetch)
+    headers = {'Authorization': f'Bearer {signer.token()}'}
+
+    with app.app_context():
+        db.create_all()
+        seconds = seed(args.movies, args.actors_per_movie)
+        if args.stats_summary:
+            with db.engine.begin() as connection:
+                rebuild_summary(connection)
+        print(f'seeded {args.movies} movies, '
+              f'{args.movies * args.actors_per_movie} actors in {seconds:.1f}s '
+              f'({db.engine.dialect.name})')
+        results = {
+            'scale': {'movies': args.movies,
+                      'actors_per_movie': args.actors_per_movie},
+            'routes': bench_routes(app, headers, args.movies,
+                                   args.movies * args.actors_per_movie,
+                                   args.requests, args.warmup),
+            'export_rows_per_sec': bench_export(app, headers),
+            'micro_us': micro(signer, args.micro_number),
+        }
+        db.session.remove()
+        if args.database_url:
+            db.drop_all()
+        db.engine.dispose()
+
+    print(f'\n{"route":36} {"p50 ms":>8} {"p99 ms":>8} {"req/s":>8}')
+    for name, result in results['routes'].items():
+        print(f'{name:36} {result["p50"]:8.2f} {result["p99"]:8.2f} '
+              f'{result["rps"]:8.0f}')
+    print()
+    for name, rows_per_sec in results['export_rows_per_sec'].items():
+        print(f'{name}: {rows_per_sec:,.0f} rows/s')
+    print(f'\n{"micro-benchmark":36} {"us/call":>8}')
+    for name, value in results['micro_us'].items():
+        print(f'{name:36} {value:8.1f}')
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f'REGRESSION {line}')
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
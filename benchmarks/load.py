@@ -0,0 +1,101 @@
+"""Compare the sync deployment (gunicorn app:app) with the ASGI one
+(uvicorn asgi:app) under the same concurrent load.
+
+Each server is started with the same number of worker processes against
+the same database, then hit by --concurrency client threads. Protected
+routes need a real token for the configured Auth0 tenant:
+
+    DATABASE_URL=sqlite:////tmp/bench.db python benchmarks/load.py
+    python benchmarks/load.py --path /movies --token "$TOKEN" --concurrency 200
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVERS = {
+    'gunicorn app:app': lambda port, workers: [
+        sys.executable, '-m', 'gunicorn', '--workers', str(workers),
+        '--bind', f'127.0.0.1:{port}', 'app:app'],
+    'uvicorn asgi:app': lambda port, workers: [
+        sys.executable, '-m', 'uvicorn', '--workers', str(workers),
+        '--port', str(port), '--log-level', 'warning', 'asgi:app'],
+}
+
+
+def wait_until_ready(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urlopen(url, timeout=1).close()
+            return
+        except HTTPError:
+            return
+        except (URLError, OSError):
+            time.sleep(0.2)
+    raise RuntimeError(f'{url} did not come up in {timeout}s')
+
+
+def fetch(url, headers):
+    started = time.perf_counter()
+    try:
+        with urlopen(Request(url, headers=headers), timeout=30) as response:
+            response.read()
+            status = response.status
+    except HTTPError as e:
+        status = e.code
+    return time.perf_counter() - started, status
+
+
+def run_load(url, headers, requests, concurrency):
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(lambda _: fetch(url, headers), range(requests)))
+    elapsed = time.perf_counter() - started
+    latencies = sorted(latency for latency, _ in results)
+    return {
+        'rps': requests / elapsed,
+        'p50': statistics.median(latencies) * 1000,
+        'p99': latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        'errors': sum(1 for _, status in results if status >= 400),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--path', default='/')
+    parser.add_argument('--token', help='Bearer token for protected paths')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    headers = {'Authorization': f'Bearer {args.token}'} if args.token else {}
+    url = f'http://127.0.0.1:{args.port}{args.path}'
+    print(f'{args.requests} x GET {args.path}, concurrency {args.concurrency}, '
+          f'{args.workers} workers')
+    for name, command in SERVERS.items():
+        # Measure the serving stack, not the per-client rate limiter.
+        server = subprocess.Popen(command(args.port, args.workers), cwd=ROOT,
+                                  env={**os.environ, 'RATE_LIMIT_URL': 'none'})
+        try:
+            wait_until_ready(url)
+            run_load(url, headers, min(args.requests, 100), args.concurrency)
+            result = run_load(url, headers, args.requests, args.concurrency)
+        finally:
+            server.terminate()
+            server.wait()
+        print(f'{name:18} {result["rps"]:8.0f} req/s  p50 {result["p50"]:7.1f} ms'
+              f'  p99 {result["p99"]:7.1f} ms  errors {result["errors"]}')
+
+
+if __name__ == '__main__':
+    main()
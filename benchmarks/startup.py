@@ -0,0 +1,74 @@
+"""Measure cold-start and per-worker boot cost of the app.
+
+Cold start runs ``import app; app.app`` in a fresh interpreter, the way a
+gunicorn worker does for ``app:app``. Per-worker boot calls ``create_app``
+again in a warm interpreter and counts the SQL statements it issues, which
+is the cost every preloaded worker and every test case pays.
+
+    DATABASE_URL=sqlite:////tmp/bench.db python benchmarks/startup.py
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COLD_START = '''
+import json, time
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+statements = []
+event.listen(Engine, 'before_cursor_execute',
+             lambda *args: statements.append(args[2]))
+started = time.perf_counter()
+import app
+app.app
+print(json.dumps({'seconds': time.perf_counter() - started,
+                  'statements': len(statements)}))
+'''
+
+WORKER_BOOT = '''
+import json, sys, time
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app import create_app
+statements = []
+event.listen(Engine, 'before_cursor_execute',
+             lambda *args: statements.append(args[2]))
+timings = []
+for _ in range(int(sys.argv[1])):
+    started = time.perf_counter()
+    create_app()
+    timings.append(time.perf_counter() - started)
+print(json.dumps({'timings': timings, 'statements': len(statements)}))
+'''
+
+
+def run(code, *args):
+    output = subprocess.run(
+        [sys.executable, '-c', code, *args], cwd=ROOT, check=True,
+        capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    cold = [run(COLD_START) for _ in range(args.runs)]
+    boot = run(WORKER_BOOT, str(args.runs))
+
+    cold_ms = [r['seconds'] * 1000 for r in cold]
+    boot_ms = [t * 1000 for t in boot['timings']]
+    print(f'cold start     median {statistics.median(cold_ms):8.1f} ms  '
+          f'statements {cold[0]["statements"]}')
+    print(f'worker boot    median {statistics.median(boot_ms):8.1f} ms  '
+          f'statements {boot["statements"] / args.runs:.0f} per create_app')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from threading import Lock, local
+
+
+class MemoryBackend:
+    """Per-process LRU with a TTL on every entry."""
+
+    shared = False
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def generation(self, namespace):
+        return self._generations.get(namespace, 0)
+
+    def bump(self, namespace):
+        with self._lock:
+            self._generations[namespace] = self.generation(namespace) + 1
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteBackend:
+    """Cache shared by every worker on the host through one SQLite file.
+
+    Values are stored as JSON. Invalidation bumps a generation counter in the
+    same file, so a write in one worker is seen by all the others.
+    """
+
+    shared = True
+
+    def __init__(self, path, maxsize=10000):
+        self.path = path
+        self.maxsize = maxsize
+        self._local = local()
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS cache_entries ('
+                         'key TEXT PRIMARY KEY, value TEXT NOT NULL, '
+                         'expires_at REAL NOT NULL, accessed_at REAL NOT NULL)')
+            conn.execute('CREATE TABLE IF NOT EXISTS cache_generations ('
+                         'namespace TEXT PRIMARY KEY, generation INTEGER NOT NULL)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._connect()
+        now = time.time()
+        row = conn.execute(
+            'SELECT value FROM cache_entries WHERE key = ? AND expires_at > ?',
+            (key, now)).fetchone()
+        if row is None:
+            return None
+        conn.execute('UPDATE cache_entries SET accessed_at = ? WHERE key = ?',
+                     (now, key))
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl):
+        conn = self._connect()
+        now = time.time()
+        conn.execute('INSERT OR REPLACE INTO cache_entries VALUES (?, ?, ?, ?)',
+                     (key, json.dumps(value), now + ttl, now))
+        conn.execute('DELETE FROM cache_entries WHERE expires_at <= ?', (now,))
+        conn.execute(
+            'DELETE FROM cache_entries WHERE key IN (SELECT key FROM cache_entries '
+            'ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)', (self.maxsize,))
+
+    def generation(self, namespace):
+        row = self._connect().execute(
+            'SELECT generation FROM cache_generations WHERE namespace = ?',
+            (namespace,)).fetchone()
+        return row[0] if row else 0
+
+    def bump(self, namespace):
+        self._connect().execute(
+            'INSERT INTO cache_generations VALUES (?, 1) ON CONFLICT(namespace) '
+            'DO UPDATE SET generation = generation + 1', (namespace,))
+
+    def __len__(self):
+        return self._connect().execute(
+            'SELECT COUNT(*) FROM cache_entries').fetchone()[0]
+
+
+def create_backend(url, maxsize=10000):
+    if not url or url == 'none':
+        return None
+    if url == 'memory':
+        return MemoryBackend(maxsize)
+    if url.startswith('sqlite:///'):
+        return SQLiteBackend(url[len('sqlite:///'):], maxsize)
+    raise ValueError(f'Unsupported read cache backend: {url}')
+
+
+class ReadThroughCache:
+    """Read-through cache for catalog lookups.
+
+    Keys are scoped by the generation of every table they were built from;
+    invalidating a table bumps its generation, which orphans all of its
+    entries at once and leaves them to the LRU/TTL to reclaim.
+    """
+
+    def __init__(self, backend=None, ttl=60):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def configure(self, backend, ttl=60):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def shared(self):
+        """True when generation bumps reach every worker."""
+        return getattr(self.backend, 'shared', False)
+
+    def get_or_load(self, namespaces, key, loader, cacheable=None, ttl=None):
+        """``cacheable``, if given, is called after a miss; False skips the store.
+
+        ``ttl`` overrides the cache's TTL for this entry.
+        """
+        backend = self.backend
+        if backend is None:
+            return loader()
+        scope = '|'.join(f'{ns}:{backend.generation(ns)}' for ns in namespaces)
+        full_key = f'{scope}|{key}'
+        value = backend.get(full_key)
+        if value is not None:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = loader()
+        if value is not None and (cacheable is None or cacheable()):
+            backend.set(full_key, value, self.ttl if ttl is None else ttl)
+        return value
+
+    def invalidate(self, *namespaces):
+        if self.backend is None:
+            return
+        for namespace in namespaces:
+            self.backend.bump(namespace)
+
+    def stats(self):
+        return {
+            'size': len(self.backend) if self.backend is not None else 0,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+read_cache = ReadThroughCache()
@@ -0,0 +1,177 @@
+import csv
+import io
+import json
+import os
+import time
+from datetime import datetime
+import click
+from sqlalchemy import text
+from cache import read_cache
+from models import (
+    db, bump_collection_versions, stats_summary_enabled, Movie, Actor)
+from stats import rebuild_summary
+
+IMPORT_SPECS = {
+    'movies': (Movie, {'title': str, 'release_year': int}),
+    'actors': (Actor, {'name': str, 'age': int, 'gender': str, 'movie_id': int}),
+}
+
+SQL_TYPES = {str: 'TEXT', int: 'INTEGER'}
+
+
+def read_records(path, file_format):
+    with open(path, newline='') as f:
+        if file_format == 'csv':
+            yield from csv.DictReader(f)
+        else:
+            # Lines are parsed in validated_chunks, so a malformed one is
+            # rejected like any other invalid record.
+            for line in f:
+                if line.strip():
+                    yield line
+
+
+def coerce(record, fields):
+    """Cast CSV strings to the column types the API expects."""
+    row = {}
+    for field, field_type in fields.items():
+        value = record.get(field, None)
+        if value == '':
+            value = None
+        if field_type is int and isinstance(value, str):
+            value = int(value)
+        row[field] = value
+    return row
+
+
+def validated_chunks(records, model, fields, chunk_size, errors):
+    chunk = []
+    for line, record in enumerate(records, 1):
+        try:
+            if isinstance(record, str):
+                record = json.loads(record)
+            chunk.append(model.validate(coerce(record, fields)))
+        except (ValueError, AttributeError, TypeError) as e:
+            errors.append((line, str(e)))
+            continue
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def stage_copy(connection, staging, fields, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([row[field] for field in fields])
+    buffer.seek(0)
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(
+            f'COPY {staging} ({", ".join(fields)}) FROM STDIN WITH (FORMAT csv)',
+            buffer)
+    finally:
+        cursor.close()
+
+
+def stage_executemany(connection, staging, fields, rows):
+    columns = ', '.join(fields)
+    params = ', '.join(f':{field}' for field in fields)
+    connection.execute(
+        text(f'INSERT INTO {staging} ({columns}) VALUES ({params})'), rows)
+
+
+def import_chunk(connection, name, fields, rows, use_copy):
+    """Stage one chunk, then move it into the table skipping conflicts.
+
+    Rows land in a temporary table first (COPY on PostgreSQL, executemany
+    elsewhere) so that duplicates and, for actors, unknown movie ids are
+    dropped set-wise by a single INSERT ... SELECT.
+    """
+    staging = f'import_{name}'
+    (stage_copy if use_copy else stage_executemany)(
+        connection, staging, fields, rows)
+
+    columns = ', '.join(fields)
+    selected = ', '.join(f's.{field}' for field in fields)
+    join = 'JOIN movies m ON m.id = s.movie_id' if name == 'actors' else ''
+    if connection.dialect.name == 'postgresql':
+        insert, conflict = 'INSERT INTO', 'ON CONFLICT DO NOTHING'
+    else:
+        insert, conflict = 'INSERT OR IGNORE INTO', ''
+    result = connection.execute(
+        text(f'{insert} {name} ({columns}, version, updated_at) '
+             f'SELECT {selected}, 1, :now FROM {staging} s {join} {conflict}'),
+        {'now': datetime.utcnow()})
+    connection.execute(text(f'DELETE FROM {staging}'))
+    return result.rowcount
+
+
+def import_file(name, path, file_format, chunk_size, echo=click.echo):
+    model, fields = IMPORT_SPECS[name]
+    errors = []
+    imported = total = 0
+    started = time.perf_counter()
+
+    with db.engine.connect() as connection:
+        use_copy = (connection.dialect.name == 'postgresql'
+                    and connection.dialect.driver == 'psycopg2')
+        columns = ', '.join(
+            f'{field} {SQL_TYPES[field_type]}'
+            for field, field_type in fields.items())
+        connection.execute(
+            text(f'CREATE TEMPORARY TABLE IF NOT EXISTS import_{name} ({columns})'))
+
+        records = read_records(path, file_format)
+        for rows in validated_chunks(records, model, fields, chunk_size, errors):
+            with connection.begin():
+                imported += import_chunk(connection, name, list(fields), rows,
+                                         use_copy)
+                bump_collection_versions(connection, [name])
+            read_cache.invalidate(name)
+            total += len(rows)
+            elapsed = time.perf_counter() - started
+            echo(f'{total} rows processed, {imported} imported '
+                 f'({total / elapsed:,.0f} rows/sec)')
+
+    if imported and stats_summary_enabled():
+        # Bulk rows bypass the ORM hooks that keep the summary current.
+        with db.engine.begin() as connection:
+            rebuild_summary(connection)
+        read_cache.invalidate('movies', 'actors')
+
+    elapsed = time.perf_counter() - started
+    for line, message in errors[:20]:
+        echo(f'record {line}: {message}', err=True)
+    echo(f'Imported {imported} {name} in {elapsed:.2f}s '
+         f'({imported / elapsed if elapsed else 0:,.0f} rows/sec); '
+         f'{total - imported} duplicates or unknown references skipped, '
+         f'{len(errors)} invalid records rejected.')
+    return imported, total - imported, len(errors)
+
+
+def register_commands(app):
+    @app.cli.command('import-data')
+    @click.argument('table', type=click.Choice(sorted(IMPORT_SPECS)))
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--format', 'file_format', type=click.Choice(['csv', 'ndjson']),
+                  help='Input format; defaults to the file extension.')
+    @click.option('--chunk-size', default=10000, show_default=True,
+                  help='Rows validated and written per transaction.')
+    def import_data(table, path, file_format, chunk_size):
+        """Bulk load movies or actors from a CSV or NDJSON file."""
+        if file_format is None:
+            extension = os.path.splitext(path)[1].lower()
+            file_format = 'csv' if extension == '.csv' else 'ndjson'
+        import_file(table, path, file_format, chunk_size)
+
+    @app.cli.command('rebuild-stats')
+    def rebuild_stats():
+        """Recompute the catalog_stats summary behind /stats."""
+        started = time.perf_counter()
+        with db.engine.begin() as connection:
+            rebuild_summary(connection)
+        read_cache.invalidate('movies', 'actors')
+        click.echo(f'Rebuilt catalog_stats in {time.perf_counter() - started:.2f}s')
@@ -0,0 +1,92 @@
+import zlib
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIMETYPES = frozenset({
+    'application/json', 'application/x-ndjson', 'text/csv'})
+
+
+def choose_encoding(algorithms):
+    """Pick the client's most preferred encoding that we support."""
+    accepted = request.accept_encodings
+    best, best_quality = None, 0
+    for name in algorithms:
+        if name == 'br' and brotli is None:
+            continue
+        quality = accepted[name]
+        if quality > best_quality:
+            best, best_quality = name, quality
+    return best
+
+
+def compressor(encoding, config):
+    if encoding == 'br':
+        return brotli.Compressor(quality=config['COMPRESS_BR_LEVEL'])
+    return zlib.compressobj(config['COMPRESS_LEVEL'], zlib.DEFLATED, 31)
+
+
+def compress(data, encoding, config):
+    engine = compressor(encoding, config)
+    if encoding == 'br':
+        return engine.process(data) + engine.finish()
+    return engine.compress(data) + engine.flush()
+
+
+def compress_chunks(chunks, encoding, config):
+    # Flush after every chunk so streamed exports still reach the client
+    # as they are produced, not when the compressor's window fills up.
+    engine = compressor(encoding, config)
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            if encoding == 'br':
+                data = engine.process(chunk) + engine.flush()
+            else:
+                data = engine.compress(chunk) + engine.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield engine.finish() if encoding == 'br' else engine.flush()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def compress_response(response):
+    """Negotiate gzip/brotli for JSON, NDJSON and CSV responses.
+
+    Buffered bodies under COMPRESS_MIN_SIZE are left alone; streamed ones
+    are compressed chunk by chunk since their size isn't known up front.
+    """
+    config = current_app.config
+    algorithms = config['COMPRESS_ALGORITHMS']
+    if (not algorithms or request.method == 'HEAD'
+            or response.status_code < 200 or response.status_code in (204, 304)
+            or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESS_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(algorithms)
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = compress_chunks(response.response, encoding, config)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < config['COMPRESS_MIN_SIZE']:
+            return response
+        response.set_data(compress(data, encoding, config))
+    response.headers['Content-Encoding'] = encoding
+    # The compressed bytes differ from the identity ones, so a strong
+    # validator would be wrong; conditional GETs compare weakly anyway.
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
@@ -0,0 +1,66 @@
+import csv
+import io
+import json
+from flask import Response, abort, request, stream_with_context
+from models import db
+
+EXPORT_BATCH_SIZE = 1000
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def stream_rows(columns):
+    """Yield rows in primary-key order through a server-side cursor."""
+    query = db.session.query(*columns).order_by(columns[0]).execution_options(
+        stream_results=True).yield_per(EXPORT_BATCH_SIZE)
+    for row in query:
+        yield row
+
+
+def ndjson_lines(columns):
+    names = [column.key for column in columns]
+    buffer = []
+    for row in stream_rows(columns):
+        buffer.append(json.dumps(dict(zip(names, row))))
+        if len(buffer) >= EXPORT_BATCH_SIZE:
+            yield '\n'.join(buffer) + '\n'
+            buffer = []
+    if buffer:
+        yield '\n'.join(buffer) + '\n'
+
+
+def drain(output):
+    value = output.getvalue()
+    output.seek(0)
+    output.truncate()
+    return value
+
+
+def csv_lines(columns):
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow([column.key for column in columns])
+    yield drain(output)
+    for count, row in enumerate(stream_rows(columns), 1):
+        writer.writerow(row)
+        if count % EXPORT_BATCH_SIZE == 0:
+            yield drain(output)
+    rest = drain(output)
+    if rest:
+        yield rest
+
+
+def export_response(columns, name):
+    """Stream every row of a table as NDJSON (default) or CSV."""
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        abort(400)
+    lines = ndjson_lines if export_format == 'ndjson' else csv_lines
+    response = Response(stream_with_context(lines(columns)),
+                        mimetype=EXPORT_FORMATS[export_format])
+    response.headers['Content-Disposition'] = (
+        f'attachment; filename={name}.{export_format}')
+    return response
@@ -0,0 +1,75 @@
+import logging
+import time
+from threading import Lock
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from auth import auth
+from models import db, pool_stats
+
+logger = logging.getLogger(__name__)
+
+
+def check_pool():
+    stats = pool_stats()
+    if 'size' not in stats:
+        return {'ok': True, **stats}
+    capacity = stats['size'] + stats['max_overflow']
+    return {'ok': stats['checked_out'] < capacity, **stats}
+
+
+def check_database(timeout_ms):
+    started = time.perf_counter()
+    try:
+        with db.engine.connect() as connection:
+            with connection.begin():
+                if connection.dialect.name == 'postgresql':
+                    connection.execute(text(
+                        f'SET LOCAL statement_timeout = {int(timeout_ms)}'))
+                connection.execute(text('SELECT 1'))
+    except SQLAlchemyError as e:
+        logger.warning('Readiness database check failed: %s', e)
+        return {'ok': False, 'error': type(e).__name__}
+    return {'ok': True,
+            'latency_ms': round((time.perf_counter() - started) * 1000, 2)}
+
+
+def check_jwks():
+    # A cold or expired key set only starts a background fetch here, so the
+    # probe never waits on Auth0 and the keys are warm before traffic arrives.
+    status = auth.jwks_cache.status()
+    if not status['fresh']:
+        auth.jwks_cache.warm()
+    return {'ok': status['usable'], **status}
+
+
+def run_checks(timeout_ms):
+    checks = {'pool': check_pool()}
+    if checks['pool']['ok']:
+        checks['database'] = check_database(timeout_ms)
+    else:
+        # Checking out a connection now would wait for DB_POOL_TIMEOUT.
+        checks['database'] = {'ok': False, 'error': 'pool exhausted'}
+    checks['jwks'] = check_jwks()
+    return all(check['ok'] for check in checks.values()), checks
+
+
+class Readiness:
+    """Readiness result cached for ``ttl`` seconds.
+
+    Every load balancer probe in the window shares one database round trip.
+    """
+
+    def __init__(self, ttl=2, timeout_ms=1000):
+        self.ttl = ttl
+        self.timeout_ms = timeout_ms
+        self._result = None
+        self._checked_at = None
+        self._lock = Lock()
+
+    def check(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._checked_at is None or now - self._checked_at >= self.ttl:
+                self._result = run_checks(self.timeout_ms)
+                self._checked_at = now
+            return self._result
@@ -0,0 +1,80 @@
+import hashlib
+from datetime import timezone
+from flask import request, current_app, make_response
+from models import CollectionVersion
+
+DEFAULT_CACHE_CONTROL = {
+    'health_check': 'public, max-age=5',
+    'get_metrics': 'no-store',
+    'liveness': 'no-store',
+    'readiness': 'no-store',
+    'default': 'private, no-cache',
+}
+
+
+def make_etag(*parts):
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def as_utc(value):
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def is_conditional():
+    return bool(request.if_none_match or request.if_modified_since)
+
+
+def collection_validators(*names):
+    """ETag and Last-Modified for a list response built from these tables."""
+    versions = CollectionVersion.get(*names)
+    etag = make_etag(request.path, request.query_string,
+                     [row.version if row else 0 for row in versions])
+    dates = [row.updated_at for row in versions if row is not None]
+    return etag, max(dates) if dates else None
+
+
+def resource_validators(name, resource_id, version, updated_at, *related):
+    """ETag and Last-Modified for one row, optionally embedding other tables."""
+    versions = CollectionVersion.get(*related) if related else []
+    etag = make_etag(name, resource_id, version, request.query_string,
+                     [row.version if row else 0 for row in versions])
+    dates = [updated_at] + [row.updated_at for row in versions if row]
+    return etag, max(dates)
+
+
+def not_modified(etag, last_modified=None):
+    """Return a 304 response if the request's validators still match."""
+    if request.if_none_match:
+        # Weak comparison (RFC 7232): compression marks ETags weak.
+        matched = request.if_none_match.contains_weak(etag)
+    elif request.if_modified_since and last_modified is not None:
+        last_modified = as_utc(last_modified).replace(microsecond=0)
+        matched = last_modified <= request.if_modified_since
+    else:
+        matched = False
+    if not matched:
+        return None
+    return set_validators(make_response('', 304), etag, last_modified)
+
+
+def set_validators(response, etag, last_modified=None):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = as_utc(last_modified)
+    return response
+
+
+def apply_cache_control(response):
+    if request.method not in ('GET', 'HEAD'):
+        return response
+    if response.status_code not in (200, 304):
+        return response
+    if 'Cache-Control' in response.headers:
+        return response
+    policies = current_app.config['CACHE_CONTROL']
+    policy = policies.get(request.endpoint, policies.get('default'))
+    if policy:
+        response.headers['Cache-Control'] = policy
+    return response
@@ -0,0 +1,49 @@
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson.
+
+    Dates, decimals, UUIDs and dataclasses still go through Flask's
+    ``default`` hook, so responses parse to the same JSON as with the
+    stdlib provider. Non-ASCII text is written as raw UTF-8 instead of
+    ``\\u`` escapes, and integers beyond 64 bits raise ``TypeError``.
+    """
+
+    def _options(self, indent=False):
+        option = (orjson.OPT_PASSTHROUGH_DATETIME
+                  | orjson.OPT_PASSTHROUGH_DATACLASS
+                  | orjson.OPT_NON_STR_KEYS)
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default,
+                            option=self._options()).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        body = orjson.dumps(obj, default=self.default,
+                            option=self._options(indent) | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def create_json_provider(app, name):
+    """'orjson' (the default) falls back to the stdlib when it is missing."""
+    if name == 'orjson' and orjson is not None:
+        return OrjsonProvider(app)
+    if name not in ('orjson', 'default'):
+        raise ValueError(f'Unsupported JSON provider: {name}')
+    return DefaultJSONProvider(app)
@@ -0,0 +1,220 @@
+import logging
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+PROMETHEUS_MIMETYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10)
+METRIC_HELP = {
+    'http_request_duration_seconds': ('histogram', 'Request latency by route.'),
+    'http_request_queries': ('histogram', 'SQL statements issued per request.'),
+    'db_query_duration_seconds': ('histogram', 'SQL statement latency.'),
+    'db_slow_queries_total': ('counter', 'Statements slower than SLOW_QUERY_MS.'),
+    'auth_token_verify_seconds': ('histogram', 'Bearer token verification time.'),
+    'auth_jwks_fetch_seconds': ('histogram', 'Auth0 JWKS fetch time.'),
+    'serialize_duration_seconds': ('histogram', 'JSON response encoding time.'),
+    'cache_hits_total': ('counter', 'Cache lookups served from the cache.'),
+    'cache_misses_total': ('counter', 'Cache lookups that missed.'),
+    'cache_entries': ('gauge', 'Entries currently held by the cache.'),
+    'db_pool_connections': ('gauge', 'Pooled connections by state.'),
+    'rate_limited_total': ('counter', 'Requests rejected with 429, by budget.'),
+}
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def format_labels(labels, **extra):
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"')
+               .replace('\n', '\\n') for _, value in items)
+    return '{' + ','.join(f'{name}="{value}"'
+                          for (name, _), value in zip(items, escaped)) + '}'
+
+
+class Metrics:
+    """Per-process counters and histograms, rendered in Prometheus text format.
+
+    Each worker keeps its own numbers; Prometheus sums them across the
+    scraped targets.
+    """
+
+    def __init__(self):
+        self.slow_query_seconds = None
+        self._lock = Lock()
+        self._histograms = {}
+        self._counters = {}
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def histogram(self, name, **labels):
+        return self._histograms.get((name, tuple(sorted(labels.items()))))
+
+    def counter(self, name, **labels):
+        return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def render(self, samples=()):
+        """Exposition text; ``samples`` adds (name, labels, value) read at scrape time."""
+        families = {}
+        with self._lock:
+            for (name, labels), histogram in self._histograms.items():
+                lines = families.setdefault(name, [])
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ('+Inf',),
+                                        histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket'
+                                 f'{format_labels(labels, le=bound)} {cumulative}')
+                lines.append(f'{name}_sum{format_labels(labels)} {histogram.sum}')
+                lines.append(f'{name}_count{format_labels(labels)} {histogram.count}')
+            for (name, labels), value in self._counters.items():
+                families.setdefault(name, []).append(
+                    f'{name}{format_labels(labels)} {value}')
+        for name, labels, value in samples:
+            families.setdefault(name, []).append(
+                f'{name}{format_labels(sorted(labels.items()))} {value}')
+
+        output = []
+        for name in sorted(families):
+            kind, description = METRIC_HELP.get(name, ('untyped', name))
+            output.append(f'# HELP {name} {description}')
+            output.append(f'# TYPE {name} {kind}')
+            output.extend(families[name])
+        return '\n'.join(output) + '\n'
+
+
+metrics = Metrics()
+
+
+def record(name, seconds):
+    """Add ``seconds`` to this request's Server-Timing entry for ``name``."""
+    if has_request_context():
+        timings = g.setdefault('timings', {})
+        timings[name] = timings.get(name, 0) + seconds
+
+
+@contextmanager
+def timer(name, metric=None, **labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        record(name, elapsed)
+        if metric:
+            metrics.observe(metric, elapsed, **labels)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_query(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('query_started')
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    metrics.observe('db_query_duration_seconds', elapsed)
+    if has_request_context():
+        record('db', elapsed)
+        g.query_count = g.get('query_count', 0) + 1
+    threshold = metrics.slow_query_seconds
+    if threshold is not None and elapsed >= threshold:
+        metrics.inc('db_slow_queries_total')
+        # Parameters are left out on purpose; they may hold user data.
+        logger.warning('Slow query (%.1f ms): %s', elapsed * 1000, statement)
+
+
+@event.listens_for(Engine, 'handle_error')
+def discard_query_timer(context):
+    started = context.connection.info.get('query_started') if context.connection else None
+    if started:
+        started.pop()
+
+
+def server_timing(timings, total, query_count):
+    entries = []
+    for name, seconds in timings.items():
+        entry = f'{name};dur={seconds * 1000:.2f}'
+        if name == 'db':
+            entry += f';desc="{query_count} queries"'
+        entries.append(entry)
+    entries.append(f'total;dur={total * 1000:.2f}')
+    return ', '.join(entries)
+
+
+def init_app(app):
+    """Time requests, queries and JSON encoding; call before other after_request hooks."""
+    slow_query_ms = app.config['SLOW_QUERY_MS']
+    metrics.slow_query_seconds = (
+        slow_query_ms / 1000 if slow_query_ms and slow_query_ms > 0 else None)
+
+    # jsonify() goes through app.json.response, so wrapping it here times
+    # encoding for every JSON view without touching the providers.
+    provider_response = app.json.response
+
+    def timed_response(*args, **kwargs):
+        with timer('serialize', 'serialize_duration_seconds'):
+            return provider_response(*args, **kwargs)
+    app.json.response = timed_response
+
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+
+    # Registered first, so it runs last and includes the other hooks.
+    @app.after_request
+    def record_request(response):
+        started = g.pop('request_started', None)
+        if started is None:
+            return response
+        total = time.perf_counter() - started
+        query_count = g.pop('query_count', 0)
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe('http_request_duration_seconds', total,
+                        method=request.method, route=route,
+                        status=response.status_code)
+        metrics.observe('http_request_queries', query_count,
+                        buckets=QUERY_BUCKETS, route=route)
+        if current_app.config['SERVER_TIMING']:
+            response.headers['Server-Timing'] = server_timing(
+                g.pop('timings', {}), total, query_count)
+        return response
@@ -0,0 +1,59 @@
+"""unique movie and actor keys
+
+Revision ID: a4e8d2c7f1b3
+Revises: 6c3f2a1d9b7e
+Create Date: 2026-10-18 10:03:17.228406
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4e8d2c7f1b3'
+down_revision = '6c3f2a1d9b7e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Collapse rows that the old check-then-insert let through concurrently,
+    # pointing actors at the surviving copy of each movie.
+    op.execute('''
+        UPDATE actors SET movie_id = (
+            SELECT MIN(m2.id) FROM movies m1
+            JOIN movies m2
+              ON m2.title = m1.title AND m2.release_year = m1.release_year
+            WHERE m1.id = actors.movie_id)
+        WHERE movie_id IN (
+            SELECT id FROM movies
+            WHERE title IS NOT NULL AND release_year IS NOT NULL)
+    ''')
+    op.execute('''
+        DELETE FROM movies
+        WHERE title IS NOT NULL AND release_year IS NOT NULL
+          AND id NOT IN (
+            SELECT MIN(id) FROM movies GROUP BY title, release_year)
+    ''')
+    op.execute('''
+        DELETE FROM actors
+        WHERE name IS NOT NULL AND age IS NOT NULL AND gender IS NOT NULL
+          AND id NOT IN (
+            SELECT MIN(id) FROM actors GROUP BY name, age, gender, movie_id)
+    ''')
+
+    with op.batch_alter_table('movies') as batch_op:
+        batch_op.create_unique_constraint(
+            'uq_movies_title_release_year', ['title', 'release_year'])
+    with op.batch_alter_table('actors') as batch_op:
+        batch_op.create_unique_constraint(
+            'uq_actors_name_age_gender_movie_id',
+            ['name', 'age', 'gender', 'movie_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('actors') as batch_op:
+        batch_op.drop_constraint(
+            'uq_actors_name_age_gender_movie_id', type_='unique')
+    with op.batch_alter_table('movies') as batch_op:
+        batch_op.drop_constraint('uq_movies_title_release_year', type_='unique')
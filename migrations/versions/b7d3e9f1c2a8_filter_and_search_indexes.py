@@ -0,0 +1,72 @@
+"""filter and search indexes
+
+Revision ID: b7d3e9f1c2a8
+Revises: e5f0c8b2a9d6
+Create Date: 2026-10-18 20:52:31.604118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d3e9f1c2a8'
+down_revision = 'e5f0c8b2a9d6'
+branch_labels = None
+depends_on = None
+
+SEARCH_COLUMNS = {'movies': 'title', 'actors': 'name'}
+
+
+def sqlite_statements(table, column):
+    fts = f'{table}_fts'
+    return [
+        f"CREATE VIRTUAL TABLE {fts} USING fts5({column}, "
+        f"content='{table}', content_rowid='id', tokenize='trigram')",
+        f"CREATE TRIGGER {fts}_insert AFTER INSERT ON {table} "
+        f"BEGIN INSERT INTO {fts}(rowid, {column}) "
+        f"VALUES (new.id, new.{column}); END",
+        f"CREATE TRIGGER {fts}_delete AFTER DELETE ON {table} "
+        f"BEGIN INSERT INTO {fts}({fts}, rowid, {column}) "
+        f"VALUES ('delete', old.id, old.{column}); END",
+        f"CREATE TRIGGER {fts}_update AFTER UPDATE OF {column} "
+        f"ON {table} BEGIN INSERT INTO {fts}({fts}, rowid, {column}) "
+        f"VALUES ('delete', old.id, old.{column}); "
+        f"INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column}); END",
+        f"INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+    ]
+
+
+def upgrade():
+    # Range filters. On SQLite, title and name prefixes use the leading
+    # column of the unique constraints; PostgreSQL compares prefix ranges
+    # in the "C" collation, which needs its own index.
+    op.create_index('ix_movies_release_year', 'movies', ['release_year'])
+    op.create_index('ix_actors_age', 'actors', ['age'])
+
+    dialect = op.get_bind().dialect.name
+    for table, column in SEARCH_COLUMNS.items():
+        if dialect == 'sqlite':
+            for statement in sqlite_statements(table, column):
+                op.execute(statement)
+        elif dialect == 'postgresql':
+            op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            op.execute(f'CREATE INDEX ix_{table}_{column}_trgm ON {table} '
+                       f'USING gin ({column} gin_trgm_ops)')
+            op.execute(f'CREATE INDEX ix_{table}_{column}_prefix ON {table} '
+                       f'({column} COLLATE "C")')
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    for table, column in SEARCH_COLUMNS.items():
+        if dialect == 'sqlite':
+            for trigger in ('insert', 'delete', 'update'):
+                op.execute(f'DROP TRIGGER {table}_fts_{trigger}')
+            op.execute(f'DROP TABLE {table}_fts')
+        elif dialect == 'postgresql':
+            op.drop_index(f'ix_{table}_{column}_trgm', table_name=table)
+            op.drop_index(f'ix_{table}_{column}_prefix', table_name=table)
+
+    op.drop_index('ix_actors_age', table_name='actors')
+    op.drop_index('ix_movies_release_year', table_name='movies')
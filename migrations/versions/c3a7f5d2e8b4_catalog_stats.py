@@ -0,0 +1,31 @@
+"""catalog stats
+
+Revision ID: c3a7f5d2e8b4
+Revises: b7d3e9f1c2a8
+Create Date: 2026-10-18 23:10:42.518307
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3a7f5d2e8b4'
+down_revision = 'b7d3e9f1c2a8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Left empty: it is only maintained with STATS_SUMMARY on, so populate
+    # it with `flask rebuild-stats` when turning that on.
+    op.create_table('catalog_stats',
+    sa.Column('dimension', sa.String(), nullable=False),
+    sa.Column('bucket', sa.String(), nullable=False),
+    sa.Column('total', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('dimension', 'bucket')
+    )
+
+
+def downgrade():
+    op.drop_table('catalog_stats')
@@ -0,0 +1,27 @@
+"""index actors.movie_id
+
+Revision ID: d91b5e3a07c4
+Revises: a4e8d2c7f1b3
+Create Date: 2026-10-18 11:26:52.914730
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd91b5e3a07c4'
+down_revision = 'a4e8d2c7f1b3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Title and name lookups are served by the leading column of the
+    # unique constraints added in a4e8d2c7f1b3, so only the foreign key
+    # needs its own index.
+    op.create_index('ix_actors_movie_id', 'actors', ['movie_id'])
+
+
+def downgrade():
+    op.drop_index('ix_actors_movie_id', table_name='actors')
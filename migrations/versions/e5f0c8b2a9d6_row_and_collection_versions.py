@@ -0,0 +1,48 @@
+"""row and collection versions
+
+Revision ID: e5f0c8b2a9d6
+Revises: d91b5e3a07c4
+Create Date: 2026-10-18 13:41:08.377152
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5f0c8b2a9d6'
+down_revision = 'd91b5e3a07c4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('movies', 'actors'):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.add_column(sa.Column(
+                'version', sa.Integer(), nullable=False, server_default='1'))
+            batch_op.add_column(sa.Column(
+                'updated_at', sa.DateTime(), nullable=True))
+        op.execute(f'UPDATE {table} SET updated_at = CURRENT_TIMESTAMP')
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column('updated_at', nullable=False)
+
+    collection_versions = op.create_table('collection_versions',
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.execute(collection_versions.insert().from_select(
+        ['name', 'version', 'updated_at'],
+        sa.select(sa.literal('movies'), sa.literal(1), sa.func.current_timestamp())
+        .union_all(sa.select(
+            sa.literal('actors'), sa.literal(1), sa.func.current_timestamp()))))
+
+
+def downgrade():
+    op.drop_table('collection_versions')
+    for table in ('actors', 'movies'):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('updated_at')
+            batch_op.drop_column('version')
@@ -1,31 +1,375 @@
 import os
-from sqlalchemy import Column, String, Integer
-from flask_sqlalchemy import SQLAlchemy
+import time
+import logging
+from datetime import datetime
+from collections import Counter
+from itertools import chain
+from flask import current_app, has_app_context
+from sqlalchemy import (
+    DDL, Column, String, Integer, DateTime, and_, event, inspect, or_)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import DisconnectionError, IntegrityError
+from sqlalchemy.pool import Pool, QueuePool
+from flask_sqlalchemy import SignallingSession
 from flask_migrate import Migrate
+from cache import read_cache
+from replicas import RoutingSQLAlchemy, init_replicas
 
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 migrate = Migrate()
-database_path = os.environ['DATABASE_URL']
-if database_path.startswith("postgres://"):
-  database_path = database_path.replace("postgres://", "postgresql://", 1)
 
-db = SQLAlchemy()
 
+logger = logging.getLogger(__name__)
 
-def setup_db(app, database_path=database_path):
+POOL_WARNING_INTERVAL = 60
+_last_pool_warning = 0
+
+
+def env_flag(environ, name, default):
+    value = environ.get(name)
+    if value is None:
+        return default
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+
+def engine_options(database_path, environ=os.environ):
+    """Build SQLALCHEMY_ENGINE_OPTIONS from DB_* environment variables."""
+    options = {
+        'pool_pre_ping': env_flag(environ, 'DB_POOL_PRE_PING', True),
+    }
+    if database_path.startswith('sqlite'):
+        return options
+
+    options.update({
+        'pool_size': int(environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': int(environ.get('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(environ.get('DB_POOL_RECYCLE', 1800)),
+        'pool_use_lifo': env_flag(environ, 'DB_POOL_USE_LIFO', True),
+    })
+    if database_path.startswith('postgresql'):
+        connect_args = {
+            'connect_timeout': int(environ.get('DB_CONNECT_TIMEOUT', 10)),
+        }
+        statement_timeout = environ.get('DB_STATEMENT_TIMEOUT_MS')
+        if statement_timeout:
+            connect_args['options'] = (
+                f'-c statement_timeout={int(statement_timeout)}')
+        options['connect_args'] = connect_args
+    return options
+
+
+def pool_stats(engine=None):
+    pool = (engine or db.engine).pool
+    if not isinstance(pool, QueuePool):
+        return {'pool': type(pool).__name__}
+    return {
+        'pool': type(pool).__name__,
+        'size': pool.size(),
+        'checked_in': pool.checkedin(),
+        'checked_out': pool.checkedout(),
+        'overflow': max(pool.overflow(), 0),
+        'max_overflow': pool._max_overflow,
+    }
+
+
+@event.listens_for(Pool, 'connect')
+def record_connection_pid(dbapi_connection, connection_record):
+    connection_record.info['pid'] = os.getpid()
+
+
+@event.listens_for(Pool, 'checkout')
+def check_connection_pid(dbapi_connection, connection_record, connection_proxy):
+    # A connection inherited across fork() (e.g. gunicorn --preload) must
+    # never be shared with the parent; drop it and let the pool reconnect.
+    pid = os.getpid()
+    if connection_record.info.get('pid', pid) != pid:
+        connection_record.dbapi_connection = connection_proxy.dbapi_connection = None
+        raise DisconnectionError(
+            f'Connection record belongs to pid {connection_record.info["pid"]}, '
+            f'attempting to check out in pid {pid}')
+
+    global _last_pool_warning
+    pool = connection_proxy._pool
+    if isinstance(pool, QueuePool) and pool.overflow() > 0:
+        now = time.monotonic()
+        if now - _last_pool_warning >= POOL_WARNING_INTERVAL:
+            _last_pool_warning = now
+            logger.warning('Connection pool using overflow: %s', pool.status())
+
+
+def get_database_path(environ=os.environ):
+    database_path = environ.get('DATABASE_URL')
+    if not database_path:
+        raise RuntimeError('DATABASE_URL is not set')
+    if database_path.startswith("postgres://"):
+        database_path = database_path.replace("postgres://", "postgresql://", 1)
+    return database_path
+
+
+def setup_db(app, database_path=None):
+    if database_path is None:
+        database_path = get_database_path()
     app.config['SQLALCHEMY_DATABASE_URI'] = database_path
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    options = engine_options(database_path)
+    options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+    init_replicas(app)
     db.app = app
     db.init_app(app)
     migrate.init_app(app, db)
-    db.create_all()
+
+
+def is_unique_violation(error):
+    if not isinstance(error, IntegrityError):
+        return False
+    orig = error.orig
+    if getattr(orig, 'pgcode', None) == '23505':
+        return True
+    return 'UNIQUE constraint failed' in str(orig)
+
+class CollectionVersion(db.Model):
+    """Row version of a whole table, bumped by every write to it."""
+    __tablename__ = 'collection_versions'
+    name = Column(String(), primary_key=True)
+    version = Column(Integer(), nullable=False, default=0)
+    updated_at = Column(DateTime(), nullable=False, default=datetime.utcnow)
+
+    @classmethod
+    def get(cls, *names):
+        rows = {row.name: row for row in cls.query.filter(cls.name.in_(names))}
+        return [rows.get(name) for name in names]
+
+
+def bump_collection_versions(connection, names):
+    table = CollectionVersion.__table__
+    now = datetime.utcnow()
+    for name in sorted(names):
+        result = connection.execute(
+            table.update()
+            .where(table.c.name == name)
+            .values(version=table.c.version + 1, updated_at=now))
+        if result.rowcount == 0:
+            connection.execute(
+                table.insert().values(name=name, version=1, updated_at=now))
+
+
+@event.listens_for(SignallingSession, 'before_flush')
+def track_collection_changes(session, flush_context, instances):
+    names = {
+        obj.__tablename__ for obj in chain(session.new, session.deleted)
+        if isinstance(obj, (Movie, Actor))
+    }
+    names.update(
+        obj.__tablename__ for obj in session.dirty
+        if isinstance(obj, (Movie, Actor)) and session.is_modified(obj))
+    if names:
+        bump_collection_versions(session.connection(), names)
+        session.info.setdefault('changed_tables', set()).update(names)
+
+
+class CatalogStat(db.Model):
+    """Materialized row count for one group of a /stats breakdown.
+
+    Maintained in the writing transaction when STATS_SUMMARY is on; run
+    `flask rebuild-stats` after turning it on or after bulk loads.
+    """
+    __tablename__ = 'catalog_stats'
+    dimension = Column(String(), primary_key=True)
+    bucket = Column(String(), primary_key=True)
+    total = Column(Integer(), nullable=False, default=0)
+
+
+AGE_BUCKET = 10
+UPSERTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+
+def movie_stat_keys(release_year):
+    keys = [('movies', '')]
+    if release_year is not None:
+        keys.append(('movies_by_year', str(release_year)))
+    return keys
+
+
+def actor_stat_keys(age, gender):
+    keys = [('actors', '')]
+    if gender is not None:
+        keys.append(('actors_by_gender', gender))
+    if isinstance(age, str) and age.strip().lstrip('-').isdigit():
+        # PATCH stores values as sent; the integer column coerces "30".
+        age = int(age)
+    if isinstance(age, int):
+        keys.append(('actors_by_age', str(age - age % AGE_BUCKET)))
+    return keys
+
+
+def old_value(obj, name):
+    history = inspect(obj).attrs[name].history
+    if history.deleted:
+        return history.deleted[0]
+    return history.unchanged[0] if history.unchanged else getattr(obj, name)
+
+
+def stats_summary_enabled(session=None):
+    # Sessions made outside Flask, like the ASGI app's, carry the flag.
+    if session is not None and 'stats_summary' in session.info:
+        return session.info['stats_summary']
+    return has_app_context() and current_app.config.get('STATS_SUMMARY', False)
+
+
+@event.listens_for(SignallingSession, 'before_flush')
+def track_stat_removals(session, flush_context, instances):
+    # Old values must be read before the flush deletes or overwrites them;
+    # additions wait for after_flush, when new rows have their ids.
+    if not stats_summary_enabled(session):
+        return
+    pending = session.info.setdefault('stat_changes', {
+        'counts': Counter(), 'actors_per_movie': Counter(),
+        'deleted_movies': set()})
+    for obj in session.deleted:
+        if isinstance(obj, Movie):
+            pending['counts'].subtract(movie_stat_keys(obj.release_year))
+            pending['deleted_movies'].add(obj.id)
+        elif isinstance(obj, Actor):
+            pending['counts'].subtract(actor_stat_keys(obj.age, obj.gender))
+            pending['actors_per_movie'][obj.movie_id] -= 1
+    for obj in session.dirty:
+        if isinstance(obj, Movie) and session.is_modified(obj):
+            pending['counts'].subtract(
+                movie_stat_keys(old_value(obj, 'release_year')))
+        elif isinstance(obj, Actor) and session.is_modified(obj):
+            pending['counts'].subtract(actor_stat_keys(
+                old_value(obj, 'age'), old_value(obj, 'gender')))
+            pending['actors_per_movie'][old_value(obj, 'movie_id')] -= 1
+
+
+@event.listens_for(SignallingSession, 'after_flush')
+def apply_stat_changes(session, flush_context):
+    pending = session.info.pop('stat_changes', None)
+    if pending is None:
+        return
+    counts = pending['counts']
+    actors_per_movie = pending['actors_per_movie']
+    created_movies = set()
+    for obj in chain(session.new, session.dirty):
+        if obj in session.dirty and not session.is_modified(obj):
+            continue
+        if isinstance(obj, Movie):
+            counts.update(movie_stat_keys(obj.release_year))
+            if obj in session.new:
+                created_movies.add(obj.id)
+        elif isinstance(obj, Actor):
+            counts.update(actor_stat_keys(obj.age, obj.gender))
+            actors_per_movie[obj.movie_id] += 1
+    update_catalog_stats(session.connection(), counts, actors_per_movie,
+                         created_movies, pending['deleted_movies'])
+
+
+def upsert_stats(connection, rows):
+    """Add each row's total to its group, creating missing groups."""
+    table = CatalogStat.__table__
+    upsert = UPSERTS.get(connection.dialect.name)
+    if upsert is not None:
+        # One statement for every group a flush touched.
+        statement = upsert(table).values(rows)
+        connection.execute(statement.on_conflict_do_update(
+            index_elements=['dimension', 'bucket'],
+            set_={'total': table.c.total + statement.excluded.total}))
+        return
+    for row in rows:
+        result = connection.execute(
+            table.update()
+            .where(table.c.dimension == row['dimension'],
+                   table.c.bucket == row['bucket'])
+            .values(total=table.c.total + row['total']))
+        if result.rowcount == 0:
+            connection.execute(table.insert().values(**row))
+
+
+def update_catalog_stats(connection, counts, actors_per_movie,
+                         created_movies=(), deleted_movies=()):
+    """Apply count deltas, moving each touched movie between
+    actors-per-movie groups."""
+    table = CatalogStat.__table__
+    movie_ids = sorted({m for m, delta in actors_per_movie.items() if delta}
+                       | set(created_movies) | set(deleted_movies), key=str)
+    emptied = set()
+    if movie_ids:
+        # Apply the per-movie deltas first and read the totals back while
+        # holding the row locks, so concurrent writers to one movie never
+        # both start from the same total.
+        buckets = [str(m) for m in movie_ids]
+        upsert_stats(connection, [
+            {'dimension': 'actors_by_movie', 'bucket': str(m),
+             'total': actors_per_movie[m]} for m in movie_ids])
+        totals = {bucket: total for bucket, total in connection.execute(
+            table.select().with_only_columns(table.c.bucket, table.c.total)
+            .where(table.c.dimension == 'actors_by_movie',
+                   table.c.bucket.in_(buckets))
+            .with_for_update())}
+        for movie_id in movie_ids:
+            total = totals[str(movie_id)]
+            before = None if movie_id in created_movies else (
+                total - actors_per_movie[movie_id])
+            after = None if movie_id in deleted_movies else total
+            if before is not None:
+                counts[('movies_by_actor_count', str(before))] -= 1
+            if after is not None:
+                counts[('movies_by_actor_count', str(after))] += 1
+            else:
+                counts[('actors_by_movie', str(movie_id))] -= total
+        emptied.update(('actors_by_movie', bucket) for bucket in buckets)
+
+    deltas = [{'dimension': dimension, 'bucket': key, 'total': delta}
+              for (dimension, key), delta in sorted(counts.items()) if delta]
+    if deltas:
+        upsert_stats(connection, deltas)
+    emptied.update((row['dimension'], row['bucket'])
+                   for row in deltas if row['total'] < 0)
+    if emptied:
+        connection.execute(table.delete().where(table.c.total == 0, or_(*(
+            and_(table.c.dimension == dimension, table.c.bucket == bucket)
+            for dimension, bucket in sorted(emptied)))))
+
+
+@event.listens_for(SignallingSession, 'after_commit')
+def invalidate_read_cache(session):
+    names = session.info.pop('changed_tables', None)
+    if names:
+        read_cache.invalidate(*names)
+
+
+@event.listens_for(SignallingSession, 'after_rollback')
+def forget_changed_tables(session):
+    session.info.pop('changed_tables', None)
+    session.info.pop('stat_changes', None)
+
 
 class Movie(db.Model):
     __tablename__ = 'movies'
+    __table_args__ = (
+        db.UniqueConstraint('title', 'release_year',
+                            name='uq_movies_title_release_year'),
+    )
     id = Column(Integer(), primary_key=True)
     title = Column(String())
-    release_year = Column(Integer())
-    actors = db.relationship('Actor', backref='movies')
+    release_year = Column(Integer(), index=True)
+    version = Column(Integer(), nullable=False, server_default='1')
+    updated_at = Column(DateTime(), nullable=False, default=datetime.utcnow,
+                        onupdate=datetime.utcnow)
+    actors = db.relationship('Actor', backref='movies', order_by='Actor.id')
+    __mapper_args__ = {'version_id_col': version}
+
+    @staticmethod
+    def validate(data):
+        title = data.get('title', None)
+        release_year = data.get('release_year', None)
+        if not isinstance(title, str) or not isinstance(release_year, int):
+            raise ValueError('title must be a string and release_year an integer')
+        if not title or not release_year:
+            raise ValueError('title and release_year are required')
+        return {'title': title, 'release_year': release_year}
 
     def insert(self):
         db.session.add(self)
@@ -38,24 +382,54 @@ class Movie(db.Model):
         db.session.delete(self)
         db.session.commit()
 
-    def format(self):
-        return {
+    def format(self, include_actors=False):
+        movie = {
             'id': self.id,
             'title': self.title,
             'release_year': self.release_year
         }
+        if include_actors:
+            movie['actors'] = [actor.format() for actor in self.actors]
+        return movie
 
 class Actor(db.Model):
     __tablename__ = 'actors'
+    __table_args__ = (
+        db.UniqueConstraint('name', 'age', 'gender', 'movie_id',
+                            name='uq_actors_name_age_gender_movie_id'),
+    )
     id = Column(Integer(), primary_key=True)
     name = Column(String())
-    age = Column(Integer())
+    age = Column(Integer(), index=True)
     gender = Column(String())
 
     movie_id = db.Column(
         db.Integer,
         db.ForeignKey('movies.id'),
-        nullable=False)
+        nullable=False,
+        index=True)
+    version = Column(Integer(), nullable=False, server_default='1')
+    updated_at = Column(DateTime(), nullable=False, default=datetime.utcnow,
+                        onupdate=datetime.utcnow)
+    __mapper_args__ = {'version_id_col': version}
+
+    @staticmethod
+    def validate(data):
+        fields = {
+            'name': data.get('name', None),
+            'age': data.get('age', None),
+            'gender': data.get('gender', None),
+            'movie_id': data.get('movie_id', None),
+        }
+        if not (isinstance(fields['name'], str)
+                and isinstance(fields['gender'], str)
+                and isinstance(fields['age'], int)
+                and isinstance(fields['movie_id'], int)):
+            raise ValueError('name and gender must be strings, '
+                             'age and movie_id integers')
+        if not all(fields.values()):
+            raise ValueError('name, age, gender and movie_id are required')
+        return fields
 
     def insert(self):
         db.session.add(self)
@@ -68,11 +442,63 @@ class Actor(db.Model):
         db.session.delete(self)
         db.session.commit()
 
-    def format(self):
-        return {
+    def format(self, include_movie=False):
+        actor = {
             'id': self.id,
             'movie_id': self.movie_id,
             'name': self.name,
             'age': self.age,
             'gender': self.gender,
-        }
\ No newline at end of file
+        }
+        if include_movie:
+            actor['movie'] = self.movies.format()
+        return actor
+
+
+SEARCH_COLUMNS = {'movies': 'title', 'actors': 'name'}
+
+
+def search_index_ddl(table, column):
+    """Statements that index table.column for ?q= substring search.
+
+    SQLite gets an external-content FTS5 table with the trigram tokenizer,
+    kept in sync by triggers; PostgreSQL a pg_trgm GIN index for ILIKE,
+    plus a "C" collation btree for prefix ranges (see prefix_match).
+    """
+    fts = f'{table}_fts'
+    sqlite = [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({column}, "
+        f"content='{table}', content_rowid='id', tokenize='trigram')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} "
+        f"BEGIN INSERT INTO {fts}(rowid, {column}) "
+        f"VALUES (new.id, new.{column}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} "
+        f"BEGIN INSERT INTO {fts}({fts}, rowid, {column}) "
+        f"VALUES ('delete', old.id, old.{column}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF {column} "
+        f"ON {table} BEGIN INSERT INTO {fts}({fts}, rowid, {column}) "
+        f"VALUES ('delete', old.id, old.{column}); "
+        f"INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column}); END",
+    ]
+    postgresql = [
+        'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+        f'CREATE INDEX IF NOT EXISTS ix_{table}_{column}_trgm '
+        f'ON {table} USING gin ({column} gin_trgm_ops)',
+        f'CREATE INDEX IF NOT EXISTS ix_{table}_{column}_prefix '
+        f'ON {table} ({column} COLLATE "C")',
+    ]
+    return {'sqlite': sqlite, 'postgresql': postgresql}
+
+
+def add_search_index_ddl(table):
+    ddl = search_index_ddl(table.name, SEARCH_COLUMNS[table.name])
+    for dialect, statements in ddl.items():
+        for statement in statements:
+            event.listen(table, 'after_create',
+                         DDL(statement).execute_if(dialect=dialect))
+    event.listen(table, 'before_drop', DDL(
+        f'DROP TABLE IF EXISTS {table.name}_fts').execute_if(dialect='sqlite'))
+
+
+add_search_index_ddl(Movie.__table__)
+add_search_index_ddl(Actor.__table__)
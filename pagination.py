@@ -0,0 +1,68 @@
+import time
+from threading import Lock
+from flask import current_app, request, abort
+from sqlalchemy import func
+from models import db
+
+MAX_PAGE_SIZE = 100
+COUNT_CACHE_TTL = 30
+
+_count_cache = {}
+_count_lock = Lock()
+
+
+def get_page_args(default_limit, args=None, max_size=None):
+    if args is None:
+        args = request.args
+    if max_size is None:
+        max_size = current_app.config.get('MAX_PAGE_SIZE', MAX_PAGE_SIZE)
+    page = args.get('page', 1, type=int)
+    after = args.get('after', None, type=int)
+    limit = args.get('limit', default_limit, type=int)
+    if page < 1 or limit < 1 or (after is not None and after < 0):
+        abort(400)
+    return page, after, min(limit, max_size)
+
+
+def paginate(query, model, default_limit):
+    """Apply the request's ?page=/?after=/?limit= to query in SQL.
+
+    ?after=<id> switches to keyset mode, which seeks on the primary key
+    instead of skipping rows so deep pages cost the same as the first one.
+    Returns the page items and a dict of paging metadata for the response.
+    """
+    page, after, limit = get_page_args(default_limit)
+    query = query.order_by(model.id)
+    if after is not None:
+        items = query.filter(model.id > after).limit(limit).all()
+    else:
+        items = query.offset((page - 1) * limit).limit(limit).all()
+
+    meta = {
+        'next_cursor': items[-1].id if len(items) == limit else None
+    }
+    if request.args.get('count', 'false').lower() in ('1', 'true'):
+        if query.whereclause is None:
+            meta['total'] = cached_count(model)
+        else:
+            meta['total'] = query.with_entities(
+                func.count(model.id)).order_by(None).scalar()
+    return items, meta
+
+
+def cached_count(model):
+    key = model.__tablename__
+    now = time.monotonic()
+    with _count_lock:
+        cached = _count_cache.get(key)
+        if cached is not None and cached[1] > now:
+            return cached[0]
+    total = db.session.query(func.count(model.id)).scalar()
+    with _count_lock:
+        _count_cache[key] = (total, now + COUNT_CACHE_TTL)
+    return total
+
+
+def clear_count_cache():
+    with _count_lock:
+        _count_cache.clear()
@@ -0,0 +1,187 @@
+import math
+import sqlite3
+import time
+from collections import OrderedDict
+from threading import Lock, local
+from flask import abort, request
+from metrics import metrics
+
+DEFAULT_LIMITS = 'default=10/20'
+
+
+def parse_limits(spec):
+    """'default=10/20,get:actors=2/10' -> {name: (tokens per second, burst)}."""
+    limits = {}
+    for item in spec.split(','):
+        if not item.strip():
+            continue
+        name, _, limit = item.partition('=')
+        rate, _, burst = limit.partition('/')
+        limits[name.strip()] = (float(rate), float(burst or rate))
+    return limits
+
+
+def take_token(tokens, updated_at, now, rate, burst):
+    """Refill the bucket, then take a token from it.
+
+    Returns the tokens left and how many seconds to wait; the wait is 0
+    when a token was taken.
+    """
+    tokens = min(burst, tokens + max(now - updated_at, 0) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0
+    return tokens, (1 - tokens) / rate
+
+
+class MemoryBuckets:
+    """Token buckets for a single worker process.
+
+    Evicting the least recently used bucket only hands that client a full
+    bucket again, so the size bound never blocks anyone wrongly.
+    """
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = Lock()
+
+    def take(self, key, rate, burst):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(key, (burst, now))
+            tokens, wait = take_token(tokens, updated_at, now, rate, burst)
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class SQLiteBuckets:
+    """Token buckets shared by every worker on the host through one SQLite file.
+
+    Each take runs in a BEGIN IMMEDIATE transaction, so concurrent workers
+    never spend the same token twice.
+    """
+
+    PRUNE_EVERY = 1000
+
+    def __init__(self, path, max_idle=3600):
+        self.path = path
+        self.max_idle = max_idle
+        self._local = local()
+        self._takes = 0
+        self._connect().execute(
+            'CREATE TABLE IF NOT EXISTS rate_limit_buckets ('
+            'key TEXT PRIMARY KEY, tokens REAL NOT NULL, '
+            'updated_at REAL NOT NULL)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def take(self, key, rate, burst):
+        conn = self._connect()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT tokens, updated_at FROM rate_limit_buckets WHERE key = ?',
+                (key,)).fetchone()
+            tokens, updated_at = row or (burst, now)
+            tokens, wait = take_token(tokens, updated_at, now, rate, burst)
+            conn.execute('INSERT OR REPLACE INTO rate_limit_buckets VALUES (?, ?, ?)',
+                         (key, tokens, now))
+            self._takes += 1
+            if self._takes % self.PRUNE_EVERY == 0:
+                # Buckets idle this long have refilled; dropping them is free.
+                conn.execute('DELETE FROM rate_limit_buckets WHERE updated_at < ?',
+                             (now - self.max_idle,))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return wait
+
+    def __len__(self):
+        return self._connect().execute(
+            'SELECT COUNT(*) FROM rate_limit_buckets').fetchone()[0]
+
+
+def create_backend(url):
+    if not url or url == 'none':
+        return None
+    if url == 'memory':
+        return MemoryBuckets()
+    if url.startswith('sqlite:///'):
+        return SQLiteBuckets(url[len('sqlite:///'):])
+    raise ValueError(f'Unsupported rate limit backend: {url}')
+
+
+def configure_from(url, limits):
+    """Backend and limits; limiting stays off unless one of them is set."""
+    if not url:
+        url = 'memory' if limits else 'none'
+    if url != 'none' and not limits:
+        limits = parse_limits(DEFAULT_LIMITS)
+    return create_backend(url), limits
+
+
+def client_key(payload=None):
+    """The token's subject (or authorized party), else the client address."""
+    if payload:
+        subject = payload.get('sub') or payload.get('azp')
+        if subject:
+            return f'sub:{subject}'
+    return f'ip:{request.remote_addr}'
+
+
+class RateLimiter:
+    """Per-client token buckets with a budget per route, permission or default.
+
+    A budget is looked up by endpoint name first, then by the permission the
+    route requires, then under 'default'. Each budget has its own bucket per
+    client.
+    """
+
+    def __init__(self, backend=None, limits=None):
+        self.backend = backend
+        self.limits = limits or {}
+
+    def configure(self, backend, limits):
+        self.backend = backend
+        self.limits = limits
+
+    def budget(self, endpoint=None, permission=None):
+        for name in (endpoint, permission):
+            if name and name in self.limits:
+                return name, self.limits[name]
+        return 'default', self.limits.get('default')
+
+    @staticmethod
+    def exempt(f):
+        """Mark a view (e.g. a load balancer probe) as never rate limited."""
+        f.rate_limit_exempt = True
+        return f
+
+    def check(self, client, endpoint=None, permission=None):
+        if self.backend is None:
+            return
+        name, limit = self.budget(endpoint, permission)
+        if limit is None:
+            return
+        rate, burst = limit
+        wait = self.backend.take(f'{name}|{client}', rate, burst)
+        if wait:
+            metrics.inc('rate_limited_total', budget=name)
+            abort(429, retry_after=math.ceil(wait))
+
+
+limiter = RateLimiter()
@@ -0,0 +1,170 @@
+import logging
+import os
+import time
+from functools import wraps
+from threading import Lock
+from flask import current_app, g, has_request_context, request
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import orm, text
+from sqlalchemy.exc import SQLAlchemyError
+
+logger = logging.getLogger(__name__)
+
+READ_PRIMARY_COOKIE = 'read_primary_until'
+READ_PRIMARY_HEADER = 'X-Read-Primary'
+
+# Seconds the standby is behind the primary; 0 when it has replayed
+# everything it received, so an idle primary doesn't look like lag.
+POSTGRES_LAG_QUERY = (
+    'SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() '
+    'THEN 0 ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) '
+    'END')
+
+
+class ReplicaSet:
+    """Round-robin over replica binds, skipping any that lag or fail.
+
+    Each replica's lag is measured at most once per ``check_interval``;
+    when none is usable the caller falls back to the primary.
+    """
+
+    def __init__(self, keys=(), max_lag=5, check_interval=5):
+        self.keys = list(keys)
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._next = 0
+        self._status = {}
+        self._lock = Lock()
+
+    def measure_lag(self, engine):
+        with engine.connect() as connection:
+            if connection.dialect.name == 'postgresql':
+                return float(connection.execute(text(POSTGRES_LAG_QUERY)).scalar() or 0)
+            connection.execute(text('SELECT 1'))
+            return 0.0
+
+    def is_healthy(self, key, engine):
+        now = time.monotonic()
+        status = self._status.get(key)
+        if status is not None and now - status['checked_at'] < self.check_interval:
+            return status['healthy']
+        try:
+            lag = self.measure_lag(engine)
+        except SQLAlchemyError as e:
+            logger.warning('Replica %s unavailable: %s', key, e)
+            lag = None
+        healthy = lag is not None and lag <= self.max_lag
+        self._status[key] = {'checked_at': now, 'lag': lag, 'healthy': healthy}
+        return healthy
+
+    def choose(self, engine_for):
+        """Return the bind key of the next healthy replica, or None."""
+        if not self.keys:
+            return None
+        with self._lock:
+            start = self._next
+            self._next = (start + 1) % len(self.keys)
+        for offset in range(len(self.keys)):
+            key = self.keys[(start + offset) % len(self.keys)]
+            if self.is_healthy(key, engine_for(key)):
+                return key
+        return None
+
+    def stats(self):
+        return {
+            key: {
+                'lag': self._status.get(key, {}).get('lag'),
+                'healthy': self._status.get(key, {}).get('healthy'),
+            }
+            for key in self.keys
+        }
+
+
+def reads_primary():
+    """True when the client asked to see its own recent writes."""
+    if request.headers.get(READ_PRIMARY_HEADER):
+        return True
+    try:
+        until = float(request.cookies.get(READ_PRIMARY_COOKIE, 0))
+    except ValueError:
+        return False
+    return until > time.time()
+
+
+def served_by_primary():
+    """False once a query of this request has run on a replica."""
+    return g.get('replica_bind') is None
+
+
+def read_replica(f):
+    """Let the queries of a read-only view run on a replica."""
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        g.read_replica = not reads_primary()
+        return f(*args, **kwargs)
+    return wrapper
+
+
+class RoutingSession(SignallingSession):
+    """Sends reads of @read_replica views to a replica, everything else to
+    the primary.
+
+    A replica is picked on the first query of the request and kept for the
+    rest of it, so one response never mixes two replicas.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        if (has_request_context() and g.get('read_replica')
+                and not self._flushing and self._is_clean()):
+            db = get_state(self.app).db
+            if 'replica_bind' not in g:
+                replicas = self.app.extensions['replicas']
+                g.replica_bind = replicas.choose(
+                    lambda key: db.get_engine(self.app, bind=key))
+            if g.replica_bind is not None:
+                return db.get_engine(self.app, bind=g.replica_bind)
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def replica_urls(app, environ=os.environ):
+    urls = app.config.get('SQLALCHEMY_REPLICA_URIS')
+    if urls is None:
+        urls = [url.strip() for url in
+                environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+    return [url.replace('postgres://', 'postgresql://', 1) for url in urls]
+
+
+def init_replicas(app, environ=os.environ):
+    """Register replica URLs as binds and pin writers to the primary."""
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    keys = []
+    for number, url in enumerate(replica_urls(app, environ)):
+        keys.append(f'replica_{number}')
+        binds[keys[-1]] = url
+    app.config['SQLALCHEMY_BINDS'] = binds
+    app.config.setdefault('READ_YOUR_WRITES_WINDOW',
+                          int(environ.get('READ_YOUR_WRITES_WINDOW', 10)))
+    app.extensions['replicas'] = ReplicaSet(
+        keys,
+        max_lag=float(app.config.get(
+            'REPLICA_MAX_LAG', environ.get('REPLICA_MAX_LAG', 5))),
+        check_interval=float(app.config.get(
+            'REPLICA_CHECK_INTERVAL', environ.get('REPLICA_CHECK_INTERVAL', 5))))
+    if not keys:
+        return
+
+    @app.after_request
+    def remember_write(response):
+        # After a successful write, this client reads from the primary long
+        # enough for the replicas to catch up.
+        if request.method in ('POST', 'PUT', 'PATCH', 'DELETE') \
+                and response.status_code < 400:
+            window = current_app.config['READ_YOUR_WRITES_WINDOW']
+            response.set_cookie(READ_PRIMARY_COOKIE, str(time.time() + window),
+                                max_age=window, httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,96 @@
+import sys
+from flask import abort, request
+from sqlalchemy import Integer, and_, text
+from models import db, SEARCH_COLUMNS, Movie, Actor
+
+MIN_SEARCH_LENGTH = 3
+
+
+def int_arg(name):
+    value = request.args.get(name, None)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        abort(400)
+
+
+def prefix_match(column, prefix):
+    """Prefix match written as a key range so a plain btree index serves it.
+
+    The bound after the prefix only holds in code point order, so on
+    PostgreSQL the range is compared in the "C" collation, served by the
+    ix_*_prefix indexes; under en_US, 'Zorro' < '[' is false.
+    """
+    starts_with = column.startswith(prefix, autoescape=True)
+    if db.engine.dialect.name == 'postgresql':
+        column = column.collate('C')
+    clauses = [column >= prefix, starts_with]
+    last = ord(prefix[-1])
+    if last < sys.maxunicode:
+        # Surrogates can't be encoded, so the bound after U+D7FF is U+E000.
+        upper = 0xE000 if 0xD800 <= last + 1 < 0xE000 else last + 1
+        clauses.append(column < prefix[:-1] + chr(upper))
+    return and_(*clauses)
+
+
+def int_range(column, name):
+    clauses = []
+    exact, low, high = int_arg(name), int_arg(f'{name}_min'), int_arg(f'{name}_max')
+    if exact is not None:
+        clauses.append(column == exact)
+    if low is not None:
+        clauses.append(column >= low)
+    if high is not None:
+        clauses.append(column <= high)
+    return clauses
+
+
+def text_search(model, q):
+    """Case-insensitive substring search on the model's search column.
+
+    Uses the FTS5 trigram table on SQLite and the pg_trgm index on
+    PostgreSQL (see models.search_index_ddl); both need 3+ characters.
+    """
+    if len(q) < MIN_SEARCH_LENGTH:
+        abort(400)
+    table = model.__tablename__
+    column = getattr(model, SEARCH_COLUMNS[table])
+    if db.engine.dialect.name == 'sqlite':
+        phrase = '"' + q.replace('"', '""') + '"'
+        matches = text(f'SELECT rowid FROM {table}_fts WHERE {table}_fts MATCH :q')
+        return model.id.in_(
+            matches.bindparams(q=phrase).columns(rowid=Integer))
+    escaped = q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return column.ilike(f'%{escaped}%', escape='\\')
+
+
+def movie_filters():
+    """WHERE clauses for ?title=, ?release_year[_min|_max]= and ?q=."""
+    clauses = int_range(Movie.release_year, 'release_year')
+    title = request.args.get('title', None)
+    if title:
+        clauses.append(prefix_match(Movie.title, title))
+    q = request.args.get('q', None)
+    if q is not None:
+        clauses.append(text_search(Movie, q))
+    return clauses
+
+
+def actor_filters():
+    """WHERE clauses for ?name=, ?age[_min|_max]=, ?gender=, ?movie_id=, ?q=."""
+    clauses = int_range(Actor.age, 'age')
+    movie_id = int_arg('movie_id')
+    if movie_id is not None:
+        clauses.append(Actor.movie_id == movie_id)
+    name = request.args.get('name', None)
+    if name:
+        clauses.append(prefix_match(Actor.name, name))
+    gender = request.args.get('gender', None)
+    if gender:
+        clauses.append(Actor.gender == gender)
+    q = request.args.get('q', None)
+    if q is not None:
+        clauses.append(text_search(Actor, q))
+    return clauses
@@ -0,0 +1,97 @@
+from collections import defaultdict
+from sqlalchemy import String, cast, func, literal, select
+from models import db, AGE_BUCKET, CatalogStat, Movie, Actor
+
+
+def group_queries():
+    """SELECT (dimension, bucket, total) for every breakdown, by dimension."""
+    decade = Actor.age - Actor.age % AGE_BUCKET
+    per_movie = (select(func.count().label('actors')).select_from(Actor)
+                 .group_by(Actor.movie_id).subquery())
+
+    def counts(dimension, bucket=None):
+        label = literal('') if bucket is None else cast(bucket, String)
+        return select(literal(dimension), label, func.count())
+
+    return {
+        'movies': [counts('movies').select_from(Movie)],
+        'movies_by_year': [
+            counts('movies_by_year', Movie.release_year)
+            .where(Movie.release_year.isnot(None))
+            .group_by(Movie.release_year)],
+        'actors': [counts('actors').select_from(Actor)],
+        'actors_by_gender': [
+            counts('actors_by_gender', Actor.gender)
+            .where(Actor.gender.isnot(None)).group_by(Actor.gender)],
+        'actors_by_age': [
+            counts('actors_by_age', decade)
+            .where(Actor.age.isnot(None)).group_by(decade)],
+        'movies_by_actor_count': [
+            counts('movies_by_actor_count', per_movie.c.actors)
+            .group_by(per_movie.c.actors),
+            select(literal('movies_by_actor_count'), literal('0'), func.count())
+            .select_from(Movie).where(~Movie.actors.any())],
+        # Only kept in the summary, to move movies between the groups above.
+        'actors_by_movie': [
+            counts('actors_by_movie', Actor.movie_id).group_by(Actor.movie_id)],
+    }
+
+
+def rebuild_summary(connection):
+    """Recompute catalog_stats from the base tables in one transaction."""
+    table = CatalogStat.__table__
+    connection.execute(table.delete())
+    for queries in group_queries().values():
+        for query in queries:
+            connection.execute(table.insert().from_select(
+                ['dimension', 'bucket', 'total'], query))
+
+
+def load_groups(dimensions, summary):
+    """{dimension: {bucket: total}}, from catalog_stats or GROUP BY."""
+    if summary:
+        rows = db.session.query(
+            CatalogStat.dimension, CatalogStat.bucket, CatalogStat.total
+        ).filter(CatalogStat.dimension.in_(dimensions), CatalogStat.total > 0)
+    else:
+        queries = group_queries()
+        rows = [row for dimension in dimensions for query in queries[dimension]
+                for row in db.session.execute(query)]
+    groups = defaultdict(dict)
+    for dimension, bucket, total in rows:
+        if total:
+            groups[dimension][bucket] = total
+    return groups
+
+
+def numeric(groups):
+    return sorted((int(bucket), total) for bucket, total in groups.items())
+
+
+def movie_stats(summary=False):
+    groups = load_groups(['movies', 'movies_by_year'], summary)
+    return {
+        'total': groups['movies'].get('', 0),
+        'by_release_year': [{'release_year': year, 'movies': total}
+                            for year, total in numeric(groups['movies_by_year'])],
+    }
+
+
+def actor_stats(summary=False):
+    groups = load_groups(['movies', 'actors', 'actors_by_gender',
+                          'actors_by_age', 'movies_by_actor_count'], summary)
+    movies = groups['movies'].get('', 0)
+    actors = groups['actors'].get('', 0)
+    return {
+        'total': actors,
+        'by_gender': [{'gender': gender, 'actors': total}
+                      for gender, total in sorted(groups['actors_by_gender'].items())],
+        'by_age': [{'age_min': decade, 'age_max': decade + AGE_BUCKET - 1,
+                    'actors': total}
+                   for decade, total in numeric(groups['actors_by_age'])],
+        'per_movie': {
+            'average': round(actors / movies, 2) if movies else 0,
+            'distribution': [{'actors': count, 'movies': total} for count, total
+                             in numeric(groups['movies_by_actor_count'])],
+        },
+    }
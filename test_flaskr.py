@@ -1,9 +1,67 @@
+import asyncio
 import unittest
 import os
 from flask import Flask
 import json
+import tempfile
+import time
+from contextlib import contextmanager
+from sqlalchemy import event
+import rsa
+import json_provider
+import metrics
+from jose import jwk, jwt
 from app import create_app
 from models import setup_db, Movie, Actor
+from auth import auth
+from auth.jwks import AsyncJWKSCache, JWKSCache, as_async, file_fetcher
+from auth.token_cache import TokenCache
+from search import prefix_match, text_search
+from stats import actor_stats, movie_stats
+from cache import MemoryBackend, SQLiteBackend, ReadThroughCache, read_cache
+from ratelimit import MemoryBuckets, SQLiteBuckets, limiter, parse_limits, take_token
+
+try:
+    from starlette.testclient import TestClient
+    import aiosqlite
+except ImportError:
+    TestClient = None
+
+
+class LocalIssuer:
+    """Signs tokens with a throwaway RSA key and serves it as a JWKS file."""
+
+    def __init__(self, kid='test-key'):
+        self.kid = kid
+        public_key, private_key = rsa.newkeys(1024)
+        self.private_pem = private_key.save_pkcs1().decode()
+        key = jwk.construct(public_key.save_pkcs1().decode(), 'RS256').to_dict()
+        key.update({'kid': kid, 'use': 'sig'})
+        self.jwks = {'keys': [key]}
+        self.jwks_file = tempfile.NamedTemporaryFile(
+            'w', suffix='.json', delete=False)
+        json.dump(self.jwks, self.jwks_file)
+        self.jwks_file.close()
+
+    def fetcher(self):
+        return file_fetcher(self.jwks_file.name)
+
+    def token(self, permissions=(), expires_in=3600, **claims):
+        now = int(time.time())
+        payload = {
+            'iss': f'https://{auth.AUTH0_DOMAIN}/',
+            'aud': auth.API_AUDIENCE,
+            'sub': 'test-client@clients',
+            'iat': now,
+            'exp': now + expires_in,
+            'permissions': list(permissions),
+        }
+        payload.update(claims)
+        return jwt.encode(payload, self.private_pem, algorithm='RS256',
+                          headers={'kid': self.kid})
+
+    def close(self):
+        os.remove(self.jwks_file.name)
 
 class CapstoneAppTestCase(unittest.TestCase):
     """This class represents the Capstone app test case."""
@@ -133,5 +191,1882 @@ class CapstoneAppTestCase(unittest.TestCase):
         
     
 
+class PaginationTestCase(unittest.TestCase):
+    """Paging is applied in SQL with LIMIT/OFFSET or a keyset cursor."""
+
+    def setUp(self):
+        self.app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://'})
+        self.client = self.app.test_client
+        with self.app.app_context():
+            from models import db
+            db.create_all()
+            db.session.add_all([
+                Movie(title=f'Movie {i}', release_year=2000 + i)
+                for i in range(1, 26)])
+            db.session.commit()
+
+    def tearDown(self):
+        with self.app.app_context():
+            from models import db
+            db.session.remove()
+            db.drop_all()
+
+    def test_page_offset(self):
+        response = self.client().get('/?page=3')
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([m['id'] for m in data['movies']], list(range(21, 26)))
+        self.assertIsNone(data['next_cursor'])
+
+    def test_page_past_end(self):
+        response = self.client().get('/?page=4')
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['movies'], [])
+
+    def test_keyset_cursor(self):
+        response = self.client().get('/?after=0&limit=10')
+        data = json.loads(response.data)
+        self.assertEqual(data['next_cursor'], 10)
+
+        response = self.client().get(f'/?after={data["next_cursor"]}&limit=10')
+        data = json.loads(response.data)
+        self.assertEqual([m['id'] for m in data['movies']], list(range(11, 21)))
+
+    def test_limit_is_capped(self):
+        import pagination
+        response = self.client().get(f'/?limit={pagination.MAX_PAGE_SIZE + 50}')
+        data = json.loads(response.data)
+
+        self.assertEqual(len(data['movies']), 25)
+
+    def test_optional_total(self):
+        import pagination
+        pagination.clear_count_cache()
+        response = self.client().get('/?count=true')
+        data = json.loads(response.data)
+
+        self.assertEqual(data['total'], 25)
+        self.assertNotIn('total', json.loads(self.client().get('/').data))
+
+    def test_invalid_page(self):
+        response = self.client().get('/?page=0')
+
+        self.assertEqual(response.status_code, 400)
+
+
+class JWKSCacheTestCase(unittest.TestCase):
+    """Signing keys are cached by kid instead of fetched per request."""
+
+    def setUp(self):
+        self.fetches = 0
+        self.jwks = {'keys': [{'kid': 'a', 'kty': 'RSA', 'use': 'sig',
+                               'n': 'n', 'e': 'AQAB'}]}
+        self.max_age = None
+
+    def fetch(self):
+        self.fetches += 1
+        return self.jwks, self.max_age
+
+    def test_keys_are_cached(self):
+        cache = JWKSCache(self.fetch, ttl=60)
+        for _ in range(5):
+            self.assertEqual(cache.get_key('a')['kid'], 'a')
+
+        self.assertEqual(self.fetches, 1)
+
+    def test_unknown_kid_refresh_is_rate_limited(self):
+        cache = JWKSCache(self.fetch, ttl=60, min_refresh_interval=60)
+        cache.get_key('a')
+        cache._last_fetch -= 61
+        self.assertIsNone(cache.get_key('b'))
+        self.assertIsNone(cache.get_key('b'))
+
+        self.assertEqual(self.fetches, 2)
+
+    def test_unknown_kid_picks_up_rotated_key(self):
+        cache = JWKSCache(self.fetch, ttl=60, min_refresh_interval=0)
+        cache.get_key('a')
+        self.jwks = {'keys': [{'kid': 'b', 'kty': 'RSA', 'use': 'sig',
+                               'n': 'n', 'e': 'AQAB'}]}
+
+        self.assertEqual(cache.get_key('b')['kid'], 'b')
+
+    def test_cache_control_max_age(self):
+        from auth.jwks import parse_max_age
+        self.assertEqual(parse_max_age('public, max-age=15'), 15)
+        self.assertEqual(parse_max_age('no-store'), 0)
+        self.assertIsNone(parse_max_age(None))
+
+    def test_stale_keys_served_while_revalidating(self):
+        self.max_age = 0
+        cache = JWKSCache(self.fetch, stale_ttl=60, min_refresh_interval=0)
+        cache.get_key('a')
+
+        def failing_fetch():
+            raise OSError('IdP unavailable')
+        cache.fetcher = failing_fetch
+
+        self.assertEqual(cache.get_key('a')['kid'], 'a')
+
+    def test_concurrent_lookups_fetch_once(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from threading import Barrier
+        barrier = Barrier(20)
+
+        def slow_fetch():
+            time.sleep(0.05)
+            return self.fetch()
+        cache = JWKSCache(slow_fetch, ttl=60, min_refresh_interval=60)
+
+        def lookup(kid):
+            barrier.wait()
+            return cache.get_key(kid)
+
+        with ThreadPoolExecutor(20) as pool:
+            keys = list(pool.map(lookup, ['a'] * 10 + ['b'] * 10))
+
+        self.assertEqual(self.fetches, 1)
+        self.assertEqual([key and key['kid'] for key in keys],
+                         ['a'] * 10 + [None] * 10)
+
+        cache._last_fetch -= 61
+        barrier.reset()
+        with ThreadPoolExecutor(20) as pool:
+            list(pool.map(lookup, ['b'] * 20))
+
+        self.assertEqual(self.fetches, 2)
+
+    def test_async_cache_fetches_once(self):
+        cache = AsyncJWKSCache(as_async(self.fetch), ttl=60)
+
+        async def lookups():
+            return await asyncio.gather(*(cache.get_key('a') for _ in range(5)))
+
+        self.assertEqual([key['kid'] for key in asyncio.run(lookups())],
+                         ['a'] * 5)
+        self.assertEqual(self.fetches, 1)
+
+    def test_async_background_refresh_task_is_kept(self):
+        self.max_age = 0
+        cache = AsyncJWKSCache(as_async(self.fetch), stale_ttl=60,
+                               min_refresh_interval=0)
+
+        async def revalidate():
+            await cache.get_key('a')
+            await cache.get_key('a')
+            task = cache._task
+            self.assertIsNotNone(task)
+            await task
+            return task
+
+        self.assertTrue(asyncio.run(revalidate()).done())
+        self.assertIsNone(cache._task)
+        self.assertEqual(self.fetches, 2)
+
+
+class LocalAppTestCase(unittest.TestCase):
+    """Base case running the app on SQLite with locally signed tokens."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.issuer = LocalIssuer()
+        auth.jwks_cache.set_fetcher(cls.issuer.fetcher())
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.issuer.close()
+
+    def setUp(self):
+        self.app = create_app({
+            'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+            'AUTH0_DOMAIN': 'example.auth0.com',
+            'API_AUDIENCE': 'fsnd-image',
+        })
+        self.client = self.app.test_client
+        with self.app.app_context():
+            from models import db
+            db.create_all()
+
+    def tearDown(self):
+        with self.app.app_context():
+            from models import db
+            db.session.remove()
+            db.drop_all()
+
+    def headers(self, *permissions, **claims):
+        token = self.issuer.token(permissions, **claims)
+        return {'Authorization': f'Bearer {token}'}
+
+
+@contextmanager
+def count_statements(engine):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+
+class LocalAuthTestCase(LocalAppTestCase):
+    """requires_auth verifies tokens against a local JWKS stand-in."""
+
+    def test_valid_token(self):
+        response = self.client().get(
+            '/movies', headers=self.headers('get:movies'))
+
+        self.assertEqual(response.status_code, 200)
+
+    def test_missing_permission(self):
+        response = self.client().get(
+            '/movies', headers=self.headers('get:actors'))
+
+        self.assertEqual(response.status_code, 403)
+
+    def test_expired_token(self):
+        response = self.client().get(
+            '/movies', headers=self.headers('get:movies', expires_in=-60))
+
+        self.assertEqual(response.status_code, 401)
+
+    def test_scope_claim_grants_permission(self):
+        response = self.client().get(
+            '/movies', headers=self.headers(scope='get:movies'))
+
+        self.assertEqual(response.status_code, 200)
+
+    def test_repeated_token_skips_verification(self):
+        auth.token_cache.clear()
+        headers = self.headers('get:movies')
+        for _ in range(3):
+            self.client().get('/movies', headers=headers)
+
+        stats = auth.token_cache.stats()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 2)
+
+
+class IncludeTestCase(LocalAppTestCase):
+    """?include= embeds relations with a constant number of queries."""
+
+    def setUp(self):
+        super().setUp()
+        with self.app.app_context():
+            from models import db
+            for i in range(1, 31):
+                movie = Movie(title=f'Movie {i}', release_year=2000 + i)
+                movie.actors = [
+                    Actor(name=f'Actor {i}-{j}', age=20 + j, gender='Female')
+                    for j in range(2)]
+                db.session.add(movie)
+            db.session.commit()
+
+    def statements_for(self, url, permission):
+        headers = self.headers(permission)
+        with self.app.app_context():
+            from models import db
+            with count_statements(db.engine) as statements:
+                response = self.client().get(url, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        return len(statements), json.loads(response.data)
+
+    def test_movies_include_actors(self):
+        small, data = self.statements_for(
+            '/movies?include=actors&limit=5', 'get:movies')
+        large, _ = self.statements_for(
+            '/movies?include=actors&limit=30', 'get:movies')
+
+        self.assertEqual(small, large)
+        self.assertLessEqual(large, 3)
+        self.assertEqual([a['name'] for a in data['movies'][0]['actors']],
+                         ['Actor 1-0', 'Actor 1-1'])
+
+    def test_actors_include_movie(self):
+        small, data = self.statements_for(
+            '/actors?include=movie&limit=5', 'get:actors')
+        large, _ = self.statements_for(
+            '/actors?include=movie&limit=60', 'get:actors')
+
+        self.assertEqual(small, large)
+        self.assertEqual(data['actors'][0]['movie']['title'], 'Movie 1')
+
+    def test_single_resources(self):
+        _, data = self.statements_for('/movies/2?include=actors', 'get:movies')
+        self.assertEqual(len(data['movie']['actors']), 2)
+
+        _, data = self.statements_for('/actors/3?include=movie', 'get:actors')
+        self.assertEqual(data['actor']['movie']['id'], 2)
+
+    def test_unknown_include(self):
+        response = self.client().get(
+            '/movies?include=directors', headers=self.headers('get:movies'))
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_no_include_by_default(self):
+        _, data = self.statements_for('/movies', 'get:movies')
+
+        self.assertNotIn('actors', data['movies'][0])
+
+    def test_list_pages_skip_the_orm(self):
+        from app import load_actors_page, load_movies_page
+        from models import db
+        with self.app.test_request_context('/?limit=5'):
+            movies = load_movies_page(True)['movies']
+            actors = load_actors_page(True)['actors']
+
+            self.assertEqual(len(db.session.identity_map), 0)
+            self.assertEqual(movies[0], Movie.query.get(1).format(True))
+            self.assertEqual(actors[0], Actor.query.get(1).format(True))
+
+
+class FieldsTestCase(LocalAppTestCase):
+    """?fields= trims both the response and the columns selected."""
+
+    def setUp(self):
+        super().setUp()
+        with self.app.app_context():
+            from models import db
+            movie = Movie(title='Movie', release_year=2001)
+            movie.actors = [Actor(name='Actor', age=40, gender='Male')]
+            db.session.add(movie)
+            db.session.commit()
+
+    def get(self, url, permission):
+        with self.app.app_context():
+            from models import db
+            with count_statements(db.engine) as statements:
+                response = self.client().get(
+                    url, headers=self.headers(permission))
+        return response, statements
+
+    def test_list_selects_only_requested_columns(self):
+        response, statements = self.get('/actors?fields=name', 'get:actors')
+
+        self.assertEqual(response.get_json()['actors'],
+                         [{'id': 1, 'name': 'Actor'}])
+        selects = [s for s in statements if 'FROM actors' in s]
+        self.assertEqual(len(selects), 1)
+        self.assertNotIn('gender', selects[0])
+
+    def test_fields_with_includes(self):
+        response, _ = self.get('/movies/1?fields=title&include=actors',
+                               'get:movies')
+        movie = response.get_json()['movie']
+        self.assertEqual(set(movie), {'id', 'title', 'actors'})
+        self.assertEqual(movie['actors'][0]['gender'], 'Male')
+
+        response, _ = self.get('/actors/1?fields=age&include=movie',
+                               'get:actors')
+        self.assertEqual(response.get_json()['actor'],
+                         {'id': 1, 'age': 40, 'movie': {
+                             'id': 1, 'title': 'Movie', 'release_year': 2001}})
+
+    def test_fields_on_export(self):
+        response = self.client().get('/actors/export?format=csv&fields=name',
+                                     headers=self.headers('get:actors'))
+
+        self.assertEqual(response.get_data(as_text=True).splitlines(),
+                         ['id,name', '1,Actor'])
+
+    def test_unknown_field(self):
+        for url in ('/movies?fields=budget', '/actors/1?fields=title',
+                    '/movies/export?fields=password'):
+            with self.subTest(url=url):
+                permission = 'get:' + url.split('/')[1].split('?')[0]
+                response, _ = self.get(url, permission)
+                self.assertEqual(response.status_code, 400)
+
+
+class FilterTestCase(LocalAppTestCase):
+    """List endpoints filter and search in SQL."""
+
+    def setUp(self):
+        super().setUp()
+        with self.app.app_context():
+            from models import db
+            for title, year, cast in [
+                    ('The Godfather', 1972, [('Al Pacino', 32, 'Male'),
+                                             ('Diane Keaton', 26, 'Female')]),
+                    ('The Godfather Part II', 1974, [('Al Pacino', 34, 'Male')]),
+                    ('Heat', 1995, [('Al Pacino', 55, 'Male'),
+                                    ('Ashley Judd', 27, 'Female')])]:
+                movie = Movie(title=title, release_year=year)
+                movie.actors = [Actor(name=name, age=age, gender=gender)
+                                for name, age, gender in cast]
+                db.session.add(movie)
+            db.session.commit()
+
+    def titles(self, query):
+        response = self.client().get(f'/movies?{query}',
+                                     headers=self.headers('get:movies'))
+        self.assertEqual(response.status_code, 200)
+        return [movie['title'] for movie in response.get_json()['movies']]
+
+    def actors(self, query):
+        response = self.client().get(f'/actors?{query}',
+                                     headers=self.headers('get:actors'))
+        self.assertEqual(response.status_code, 200)
+        return [(actor['name'], actor['age'])
+                for actor in response.get_json()['actors']]
+
+    def test_movie_filters(self):
+        self.assertEqual(self.titles('title=The%20God'),
+                         ['The Godfather', 'The Godfather Part II'])
+        self.assertEqual(self.titles('title=the%20god'), [])
+        self.assertEqual(self.titles('release_year_min=1973'),
+                         ['The Godfather Part II', 'Heat'])
+        self.assertEqual(self.titles('release_year=1995'), ['Heat'])
+        self.assertEqual(self.titles('q=FATHER%20part'),
+                         ['The Godfather Part II'])
+        self.assertEqual(self.titles('q=eat&release_year_max=1990'), [])
+
+    def test_prefix_at_the_end_of_unicode(self):
+        with self.app.app_context():
+            from models import db
+            db.session.add_all([Movie(title='Heat\U0010ffff', release_year=1),
+                                Movie(title='Heat\ud7ffX', release_year=1)])
+            db.session.commit()
+
+        self.assertEqual(self.titles('title=Heat%F4%8F%BF%BF'),
+                         ['Heat\U0010ffff'])
+        self.assertEqual(self.titles('title=%F4%8F%BF%BF'), [])
+        self.assertEqual(self.titles('title=Heat%ED%9F%BF'), ['Heat\ud7ffX'])
+
+    def test_postgresql_prefix_range_uses_c_collation(self):
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': 'postgresql://localhost/unused'})
+        with app.app_context():
+            from models import db
+            clause = prefix_match(Movie.title, 'Z')
+            sql = str(clause.compile(dialect=db.engine.dialect))
+
+        self.assertEqual(sql.count('COLLATE "C"'), 2)
+
+    def test_actor_filters(self):
+        self.assertEqual(self.actors('name=Al&age_min=33&age_max=54'),
+                         [('Al Pacino', 34)])
+        self.assertEqual(self.actors('gender=Female&movie_id=3'),
+                         [('Ashley Judd', 27)])
+        self.assertEqual(self.actors('q=keat'), [('Diane Keaton', 26)])
+
+    def test_search_follows_writes(self):
+        with self.app.app_context():
+            from models import db
+            movie = Movie.query.filter(Movie.title == 'Heat').one()
+            movie.title = 'Collateral'
+            db.session.commit()
+
+        self.assertEqual(self.titles('q=heat'), [])
+        self.assertEqual(self.titles('q=llat'), ['Collateral'])
+
+    def test_filtered_count(self):
+        response = self.client().get('/actors?name=Al&count=true',
+                                     headers=self.headers('get:actors'))
+
+        self.assertEqual(response.get_json()['total'], 3)
+
+    def test_bad_filters(self):
+        for query in ('release_year_min=abc', 'q=ab', 'movie_id=x'):
+            with self.subTest(query=query):
+                url = ('/actors?' if 'movie_id' in query else '/movies?') + query
+                response = self.client().get(
+                    url, headers=self.headers('get:movies', 'get:actors'))
+                self.assertEqual(response.status_code, 400)
+
+
+class CompressionTestCase(LocalAppTestCase):
+    """Large JSON, NDJSON and CSV responses are gzip/brotli encoded."""
+
+    def setUp(self):
+        super().setUp()
+        with self.app.app_context():
+            from models import db
+            db.session.add_all(Movie(title=f'Movie {i}', release_year=2000 + i)
+                               for i in range(60))
+            db.session.commit()
+
+    def get(self, url, encoding='gzip', headers=None, **kwargs):
+        headers = {**self.headers('get:movies'), **(headers or {})}
+        if encoding:
+            headers['Accept-Encoding'] = encoding
+        return self.client().get(url, headers=headers, **kwargs)
+
+    def test_large_pages_are_gzipped(self):
+        import gzip
+        plain = self.get('/movies?limit=50', encoding=None)
+        response = self.get('/movies?limit=50')
+
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertLess(len(response.data), len(plain.data))
+        self.assertEqual(gzip.decompress(response.data), plain.data)
+        self.assertTrue(response.headers['ETag'].startswith('W/'))
+
+        revalidated = self.get('/movies?limit=50', headers={
+            'If-None-Match': response.headers['ETag']})
+        self.assertEqual(revalidated.status_code, 304)
+
+    def test_small_or_refused_responses_are_not_compressed(self):
+        for url, encoding in [('/movies?limit=1', 'gzip'),
+                              ('/movies?limit=50', 'gzip;q=0, identity'),
+                              ('/movies?limit=50', 'deflate')]:
+            with self.subTest(url=url, encoding=encoding):
+                response = self.get(url, encoding)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotIn('Content-Encoding', response.headers)
+
+    def test_streamed_export_is_compressed_in_chunks(self):
+        import zlib
+        response = self.get('/movies/export?format=csv', buffered=False)
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+
+        decompressor = zlib.decompressobj(31)
+        body = b''.join(decompressor.decompress(chunk)
+                        for chunk in response.response)
+        response.close()
+        lines = body.decode().splitlines()
+        self.assertEqual(lines[0], 'id,title,release_year')
+        self.assertEqual(len(lines), 61)
+
+    @unittest.skipIf(__import__('compression').brotli is None,
+                     'brotli not installed')
+    def test_brotli_preferred_when_accepted(self):
+        import brotli
+        response = self.get('/movies?limit=50', encoding='gzip, br')
+
+        self.assertEqual(response.headers['Content-Encoding'], 'br')
+        self.assertIn(b'Movie 49', brotli.decompress(response.data))
+
+    def test_max_page_size_is_configurable(self):
+        self.app.config['MAX_PAGE_SIZE'] = 5
+        response = self.get('/movies?limit=50', encoding=None)
+
+        self.assertEqual(len(response.get_json()['movies']), 5)
+
+
+class MetricsTestCase(LocalAppTestCase):
+    """Server-Timing headers, /metrics and the slow-query log."""
+
+    def setUp(self):
+        super().setUp()
+        metrics.metrics.clear()
+
+    def test_server_timing_breaks_down_the_request(self):
+        response = self.client().get(
+            '/movies', headers=self.headers('get:movies'))
+
+        timing = response.headers['Server-Timing']
+        self.assertRegex(timing, r'db;dur=[\d.]+;desc="\d+ queries"')
+        for name in ('auth', 'serialize', 'total'):
+            self.assertIn(f'{name};dur=', timing)
+
+        self.app.config['SERVER_TIMING'] = False
+        response = self.client().get('/movies', headers=self.headers('get:movies'))
+        self.assertNotIn('Server-Timing', response.headers)
+
+    def test_metrics_endpoint(self):
+        headers = self.headers('get:movies')
+        self.client().get('/movies', headers=headers)
+        self.client().get('/movies', headers=headers)
+        response = self.client().get('/metrics')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        self.assertEqual(response.headers['Cache-Control'], 'no-store')
+        body = response.get_data(as_text=True)
+        self.assertIn('# TYPE http_request_duration_seconds histogram', body)
+        self.assertIn('http_request_duration_seconds_count'
+                      '{method="GET",route="/movies",status="200"} 2', body)
+        self.assertIn('auth_token_verify_seconds_count 2', body)
+        self.assertIn('cache_hits_total{cache="token"}', body)
+        self.assertIn('db_query_duration_seconds_bucket{le="+Inf"}', body)
+
+    def test_slow_queries_are_logged_without_parameters(self):
+        previous = metrics.metrics.slow_query_seconds
+        metrics.metrics.slow_query_seconds = 0
+        try:
+            with self.assertLogs('metrics', 'WARNING') as logs:
+                self.client().get('/movies?title=secret',
+                                  headers=self.headers('get:movies'))
+        finally:
+            metrics.metrics.slow_query_seconds = previous
+
+        self.assertIn('Slow query', logs.output[0])
+        self.assertNotIn('secret', ''.join(logs.output))
+        self.assertGreater(metrics.metrics.counter('db_slow_queries_total'), 0)
+
+    def test_histogram_buckets_are_cumulative(self):
+        registry = metrics.Metrics()
+        for value in (0.0005, 0.003, 0.003, 20):
+            registry.observe('http_request_duration_seconds', value, route='/x')
+        body = registry.render()
+
+        self.assertIn('_bucket{route="/x",le="0.001"} 1', body)
+        self.assertIn('_bucket{route="/x",le="0.005"} 3', body)
+        self.assertIn('_bucket{route="/x",le="10"} 3', body)
+        self.assertIn('_bucket{route="/x",le="+Inf"} 4', body)
+        self.assertIn('_count{route="/x"} 4', body)
+
+
+class RateLimitTestCase(LocalAppTestCase):
+    """Token buckets per token subject, with per-route/permission budgets."""
+
+    def limit(self, limits):
+        limiter.configure(MemoryBuckets(), limits)
+
+    def test_subject_over_budget_gets_429_with_retry_after(self):
+        self.limit({'default': (0.5, 2)})
+        headers = self.headers('get:movies')
+        statuses = [self.client().get('/movies', headers=headers).status_code
+                    for _ in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+
+        response = self.client().get('/movies', headers=headers)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['Retry-After'], '2')
+        self.assertEqual(response.get_json()['message'], 'Too many requests')
+
+        other = self.headers('get:movies', sub='other-client@clients')
+        self.assertEqual(
+            self.client().get('/movies', headers=other).status_code, 200)
+
+    def test_route_and_permission_budgets(self):
+        self.limit({'default': (100, 100), 'get_actors': (0.1, 1),
+                    'get:movies': (0.1, 1)})
+        headers = self.headers('get:movies', 'get:actors', 'post:movies')
+        for url in ('/actors', '/movies/export'):
+            with self.subTest(url=url):
+                self.assertEqual(
+                    self.client().get(url, headers=headers).status_code, 200)
+        self.assertEqual(
+            self.client().get('/actors', headers=headers).status_code, 429)
+        self.assertEqual(
+            self.client().get('/movies', headers=headers).status_code, 429)
+        response = self.client().post('/movies', headers=headers, json={
+            'title': 'Limited', 'release_year': 2020})
+        self.assertEqual(response.status_code, 200)
+
+    def test_anonymous_requests_are_limited_by_address(self):
+        self.limit({'default': (0.1, 1)})
+        self.assertEqual(self.client().get('/').status_code, 200)
+        self.assertEqual(self.client().get('/').status_code, 429)
+        other = self.client().get(
+            '/', environ_overrides={'REMOTE_ADDR': '10.0.0.2'})
+        self.assertEqual(other.status_code, 200)
+
+    def test_unverified_tokens_are_limited_by_address(self):
+        self.limit({'default': (0.1, 2)})
+        bad = {'Authorization': 'Bearer not-a-token'}
+        statuses = [self.client().get('/movies', headers=headers).status_code
+                    for headers in (bad, {}, bad)]
+        self.assertEqual(statuses, [401, 401, 429])
+
+        other = self.client().get('/movies', headers=bad,
+                                  environ_overrides={'REMOTE_ADDR': '10.0.0.2'})
+        self.assertEqual(other.status_code, 401)
+        self.assertEqual(self.client().get(
+            '/movies', headers=self.headers('get:movies')).status_code, 200)
+
+    def test_trusted_proxy_count_keys_by_forwarded_address(self):
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+            'TRUSTED_PROXY_COUNT': 1,
+            'RATE_LIMITS': {'default': (0.1, 1)},
+        })
+        with app.app_context():
+            from models import db
+            db.create_all()
+
+        def get(forwarded_for):
+            return app.test_client().get(
+                '/', headers={'X-Forwarded-For': forwarded_for}).status_code
+
+        self.assertEqual([get('203.0.113.1'), get('203.0.113.1'),
+                          get('spoofed, 203.0.113.2')], [200, 429, 200])
+
+    def test_off_unless_configured(self):
+        self.assertIsNone(limiter.backend)
+        for config, limits in (({'RATE_LIMIT_URL': 'memory'},
+                                {'default': (10, 20)}),
+                               ({'RATE_LIMITS': {'default': (1, 2)}},
+                                {'default': (1, 2)})):
+            with self.subTest(config=config):
+                create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://', **config})
+                self.assertIsInstance(limiter.backend, MemoryBuckets)
+                self.assertEqual(limiter.limits, limits)
+
+    def test_metrics_is_never_rate_limited(self):
+        self.limit({'default': (0.1, 1)})
+        self.assertEqual(self.client().get('/').status_code, 200)
+        self.assertEqual(self.client().get('/').status_code, 429)
+        self.assertEqual([self.client().get('/metrics').status_code
+                          for _ in range(3)], [200] * 3)
+
+    def test_token_bucket_refills_at_rate(self):
+        self.assertEqual(take_token(2, 0, 0, 1, 2), (1, 0))
+        self.assertEqual(take_token(0, 0, 0.25, 2, 2), (0.5, 0.25))
+        self.assertEqual(take_token(0, 0, 100, 1, 3), (2, 0))
+        self.assertEqual(parse_limits('default=10/20, get:actors=2'),
+                         {'default': (10, 20), 'get:actors': (2, 2)})
+
+    def test_sqlite_buckets_are_shared_between_workers(self):
+        path = os.path.join(tempfile.mkdtemp(), 'limits.db')
+        first, second = SQLiteBuckets(path), SQLiteBuckets(path)
+
+        self.assertEqual(first.take('default|sub:a', 0.1, 2), 0)
+        self.assertEqual(second.take('default|sub:a', 0.1, 2), 0)
+        self.assertGreater(first.take('default|sub:a', 0.1, 2), 0)
+        self.assertEqual(second.take('default|sub:b', 0.1, 2), 0)
+        self.assertEqual(len(first), 2)
+
+
+class HealthTestCase(LocalAppTestCase):
+    """/healthz does no I/O; /readyz checks the pool, database and JWKS."""
+
+    def setUp(self):
+        super().setUp()
+        auth.jwks_cache.refresh()
+
+    def test_liveness_does_no_io_and_is_never_rate_limited(self):
+        limiter.configure(MemoryBuckets(), {'default': (0.1, 1)})
+        with self.app.app_context():
+            from models import db
+            with count_statements(db.engine) as statements:
+                responses = [self.client().get('/healthz') for _ in range(3)]
+
+        self.assertEqual([r.status_code for r in responses], [200] * 3)
+        self.assertEqual(responses[0].get_json()['status'], 'ok')
+        self.assertEqual(responses[0].headers['Cache-Control'], 'no-store')
+        self.assertEqual(statements, [])
+
+    def test_readiness_is_cached(self):
+        with self.app.app_context():
+            from models import db
+            with count_statements(db.engine) as statements:
+                first = self.client().get('/readyz')
+                second = self.client().get('/readyz')
+
+        self.assertEqual(first.status_code, 200)
+        checks = first.get_json()['checks']
+        self.assertEqual({name: check['ok'] for name, check in checks.items()},
+                         {'pool': True, 'database': True, 'jwks': True})
+        self.assertEqual(second.get_json(), first.get_json())
+        self.assertEqual(statements, ['SELECT 1'])
+
+    def test_cold_jwks_is_not_ready_until_warmed(self):
+        self.app.extensions['readiness'].ttl = 0
+        auth.jwks_cache.clear()
+        response = self.client().get('/readyz')
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(response.get_json()['checks']['jwks']['ok'])
+
+        deadline = time.monotonic() + 5
+        while not auth.jwks_cache.status()['fresh']:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+        self.assertEqual(self.client().get('/readyz').status_code, 200)
+
+    def test_exhausted_pool_skips_the_database(self):
+        from unittest import mock
+        saturated = {'pool': 'QueuePool', 'size': 5, 'checked_in': 0,
+                     'checked_out': 15, 'overflow': 10, 'max_overflow': 10}
+        with mock.patch('health.pool_stats', return_value=saturated), \
+                mock.patch('health.check_database') as check_database:
+            response = self.client().get('/readyz')
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.get_json()['checks']['database'],
+                         {'ok': False, 'error': 'pool exhausted'})
+        check_database.assert_not_called()
+
+
+class StatsTestCase(LocalAppTestCase):
+    """/stats aggregates with GROUP BY or from the catalog_stats summary."""
+
+    def setUp(self):
+        super().setUp()
+        self.all = self.headers('get:movies', 'get:actors', 'post:movies',
+                                'post:actors', 'patch:actors', 'delete:actors',
+                                'delete:movies')
+
+    def seed(self):
+        client = self.client()
+        for title, year in [('A', 1999), ('B', 1999), ('C', 2004)]:
+            client.post('/movies', headers=self.all,
+                        json={'title': title, 'release_year': year})
+        client.post('/actors/batch', headers=self.all, json={'actors': [
+            {'name': 'X', 'age': 25, 'gender': 'Female', 'movie_id': 1},
+            {'name': 'Y', 'age': 29, 'gender': 'Male', 'movie_id': 1},
+            {'name': 'Z', 'age': 41, 'gender': 'Female', 'movie_id': 2},
+        ]})
+
+    def test_stats_are_grouped_in_sql(self):
+        self.seed()
+        movies = self.client().get('/stats/movies', headers=self.all).get_json()
+        actors = self.client().get('/stats/actors', headers=self.all).get_json()
+
+        self.assertEqual(movies['stats'], {'total': 3, 'by_release_year': [
+            {'release_year': 1999, 'movies': 2},
+            {'release_year': 2004, 'movies': 1}]})
+        self.assertEqual(actors['stats'], {
+            'total': 3,
+            'by_gender': [{'gender': 'Female', 'actors': 2},
+                          {'gender': 'Male', 'actors': 1}],
+            'by_age': [{'age_min': 20, 'age_max': 29, 'actors': 2},
+                       {'age_min': 40, 'age_max': 49, 'actors': 1}],
+            'per_movie': {'average': 1.0, 'distribution': [
+                {'actors': 0, 'movies': 1}, {'actors': 1, 'movies': 1},
+                {'actors': 2, 'movies': 1}]},
+        })
+        response = self.client().get(
+            '/stats/actors', headers=self.headers('get:movies'))
+        self.assertEqual(response.status_code, 403)
+
+    def test_summary_is_maintained_by_writes(self):
+        self.app.config['STATS_SUMMARY'] = True
+        self.seed()
+        client = self.client()
+        client.patch('/actors/2', headers=self.all,
+                     json={'movie_id': 3, 'age': 52})
+        client.delete('/actors/3', headers=self.all)
+        client.delete('/movies/2', headers=self.all)
+
+        with self.app.app_context():
+            from models import db
+            with count_statements(db.engine) as statements:
+                summary = (movie_stats(True), actor_stats(True))
+            self.assertEqual(summary, (movie_stats(), actor_stats()))
+        self.assertEqual(len(statements), 2)
+        self.assertTrue(all('catalog_stats' in s for s in statements))
+        self.assertEqual(summary[1]['per_movie']['distribution'],
+                         [{'actors': 1, 'movies': 2}])
+
+    def test_summary_accepts_the_same_input(self):
+        self.seed()
+        results = []
+        for summary in (False, True):
+            if summary:
+                self.app.test_cli_runner().invoke(args=['rebuild-stats'])
+            self.app.config['STATS_SUMMARY'] = summary
+            results.append((
+                self.client().post('/actors', headers=self.all, json={
+                    'name': f'S{summary}', 'age': '30', 'gender': 'Male',
+                    'movie_id': 1}).status_code,
+                self.client().patch('/actors/1', headers=self.all, json={
+                    'age': str(30 + summary), 'movie_id': 1}).status_code))
+
+        self.assertEqual(results, [(422, 200), (422, 200)])
+        with self.app.app_context():
+            self.assertEqual(actor_stats(True), actor_stats())
+
+    def test_rebuild_stats_command(self):
+        self.seed()
+        self.app.config['STATS_SUMMARY'] = True
+        with self.app.app_context():
+            self.assertEqual(movie_stats(True)['total'], 0)
+
+        result = self.app.test_cli_runner().invoke(args=['rebuild-stats'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        with self.app.app_context():
+            self.assertEqual((movie_stats(True), actor_stats(True)),
+                             (movie_stats(), actor_stats()))
+
+
+class JSONProviderTestCase(unittest.TestCase):
+    """orjson is used when installed and renders what the stdlib would."""
+
+    def app_with(self, provider):
+        return create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+                           'JSON_PROVIDER': provider})
+
+    @unittest.skipIf(json_provider.orjson is None, 'orjson not installed')
+    def test_orjson_matches_stdlib_output(self):
+        from datetime import datetime
+        from decimal import Decimal
+        body = {'b': [1, 2.5, None, True], 'a': 'text',
+                'when': datetime(2024, 1, 2, 3, 4, 5), 'price': Decimal('9.99')}
+        fast, slow = self.app_with('orjson'), self.app_with('default')
+        self.assertIsInstance(fast.json, json_provider.OrjsonProvider)
+
+        with fast.app_context():
+            fast_body = fast.json.response(body).get_data()
+        with slow.app_context():
+            slow_body = slow.json.response(body).get_data()
+
+        self.assertEqual(fast_body, slow_body)
+        self.assertEqual(fast.json.loads(fast_body), slow.json.loads(slow_body))
+
+    @unittest.skipIf(json_provider.orjson is None, 'orjson not installed')
+    def test_non_ascii_parses_the_same(self):
+        body = {'name': 'Amélie', 'title': '千と千尋'}
+        fast, slow = self.app_with('orjson'), self.app_with('default')
+
+        with fast.app_context():
+            fast_body = fast.json.response(body).get_data()
+        with slow.app_context():
+            slow_body = slow.json.response(body).get_data()
+
+        self.assertIn('Amélie'.encode(), fast_body)
+        self.assertIn(b'Am\\u00e9lie', slow_body)
+        self.assertEqual(fast.json.loads(fast_body), body)
+        self.assertEqual(slow.json.loads(slow_body), body)
+
+    def test_stdlib_fallback(self):
+        from flask.json.provider import DefaultJSONProvider
+        app = self.app_with('default')
+
+        self.assertIs(type(app.json), DefaultJSONProvider)
+        with self.assertRaises(ValueError):
+            self.app_with('simplejson')
+
+
+class ConditionalGetTestCase(LocalAppTestCase):
+    """Read endpoints answer revalidation with 304 when nothing changed."""
+
+    def setUp(self):
+        super().setUp()
+        self.client().post('/movies', json={'title': 'A', 'release_year': 1},
+                           headers=self.headers('post:movies'))
+
+    def get(self, url, **headers):
+        headers.update(self.headers('get:movies'))
+        return self.client().get(url, headers=headers)
+
+    def test_list_etag_revalidation(self):
+        first = self.get('/movies')
+        etag = first.headers['ETag']
+        second = self.get('/movies', **{'If-None-Match': etag})
+
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second.data, b'')
+        self.assertEqual(second.headers['ETag'], etag)
+
+    def test_write_changes_etag(self):
+        etag = self.get('/movies').headers['ETag']
+        self.client().patch('/movies/1', json={'title': 'B'},
+                            headers=self.headers('patch:movies'))
+        response = self.get('/movies', **{'If-None-Match': etag})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_query_string_is_part_of_etag(self):
+        self.assertNotEqual(self.get('/movies?page=1').headers['ETag'],
+                            self.get('/movies?page=2').headers['ETag'])
+
+    def test_resource_revalidation_skips_row_load(self):
+        etag = self.get('/movies/1').headers['ETag']
+        with self.app.app_context():
+            from models import db
+            with count_statements(db.engine) as statements:
+                response = self.get('/movies/1', **{'If-None-Match': etag})
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(statements), 1)
+
+    def test_if_modified_since(self):
+        last_modified = self.get('/movies/1').headers['Last-Modified']
+        response = self.get('/movies/1', **{'If-Modified-Since': last_modified})
+
+        self.assertEqual(response.status_code, 304)
+
+    def test_cache_control_policy(self):
+        self.assertEqual(self.client().get('/').headers['Cache-Control'],
+                         'public, max-age=5')
+        self.assertEqual(self.get('/movies').headers['Cache-Control'],
+                         'private, no-cache')
+        self.app.config['CACHE_CONTROL']['get_movies'] = 'private, max-age=30'
+        self.assertEqual(self.get('/movies').headers['Cache-Control'],
+                         'private, max-age=30')
+
+
+class ReadCacheTestCase(LocalAppTestCase):
+    """Lookups are served from the read-through cache until a write."""
+
+    def setUp(self):
+        super().setUp()
+        self.client().post('/movies', json={'title': 'A', 'release_year': 1},
+                           headers=self.headers('post:movies'))
+
+    def statements_for(self, url):
+        headers = self.headers('get:movies')
+        with self.app.app_context():
+            from models import db
+            with count_statements(db.engine) as statements:
+                response = self.client().get(url, headers=headers)
+        return len(statements), json.loads(response.data)
+
+    def test_repeated_lookup_hits_cache(self):
+        first, _ = self.statements_for('/movies/1')
+        second, data = self.statements_for('/movies/1')
+
+        self.assertEqual(first, 1)
+        self.assertEqual(second, 0)
+        self.assertEqual(data['movie']['title'], 'A')
+
+    def test_write_in_another_worker_expires_with_resource_ttl(self):
+        from models import db
+        self.app.config['READ_CACHE_RESOURCE_TTL'] = 0.05
+        self.statements_for('/movies/1')
+        with self.app.app_context():
+            # Another worker's commit leaves this process's generation alone.
+            with db.engine.begin() as connection:
+                connection.execute(Movie.__table__.update().values(title='B'))
+
+        self.assertEqual(self.statements_for('/movies/1')[1]['movie']['title'], 'A')
+        time.sleep(0.06)
+        self.assertEqual(self.statements_for('/movies/1')[1]['movie']['title'], 'B')
+
+    def test_shared_backend_keeps_the_full_ttl(self):
+        from app import resource_ttl
+        path = os.path.join(tempfile.mkdtemp(), 'cache.db')
+        read_cache.configure(SQLiteBackend(path))
+
+        self.assertIsNone(resource_ttl(self.app))
+        read_cache.configure(MemoryBackend())
+        self.assertEqual(resource_ttl(self.app), 5)
+
+    def test_list_page_hits_cache(self):
+        first, _ = self.statements_for('/movies')
+        second, data = self.statements_for('/movies')
+
+        self.assertLess(second, first)
+        self.assertEqual(len(data['movies']), 1)
+
+    def test_write_invalidates(self):
+        self.statements_for('/movies/1')
+        self.statements_for('/movies')
+        self.client().patch('/movies/1', json={'title': 'B'},
+                            headers=self.headers('patch:movies'))
+
+        self.assertEqual(self.statements_for('/movies/1')[1]['movie']['title'], 'B')
+        self.assertEqual(self.statements_for('/movies')[1]['movies'][0]['title'], 'B')
+
+    def test_missing_resource_is_not_cached(self):
+        response = self.client().get(
+            '/movies/99', headers=self.headers('get:movies'))
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(read_cache.stats()['size'], 0)
+
+
+class CacheBackendTestCase(unittest.TestCase):
+    """Memory and SQLite backends share LRU/TTL and generation semantics."""
+
+    def test_memory_lru_and_ttl(self):
+        backend = MemoryBackend(maxsize=2)
+        backend.set('a', 1, ttl=60)
+        backend.set('b', 2, ttl=60)
+        backend.get('a')
+        backend.set('c', 3, ttl=60)
+
+        self.assertEqual(backend.get('a'), 1)
+        self.assertIsNone(backend.get('b'))
+        backend.set('d', 4, ttl=-1)
+        self.assertIsNone(backend.get('d'))
+
+    def test_invalidation_orphans_namespace(self):
+        cache = ReadThroughCache(MemoryBackend())
+        loads = []
+
+        def loader():
+            loads.append(1)
+            return {'value': len(loads)}
+
+        cache.get_or_load(['movies'], 'k', loader)
+        cache.get_or_load(['movies'], 'k', loader)
+        cache.invalidate('actors')
+        cache.get_or_load(['movies'], 'k', loader)
+        self.assertEqual(len(loads), 1)
+
+        cache.invalidate('movies')
+        self.assertEqual(cache.get_or_load(['movies'], 'k', loader), {'value': 2})
+
+    def test_sqlite_backend_is_shared(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'cache.db')
+            worker_a = ReadThroughCache(SQLiteBackend(path))
+            worker_b = ReadThroughCache(SQLiteBackend(path))
+            worker_a.get_or_load(['movies'], 'k', lambda: {'title': 'A'})
+
+            self.assertEqual(
+                worker_b.get_or_load(['movies'], 'k', lambda: None),
+                {'title': 'A'})
+            worker_a.invalidate('movies')
+            self.assertIsNone(
+                worker_b.get_or_load(['movies'], 'k', lambda: None))
+
+
+class ExportTestCase(LocalAppTestCase):
+    """Exports stream every row without building the response in memory."""
+
+    def setUp(self):
+        super().setUp()
+        import export
+        self.rows = export.EXPORT_BATCH_SIZE * 2 + 5
+        with self.app.app_context():
+            from models import db
+            movies = [Movie(title=f'Movie {i}', release_year=2000)
+                      for i in range(self.rows)]
+            db.session.add_all(movies)
+            db.session.flush()
+            db.session.add(Actor(name='X, Jr.', age=40, gender='Male',
+                                 movie_id=movies[0].id))
+            db.session.commit()
+
+    def test_ndjson_export(self):
+        response = self.client().get(
+            '/movies/export', headers=self.headers('get:movies'),
+            buffered=False)
+        self.assertTrue(response.is_streamed)
+        lines = response.get_data(as_text=True).splitlines()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        self.assertEqual(len(lines), self.rows)
+        self.assertEqual(json.loads(lines[0]),
+                         {'id': 1, 'title': 'Movie 0', 'release_year': 2000})
+        self.assertEqual(json.loads(lines[-1])['id'], self.rows)
+
+    def test_csv_export(self):
+        import csv
+        import io
+        response = self.client().get(
+            '/actors/export?format=csv', headers=self.headers('get:actors'))
+        rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+
+        self.assertEqual(response.mimetype, 'text/csv')
+        self.assertEqual(rows, [['id', 'movie_id', 'name', 'age', 'gender'],
+                                ['1', '1', 'X, Jr.', '40', 'Male']])
+
+    def test_csv_export_batches(self):
+        response = self.client().get(
+            '/movies/export?format=csv', headers=self.headers('get:movies'))
+
+        self.assertEqual(
+            len(response.get_data(as_text=True).splitlines()), self.rows + 1)
+
+    def test_unknown_format(self):
+        response = self.client().get(
+            '/movies/export?format=xml', headers=self.headers('get:movies'))
+
+        self.assertEqual(response.status_code, 400)
+
+
+class ImportCommandTestCase(unittest.TestCase):
+    """flask import-data bulk loads files with the API's validation rules."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.app = create_app({
+            'SQLALCHEMY_DATABASE_URI':
+                f'sqlite:///{self.directory.name}/import.db'})
+        with self.app.app_context():
+            from models import db
+            db.create_all()
+        self.runner = self.app.test_cli_runner()
+
+    def tearDown(self):
+        with self.app.app_context():
+            from models import db
+            db.session.remove()
+            db.drop_all()
+        self.directory.cleanup()
+
+    def write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_import_movies_csv(self):
+        path = self.write('movies.csv', 'title,release_year\n'
+                          'A,2000\nB,2001\nA,2000\nC,soon\n,1999\n')
+        result = self.runner.invoke(
+            args=['import-data', 'movies', path, '--chunk-size', '2'])
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Imported 2 movies', result.output)
+        self.assertIn('2 invalid records rejected', result.output)
+        self.assertIn('rows/sec', result.output)
+        with self.app.app_context():
+            self.assertEqual(
+                sorted(m.title for m in Movie.query), ['A', 'B'])
+
+    def test_import_actors_ndjson(self):
+        with self.app.app_context():
+            from models import db
+            db.session.add(Movie(title='A', release_year=2000))
+            db.session.commit()
+        records = [
+            {'name': 'X', 'age': 30, 'gender': 'Male', 'movie_id': 1},
+            {'name': 'Y', 'age': 31, 'gender': 'Female', 'movie_id': 99},
+            {'name': 'Z', 'gender': 'Female', 'movie_id': 1},
+        ]
+        lines = [json.dumps(r) for r in records] + ['{"name": "W", "age']
+        path = self.write('actors.ndjson', '\n'.join(lines))
+        result = self.runner.invoke(args=['import-data', 'actors', path])
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Imported 1 actors', result.output)
+        self.assertIn('2 invalid records rejected', result.output)
+        self.assertIn('record 4: Unterminated string', result.output)
+        with self.app.app_context():
+            actor = Actor.query.one()
+            self.assertEqual((actor.name, actor.version), ('X', 1))
+
+    def test_import_invalidates_cached_reads(self):
+        from models import CollectionVersion
+        path = self.write('movies.ndjson', '{"title": "A", "release_year": 1}')
+        with self.app.app_context():
+            self.runner.invoke(args=['import-data', 'movies', path])
+            self.assertEqual(CollectionVersion.get('movies')[0].version, 1)
+
+
+class DuplicateDetectionTestCase(LocalAppTestCase):
+    """Duplicates are rejected by unique constraints, not probe queries."""
+
+    def test_duplicate_movie(self):
+        headers = self.headers('post:movies')
+        movie = {'title': 'A', 'release_year': 2000}
+        first = self.client().post('/movies', json=movie, headers=headers)
+        second = self.client().post('/movies', json=movie, headers=headers)
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 409)
+        with self.app.app_context():
+            self.assertEqual(Movie.query.count(), 1)
+
+    def test_duplicate_actor(self):
+        self.client().post('/movies', json={'title': 'A', 'release_year': 1},
+                           headers=self.headers('post:movies'))
+        headers = self.headers('post:actors')
+        actor = {'name': 'X', 'age': 30, 'gender': 'Male', 'movie_id': 1}
+        first = self.client().post('/actors', json=actor, headers=headers)
+        second = self.client().post('/actors', json=actor, headers=headers)
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 409)
+
+    def test_update_into_duplicate(self):
+        headers = self.headers('post:movies', 'patch:movies', 'post:actors',
+                               'patch:actors')
+        for title in ('A', 'B'):
+            self.client().post('/movies', headers=headers,
+                               json={'title': title, 'release_year': 2000})
+        for name in ('X', 'Y'):
+            self.client().post('/actors', headers=headers, json={
+                'name': name, 'age': 30, 'gender': 'Male', 'movie_id': 1})
+
+        movie = self.client().patch('/movies/2', json={'title': 'A'},
+                                    headers=headers)
+        actor = self.client().patch('/actors/2', headers=headers,
+                                    json={'name': 'X', 'movie_id': 1})
+
+        self.assertEqual(movie.status_code, 409)
+        self.assertEqual(actor.status_code, 409)
+        with self.app.app_context():
+            self.assertEqual(Movie.query.get(2).title, 'B')
+
+
+class BatchTestCase(LocalAppTestCase):
+    """Batch endpoints write many rows per transaction with per-item results."""
+
+    def test_create_movies(self):
+        movies = [{'title': f'Movie {i}', 'release_year': 2000 + i}
+                  for i in range(5)]
+        movies += [{'title': 'Movie 0', 'release_year': 2000},
+                   {'title': 42, 'release_year': 'soon'}]
+        response = self.client().post(
+            '/movies/batch', json={'movies': movies},
+            headers=self.headers('post:movies'))
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r['success'] for r in data['results']],
+                         [True] * 5 + [False, False])
+        self.assertEqual(data['results'][5]['error'], 409)
+        self.assertEqual(data['results'][6]['error'], 422)
+        self.assertEqual(data['results'][4]['movie']['title'], 'Movie 4')
+
+    def test_create_skips_existing(self):
+        headers = self.headers('post:movies')
+        self.client().post('/movies', json={'title': 'A', 'release_year': 1},
+                           headers=headers)
+        response = self.client().post(
+            '/movies/batch', headers=headers,
+            json={'movies': [{'title': 'A', 'release_year': 1},
+                             {'title': 'B', 'release_year': 2}]})
+        data = json.loads(response.data)
+
+        self.assertEqual(data['results'][0]['error'], 409)
+        self.assertTrue(data['results'][1]['success'])
+
+    def test_update_and_delete_movies(self):
+        self.client().post(
+            '/movies/batch', headers=self.headers('post:movies'),
+            json={'movies': [{'title': 'A', 'release_year': 1},
+                             {'title': 'B', 'release_year': 2}]})
+        response = self.client().patch(
+            '/movies/batch', headers=self.headers('patch:movies'),
+            json={'movies': [{'id': 1, 'title': 'A2'}, {'id': 99}]})
+        data = json.loads(response.data)
+        self.assertEqual(data['results'][0]['movie']['title'], 'A2')
+        self.assertEqual(data['results'][1]['error'], 404)
+
+        response = self.client().delete(
+            '/movies/batch', headers=self.headers('delete:movies'),
+            json={'ids': [1, 2, 2]})
+        data = json.loads(response.data)
+        self.assertEqual([r['success'] for r in data['results']],
+                         [True, True, False])
+        with self.app.app_context():
+            self.assertEqual(Movie.query.count(), 0)
+
+    def test_create_actors(self):
+        self.client().post('/movies', json={'title': 'A', 'release_year': 1},
+                           headers=self.headers('post:movies'))
+        actors = [{'name': f'Actor {i}', 'age': 30, 'gender': 'Female',
+                   'movie_id': 1} for i in range(3)]
+        response = self.client().post(
+            '/actors/batch', json={'actors': actors + [{'name': 'X'}]},
+            headers=self.headers('post:actors'))
+        data = json.loads(response.data)
+
+        self.assertEqual([r['success'] for r in data['results']],
+                         [True, True, True, False])
+
+    def test_non_scalar_fields_are_rejected(self):
+        self.client().post('/movies', json={'title': 'A', 'release_year': 1},
+                           headers=self.headers('post:movies'))
+        headers = self.headers('post:actors')
+        actors = [{'name': ['X'], 'age': 30, 'gender': 'Male', 'movie_id': 1},
+                  {'name': 'Y', 'age': '30', 'gender': 'Male', 'movie_id': 1},
+                  {'name': 'Z', 'age': 30, 'gender': {}, 'movie_id': 1},
+                  {'name': 'W', 'age': 30, 'gender': 'Male', 'movie_id': 1}]
+        response = self.client().post('/actors/batch', headers=headers,
+                                      json={'actors': actors})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r.get('error') for r in response.get_json()['results']],
+                         [422, 422, 422, None])
+        for body in (actors[0], ['not', 'an', 'object']):
+            with self.subTest(body=body):
+                self.assertEqual(self.client().post(
+                    '/actors', headers=headers, json=body).status_code, 422)
+        self.assertEqual(self.client().post(
+            '/movies', headers=self.headers('post:movies'),
+            json=['not', 'an', 'object']).status_code, 422)
+
+    def test_update_into_existing_key_conflicts(self):
+        self.client().post(
+            '/movies/batch', headers=self.headers('post:movies'),
+            json={'movies': [{'title': 'A', 'release_year': 1},
+                             {'title': 'B', 'release_year': 1},
+                             {'title': 'C', 'release_year': 1}]})
+        response = self.client().patch(
+            '/movies/batch', headers=self.headers('patch:movies'),
+            json={'movies': [{'id': 2, 'title': 'A'},
+                             {'id': 3, 'title': 'D'}]})
+        data = json.loads(response.data)
+
+        self.assertEqual(data['results'][0]['error'], 409)
+        self.assertTrue(data['results'][1]['success'])
+
+    def test_rejects_oversized_batch(self):
+        import app as app_module
+        movies = [{'title': 'A', 'release_year': 1}] * (
+            app_module.MAX_BATCH_SIZE + 1)
+        response = self.client().post(
+            '/movies/batch', json={'movies': movies},
+            headers=self.headers('post:movies'))
+
+        self.assertEqual(response.status_code, 400)
+
+
+HOT_QUERIES = {
+    'movie by id': lambda: Movie.query.filter(Movie.id == 1),
+    'movie by title': lambda: Movie.query.filter(Movie.title == 'A'),
+    'movie by title and year': lambda: Movie.query.filter(
+        Movie.title == 'A', Movie.release_year == 2000),
+    'movies after cursor': lambda: Movie.query.filter(
+        Movie.id > 10).order_by(Movie.id).limit(10),
+    'actor by id': lambda: Actor.query.filter(Actor.id == 1),
+    'actor by name': lambda: Actor.query.filter(Actor.name == 'A'),
+    'actors by movie': lambda: Actor.query.filter(Actor.movie_id == 1),
+    'actors after cursor': lambda: Actor.query.filter(
+        Actor.id > 10).order_by(Actor.id).limit(10),
+    'movies by title prefix': lambda: Movie.query.filter(
+        prefix_match(Movie.title, 'The G')),
+    'movies by release year range': lambda: Movie.query.filter(
+        Movie.release_year >= 1990, Movie.release_year <= 1999),
+    'movies by title search': lambda: Movie.query.filter(
+        text_search(Movie, 'father')),
+    'actors by name prefix': lambda: Actor.query.filter(
+        prefix_match(Actor.name, 'To')),
+    'actors by age range': lambda: Actor.query.filter(
+        Actor.age >= 30, Actor.age <= 40),
+    'actors by name search': lambda: Actor.query.filter(
+        text_search(Actor, 'anks')),
+}
+
+
+class QueryPlanTestCase(unittest.TestCase):
+    """Hot queries must be served by an index, never a full table scan."""
+
+    database_path = 'sqlite://'
+
+    def setUp(self):
+        if not self.database_path:
+            self.skipTest('no database configured')
+        self.app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path})
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        from models import db
+        self.db = db
+        db.create_all()
+
+    def tearDown(self):
+        self.db.session.remove()
+        self.db.drop_all()
+        self.ctx.pop()
+
+    def explain(self, query):
+        engine = self.db.engine
+        sql = str(query.statement.compile(
+            dialect=engine.dialect, compile_kwargs={'literal_binds': True}))
+        with engine.connect() as connection:
+            rows = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {sql}')
+            return [row[-1] for row in rows]
+
+    def is_full_scan(self, step):
+        # FTS5 lookups show up as "SCAN x_fts VIRTUAL TABLE INDEX 0:M1";
+        # the M means the MATCH constraint was pushed into the index.
+        if 'VIRTUAL TABLE INDEX' in step:
+            return ':M' not in step
+        return step.startswith('SCAN ') and ' USING ' not in step
+
+    def test_hot_queries_use_indexes(self):
+        for name, build in HOT_QUERIES.items():
+            with self.subTest(query=name):
+                plan = self.explain(build())
+                self.assertFalse(any(self.is_full_scan(step) for step in plan),
+                                 f'{name} scans a table: {plan}')
+
+
+class PostgresQueryPlanTestCase(QueryPlanTestCase):
+    """Same checks against TEST_POSTGRES_URL, with sequential scans priced out."""
+
+    database_path = os.environ.get('TEST_POSTGRES_URL')
+
+    def explain(self, query):
+        engine = self.db.engine
+        sql = str(query.statement.compile(
+            dialect=engine.dialect, compile_kwargs={'literal_binds': True}))
+        with engine.connect() as connection:
+            connection.exec_driver_sql('SET enable_seqscan = off')
+            rows = connection.exec_driver_sql(f'EXPLAIN {sql}')
+            return [row[0] for row in rows]
+
+    def is_full_scan(self, step):
+        return 'Seq Scan' in step
+
+
+class EngineOptionsTestCase(unittest.TestCase):
+    """Pool settings come from DB_* variables or test_config."""
+
+    def test_postgres_options_from_environment(self):
+        from models import engine_options
+        options = engine_options('postgresql://db/app', {
+            'DB_POOL_SIZE': '20', 'DB_MAX_OVERFLOW': '0',
+            'DB_POOL_RECYCLE': '300', 'DB_POOL_PRE_PING': 'false',
+            'DB_STATEMENT_TIMEOUT_MS': '5000'})
+
+        self.assertEqual(options['pool_size'], 20)
+        self.assertEqual(options['max_overflow'], 0)
+        self.assertEqual(options['pool_recycle'], 300)
+        self.assertFalse(options['pool_pre_ping'])
+        self.assertEqual(options['connect_args']['options'],
+                         '-c statement_timeout=5000')
+
+    def test_sqlite_skips_pool_sizing(self):
+        from models import engine_options
+        options = engine_options('sqlite:///app.db', {'DB_POOL_SIZE': '20'})
+
+        self.assertEqual(options, {'pool_pre_ping': True})
+
+    def test_test_config_overrides_and_pool_stats(self):
+        from sqlalchemy.pool import QueuePool
+        from models import db, pool_stats
+        with tempfile.TemporaryDirectory() as directory:
+            app = create_app({
+                'SQLALCHEMY_DATABASE_URI': f'sqlite:///{directory}/pool.db',
+                'SQLALCHEMY_ENGINE_OPTIONS': {
+                    'poolclass': QueuePool, 'pool_size': 2},
+            })
+            with app.app_context():
+                self.assertTrue(
+                    app.config['SQLALCHEMY_ENGINE_OPTIONS']['pool_pre_ping'])
+                with db.engine.connect():
+                    stats = pool_stats()
+                db.engine.dispose()
+
+        self.assertEqual(stats['size'], 2)
+        self.assertEqual(stats['checked_out'], 1)
+
+    def test_connections_are_not_shared_across_fork(self):
+        from sqlalchemy import create_engine
+        from sqlalchemy.pool import QueuePool
+        with tempfile.TemporaryDirectory() as directory:
+            engine = create_engine(f'sqlite:///{directory}/fork.db',
+                                   poolclass=QueuePool)
+            with engine.connect() as connection:
+                inherited = connection.connection.dbapi_connection
+                connection.connection._connection_record.info['pid'] = -1
+            with engine.connect() as connection:
+                fresh = connection.connection.dbapi_connection
+            engine.dispose()
+
+        self.assertIsNot(inherited, fresh)
+
+
+class StartupTestCase(unittest.TestCase):
+    """Importing the app and building it must not touch the database."""
+
+    def test_create_app_issues_no_statements(self):
+        from sqlalchemy.engine import Engine
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(Engine, 'before_cursor_execute', record)
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                app = create_app({
+                    'SQLALCHEMY_DATABASE_URI': f'sqlite:///{directory}/boot.db'})
+                with app.app_context():
+                    from models import db
+                    inspector = db.inspect(db.engine)
+                    tables = inspector.get_table_names()
+                    db.engine.dispose()
+        finally:
+            event.remove(Engine, 'before_cursor_execute', record)
+
+        self.assertEqual(tables, [])
+        self.assertFalse([s for s in statements if 'CREATE' in s.upper()])
+
+    def test_module_app_is_built_lazily(self):
+        import app as app_module
+        self.assertNotIn('app', vars(app_module))
+
+
+class ReplicaRoutingTestCase(LocalAppTestCase):
+    """GET views read from replicas; writers keep reading the primary."""
+
+    READ_CACHE_URL = 'none'
+
+    def setUp(self):
+        from models import db
+        self.directory = tempfile.TemporaryDirectory()
+        self.paths = [f'{self.directory.name}/{name}.db'
+                      for name in ('primary', 'replica_0', 'replica_1')]
+        self.app = create_app({
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{self.paths[0]}',
+            'SQLALCHEMY_REPLICA_URIS': [f'sqlite:///{path}'
+                                        for path in self.paths[1:]],
+            'READ_CACHE_URL': self.READ_CACHE_URL,
+            'AUTH0_DOMAIN': 'example.auth0.com',
+            'API_AUDIENCE': 'fsnd-image',
+        })
+        self.client = self.app.test_client
+        self.replicas = self.app.extensions['replicas']
+        with self.app.app_context():
+            for bind in (None, 'replica_0', 'replica_1'):
+                engine = db.get_engine(self.app, bind=bind)
+                db.Model.metadata.create_all(engine)
+                with engine.begin() as connection:
+                    connection.execute(Movie.__table__.insert().values(
+                        title=bind or 'primary', release_year=2000))
+
+    def tearDown(self):
+        from models import db
+        with self.app.app_context():
+            db.session.remove()
+            for bind in (None, 'replica_0', 'replica_1'):
+                db.get_engine(self.app, bind=bind).dispose()
+        self.directory.cleanup()
+
+    def served_by(self, client=None, **headers):
+        response = (client or self.client()).get(
+            '/movies', headers={**self.headers('get:movies'), **headers})
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()['movies'][0]['title']
+
+    def test_reads_round_robin_over_replicas(self):
+        self.assertEqual(
+            [self.served_by() for _ in range(4)],
+            ['replica_0', 'replica_1', 'replica_0', 'replica_1'])
+
+    def test_writes_go_to_primary_and_pin_reads(self):
+        client = self.client()
+        response = client.post('/movies', headers=self.headers('post:movies'),
+                               json={'title': 'Written', 'release_year': 2001})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('read_primary_until', response.headers['Set-Cookie'])
+        self.assertEqual(self.served_by(client), 'primary')
+        self.assertTrue(self.served_by().startswith('replica'))
+
+    def test_header_forces_primary(self):
+        self.assertEqual(self.served_by(**{'X-Read-Primary': '1'}), 'primary')
+
+    def test_lagging_replica_is_skipped(self):
+        self.replicas.measure_lag = lambda engine: (
+            60 if engine.url.database == self.paths[1] else 0)
+
+        self.assertEqual({self.served_by() for _ in range(3)}, {'replica_1'})
+
+    def test_falls_back_to_primary_when_no_replica_is_usable(self):
+        from sqlalchemy.exc import OperationalError
+
+        def unavailable(engine):
+            raise OperationalError('SELECT 1', {}, Exception('down'))
+        self.replicas.measure_lag = unavailable
+
+        self.assertEqual(self.served_by(), 'primary')
+        self.assertFalse(self.replicas.stats()['replica_0']['healthy'])
+
+
+class CachedReplicaRoutingTestCase(ReplicaRoutingTestCase):
+    """Replica routing with the read-through cache enabled."""
+
+    READ_CACHE_URL = 'memory'
+
+    def get_title(self, client, **headers):
+        response = client.get('/movies/1',
+                              headers={**self.headers('get:movies'), **headers})
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()['movie']['title']
+
+    def test_replica_read_does_not_hide_own_write(self):
+        writer = self.client()
+        response = writer.patch('/movies/1', headers=self.headers('patch:movies'),
+                                json={'title': 'Renamed'})
+        self.assertEqual(response.status_code, 200)
+
+        # The replicas never see the rename, like replicas that lag behind.
+        self.assertTrue(self.get_title(self.client()).startswith('replica'))
+        self.assertEqual(self.get_title(writer), 'Renamed')
+
+    def test_primary_reads_fill_the_cache(self):
+        from cache import read_cache
+        self.get_title(self.client(), **{'X-Read-Primary': '1'})
+        self.get_title(self.client())
+        self.assertEqual(read_cache.stats()['size'], 0)
+
+        self.replicas.check_interval = 0
+        self.replicas.measure_lag = lambda engine: 60
+        self.assertEqual(self.get_title(self.client()), 'primary')
+        self.assertEqual(read_cache.stats()['size'], 1)
+
+
+@unittest.skipIf(TestClient is None, 'starlette/aiosqlite not installed')
+class AsyncAppTestCase(unittest.TestCase):
+    """The ASGI app serves the same routes on async SQLAlchemy."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.issuer = LocalIssuer()
+        auth.async_jwks_cache.set_fetcher(as_async(cls.issuer.fetcher()))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.issuer.close()
+
+    def setUp(self):
+        from sqlalchemy import create_engine
+        from models import db
+        self.directory = tempfile.TemporaryDirectory()
+        self.database_url = f'sqlite:///{self.directory.name}/async.db'
+        engine = create_engine(self.database_url)
+        db.Model.metadata.create_all(engine)
+        engine.dispose()
+        self.client = self.make_client()
+
+    def make_client(self, **config):
+        from asgi import create_asgi_app
+        client = TestClient(create_asgi_app({
+            'SQLALCHEMY_DATABASE_URI': self.database_url,
+            'READ_CACHE_URL': 'none',
+            'AUTH0_DOMAIN': 'example.auth0.com',
+            'API_AUDIENCE': 'fsnd-image',
+            **config,
+        }))
+        client.__enter__()
+        return client
+
+    def tearDown(self):
+        self.client.__exit__(None, None, None)
+        self.directory.cleanup()
+
+    def headers(self, *permissions, **claims):
+        token = self.issuer.token(permissions, **claims)
+        return {'Authorization': f'Bearer {token}'}
+
+    def test_crud_round_trip(self):
+        response = self.client.post(
+            '/movies', headers=self.headers('post:movies'),
+            json={'title': 'Async', 'release_year': 2024})
+        self.assertEqual(response.status_code, 200)
+        movie_id = response.json()['movie']['id']
+
+        response = self.client.post(
+            '/actors', headers=self.headers('post:actors'),
+            json={'name': 'A', 'age': 30, 'gender': 'F', 'movie_id': movie_id})
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.patch(
+            f'/movies/{movie_id}', headers=self.headers('patch:movies'),
+            json={'title': 'Renamed'})
+        self.assertEqual(response.json()['movie']['title'], 'Renamed')
+
+        response = self.client.get(f'/movies/{movie_id}?include=actors',
+                                   headers=self.headers('get:movies'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['movie']['actors'][0]['name'], 'A')
+
+        response = self.client.get('/actors?include=movie&count=true',
+                                   headers=self.headers('get:actors'))
+        body = response.json()
+        self.assertEqual(body['total'], 1)
+        self.assertEqual(body['actors'][0]['movie']['title'], 'Renamed')
+
+    def test_writes_maintain_stats_summary(self):
+        self.client.__exit__(None, None, None)
+        self.client = self.make_client(STATS_SUMMARY=True)
+        everything = self.headers('post:movies', 'post:actors',
+                                  'patch:actors', 'delete:movies')
+        for title in ('A', 'B', 'C'):
+            self.client.post('/movies', headers=everything,
+                             json={'title': title, 'release_year': 2024})
+        for name, movie_id in (('X', 1), ('Y', 1), ('Z', 2)):
+            self.client.post('/actors', headers=everything, json={
+                'name': name, 'age': 30, 'gender': 'F', 'movie_id': movie_id})
+        self.client.patch('/actors/2', headers=everything,
+                          json={'age': 52, 'movie_id': 2})
+        self.client.delete('/movies/3', headers=everything)
+
+        app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_url})
+        with app.app_context():
+            self.assertEqual(movie_stats(True)['total'], 2)
+            self.assertEqual((movie_stats(True), actor_stats(True)),
+                             (movie_stats(), actor_stats()))
+
+    def test_errors_match_the_wsgi_app(self):
+        self.client.post('/movies', headers=self.headers('post:movies'),
+                         json={'title': 'Twice', 'release_year': 2024})
+        cases = [
+            ('get', '/movies', {}, None, 401),
+            ('get', '/movies', self.headers('get:actors'), None, 403),
+            ('get', '/movies/999', self.headers('get:movies'), None, 404),
+            ('get', '/movies?limit=0', self.headers('get:movies'), None, 400),
+            ('get', '/movies?title=A', self.headers('get:movies'), None, 400),
+            ('get', '/?fields=title', {}, None, 400),
+            ('get', '/movies/1?fields=title', self.headers('get:movies'),
+             None, 400),
+            ('get', '/actors?gender=Female', self.headers('get:actors'),
+             None, 400),
+            ('get', '/actors?q=abc', self.headers('get:actors'), None, 400),
+            ('post', '/movies', self.headers('post:movies'),
+             {'title': 'Twice', 'release_year': 2024}, 409),
+            ('post', '/movies', self.headers('post:movies'),
+             {'title': 1}, 422),
+        ]
+        for method, url, headers, body, status in cases:
+            with self.subTest(method=method, url=url, status=status):
+                kwargs = {'json': body} if body is not None else {}
+                response = getattr(self.client, method)(
+                    url, headers=headers, **kwargs)
+                self.assertEqual(response.status_code, status)
+                self.assertFalse(response.json()['success'])
+
+
+class PermissionsTestCase(unittest.TestCase):
+    """Permissions and scope are merged into one frozen set per token."""
+
+    def test_merges_permissions_and_scope(self):
+        permissions = auth.get_permissions({
+            'permissions': ['get:movies'], 'scope': 'get:actors openid'})
+
+        self.assertEqual(permissions,
+                         frozenset({'get:movies', 'get:actors', 'openid'}))
+
+    def test_missing_claims(self):
+        with self.assertRaises(auth.AuthError) as context:
+            auth.check_permissions('get:movies', {'sub': 'a'})
+
+        self.assertEqual(context.exception.status_code, 400)
+
+    def test_single_permission(self):
+        payload = {'permissions': ['get:movies']}
+
+        self.assertTrue(auth.check_permissions('get:movies', payload))
+        with self.assertRaises(auth.AuthError) as context:
+            auth.check_permissions('delete:movies', payload)
+        self.assertEqual(context.exception.status_code, 403)
+
+    def test_all_of_and_any_of(self):
+        permissions = frozenset({'get:movies', 'get:actors'})
+
+        self.assertTrue(auth.check_permissions(
+            frozenset({'get:movies', 'get:actors'}), {}, permissions))
+        self.assertTrue(auth.check_permissions(
+            frozenset(), {}, permissions,
+            any_of=frozenset({'post:movies', 'get:actors'})))
+        with self.assertRaises(auth.AuthError):
+            auth.check_permissions(
+                frozenset(), {}, permissions,
+                any_of=frozenset({'post:movies', 'delete:movies'}))
+
+
+class TokenCacheTestCase(unittest.TestCase):
+    """Verified payloads are cached until the token's exp claim."""
+
+    def test_hit_and_miss(self):
+        cache = TokenCache()
+        self.assertIsNone(cache.get('token'))
+        cache.set('token', {'sub': 'a'})
+
+        self.assertEqual(cache.get('token'), {'sub': 'a'})
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_respects_exp_claim(self):
+        cache = TokenCache(ttl=300)
+        cache.set('token', {'sub': 'a'}, exp=time.time() - 1)
+
+        self.assertIsNone(cache.get('token'))
+
+    def test_evicts_least_recently_used(self):
+        cache = TokenCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.stats()['size'], 2)
+
+
 if __name__ == "__main__":
     unittest.main()